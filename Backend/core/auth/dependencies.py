@@ -2,13 +2,20 @@
 Firebase Authentication Dependencies
 Centralized auth logic for all routes
 """
-from fastapi import HTTPException, Request
-from typing import Dict, Any
+from fastapi import Depends, HTTPException, Request
+from typing import Annotated, Dict, Any
+import hmac
+import os
 import firebase_admin
 from firebase_admin import auth as fb_auth
+from core.auth.verifier import verify_id_token_async, TokenVerifierBusy, TokenVerifierTimeout
+from core.user_management.user_cache import get_cached_user, cache_user
 
+# /metrics: mở khi DEBUG, hoặc với header "Authorization: Bearer <METRICS_TOKEN>" nếu có đặt token
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
 
-def get_current_user(request: Request) -> Dict[str, Any]:
+
+async def get_current_user(request: Request) -> Dict[str, Any]:
     """
     Verify Firebase ID token and return decoded user info
     """
@@ -22,9 +29,12 @@ def get_current_user(request: Request) -> Dict[str, Any]:
     print(f"🎫 ID token extracted (first 20 chars): {id_token[:20]}...")
 
     try:
-        decoded = fb_auth.verify_id_token(id_token, check_revoked=True)
+        decoded = await verify_id_token_async(id_token, check_revoked=True)
         print(f"✅ Token verified successfully. User: {decoded.get('email', 'unknown')}")
         return decoded
+    except (TokenVerifierBusy, TokenVerifierTimeout) as e:
+        print(f"❌ Token verification unavailable: {e}")
+        raise HTTPException(status_code=503, detail="Authentication service busy, please retry")
     except fb_auth.ExpiredIdTokenError:
         print("❌ Token expired")
         raise HTTPException(status_code=401, detail="Token expired")
@@ -36,6 +46,48 @@ def get_current_user(request: Request) -> Dict[str, Any]:
         raise HTTPException(status_code=401, detail=f"Invalid token: {e}")
 
 
+async def resolve_current_user(decoded: Dict[str, Any], request: Request = None) -> Dict[str, Any]:
+    """
+    Resolve the Mongo user document for a verified token.
+    Memoized on request.state and in the process-wide uid cache, so one request costs at most one lookup
+    """
+    if request is not None:
+        user = getattr(request.state, "current_user", None)
+        if user is not None:
+            return user
+
+    uid = decoded.get("uid")
+    user = get_cached_user(uid) if uid else None
+    if user is None:
+        user = await get_user_by_email(extract_user_email(decoded))
+        cache_user(uid, user)
+
+    if request is not None:
+        request.state.current_user = user
+    return user
+
+
+async def get_current_user_doc(request: Request, decoded: Dict[str, Any] = Depends(get_current_user)) -> Dict[str, Any]:
+    """
+    Dependency: Mongo user document of the caller (404 if the user has no profile yet)
+    """
+    return await resolve_current_user(decoded, request)
+
+
+CurrentUser = Annotated[Dict[str, Any], Depends(get_current_user_doc)]
+
+
+async def get_current_uid(decoded: Dict[str, Any] = Depends(get_current_user)) -> str:
+    """
+    Dependency: Firebase uid of the caller - the key of the user cache, so writes to the
+    caller's users document can invalidate_user() it even when the doc has no firebase_uid
+    """
+    return decoded.get("uid")
+
+
+CurrentUid = Annotated[str, Depends(get_current_uid)]
+
+
 async def get_user_by_email(user_email: str):
     """
     Helper function to get user from database by email
@@ -56,3 +108,25 @@ def extract_user_email(decoded: Dict[str, Any]) -> str:
     if not email:
         raise HTTPException(status_code=400, detail="Email not found in token")
     return email
+
+
+def require_metrics_access(request: Request) -> None:
+    """
+    Dependency cho /metrics: chỉ DEBUG hoặc đúng METRICS_TOKEN (không dùng Firebase token,
+    để hệ thống monitor không cần tài khoản user)
+    """
+    if os.getenv("DEBUG", "False").lower() == "true":
+        return
+    auth_header = request.headers.get("Authorization", "")
+    if METRICS_TOKEN and hmac.compare_digest(auth_header.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        return
+    raise HTTPException(status_code=403, detail="Metrics access denied")
+
+
+def require_debug() -> None:
+    """
+    Dependency cho các endpoint /admin (migration, backfill, reindex): giống main_async,
+    chỉ mở khi DEBUG
+    """
+    if os.getenv("DEBUG", "False").lower() != "true":
+        raise HTTPException(status_code=403, detail="Only available in debug mode")
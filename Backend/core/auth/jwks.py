@@ -0,0 +1,206 @@
+"""
+Local Firebase ID token verifier
+Keeps Google's securetoken signing certificates in memory, refreshes them in a
+background task according to their Cache-Control max-age, and checks RS256
+signatures + Firebase claims without any per-request I/O.
+
+Note: revocation (check_revoked) needs the Admin API and is not checked here.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, Optional
+
+import requests
+from jose import jwt, JWTError, ExpiredSignatureError
+from firebase_admin import auth as fb_auth
+
+
+GOOGLE_CERTS_URL = os.getenv(
+    "FIREBASE_CERTS_URL",
+    "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com",
+)
+CLOCK_SKEW_SECONDS = int(os.getenv("AUTH_CLOCK_SKEW_SECONDS", "60"))
+# How long past their max-age the certificates are still trusted while refreshes keep failing
+MAX_CERT_STALENESS_SECONDS = int(os.getenv("AUTH_MAX_CERT_STALENESS_SECONDS", "21600"))
+MIN_REFRESH_SECONDS = 60
+RETRY_SECONDS = 30
+
+logger = logging.getLogger(__name__)
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class SigningKeysUnavailable(Exception):
+    """Raised when no signing certificates are loaded, or the loaded ones are too stale to trust"""
+
+
+def parse_max_age(cache_control: Optional[str], default: int = 3600) -> int:
+    if not cache_control:
+        return default
+    m = _MAX_AGE_RE.search(cache_control)
+    return int(m.group(1)) if m else default
+
+
+class LocalTokenVerifier:
+    """Verify Firebase ID tokens against an in-memory copy of Google's certificates"""
+
+    def __init__(
+        self,
+        project_id: Optional[str] = None,
+        certs_url: str = GOOGLE_CERTS_URL,
+        max_staleness: int = MAX_CERT_STALENESS_SECONDS,
+    ):
+        self.project_id = project_id or os.getenv("FIREBASE_PROJECT_ID")
+        self.certs_url = certs_url
+        self.max_staleness = max_staleness
+        self._certs: Dict[str, str] = {}
+        self._expires_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._refresh_lock = asyncio.Lock()
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    @property
+    def issuer(self) -> str:
+        return f"https://securetoken.google.com/{self.project_id}"
+
+    # ---------- key management ----------
+
+    def load_certificates(self, certs: Dict[str, str], max_age: int) -> None:
+        """Replace the key set ({kid: PEM certificate}) in one assignment"""
+        self._certs = dict(certs)
+        self._expires_at = time.time() + max_age
+
+    def _fetch(self):
+        resp = requests.get(self.certs_url, timeout=10)
+        resp.raise_for_status()
+        return resp.json(), parse_max_age(resp.headers.get("Cache-Control"))
+
+    async def refresh(self) -> int:
+        """Fetch the current certificates; returns the max-age reported by Google"""
+        async with self._refresh_lock:
+            try:
+                certs, max_age = await asyncio.to_thread(self._fetch)
+            except Exception:
+                self.refresh_failures += 1
+                raise
+            self.load_certificates(certs, max_age)
+            self.refreshes += 1
+            logger.info(f"Loaded {len(certs)} Firebase signing certs (max-age={max_age}s)")
+            return max_age
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                max_age = await self.refresh()
+                delay = max(max_age, MIN_REFRESH_SECONDS)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Firebase cert refresh failed: {e}")
+                delay = RETRY_SECONDS
+            await asyncio.sleep(delay)
+
+    async def start(self):
+        """Load the keys once, then keep them fresh in the background"""
+        if self._task and not self._task.done():
+            return
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.warning(f"Initial Firebase cert fetch failed: {e}")
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _schedule_refresh(self):
+        # Unknown kid usually means Google rotated keys before our max-age ran out
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if not self._refresh_lock.locked():
+            loop.create_task(self._refresh_quietly())
+
+    async def _refresh_quietly(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.warning(f"On-demand Firebase cert refresh failed: {e}")
+
+    # ---------- verification ----------
+
+    def verify(self, id_token: str) -> Dict[str, Any]:
+        """
+        Verify signature and claims; returns the decoded claims with `uid` set like firebase_admin.
+        Raises firebase_admin's ExpiredIdTokenError / InvalidIdTokenError so callers handle both verifiers alike.
+        """
+        if not self._certs:
+            raise SigningKeysUnavailable("Firebase signing certificates not loaded")
+        if time.time() > self._expires_at + self.max_staleness:
+            # Refreshes have been failing for too long: a rotated-out key may already be compromised
+            self._schedule_refresh()
+            raise SigningKeysUnavailable("Firebase signing certificates are stale")
+        if not self.project_id:
+            raise fb_auth.InvalidIdTokenError("FIREBASE_PROJECT_ID is not configured")
+
+        try:
+            header = jwt.get_unverified_header(id_token)
+        except JWTError as e:
+            raise fb_auth.InvalidIdTokenError(f"Malformed token: {e}", cause=e)
+
+        if header.get("alg") != "RS256":
+            raise fb_auth.InvalidIdTokenError("Token must be signed with RS256")
+        cert = self._certs.get(header.get("kid"))
+        if cert is None:
+            self._schedule_refresh()
+            raise fb_auth.InvalidIdTokenError("Token signed with an unknown key id")
+
+        try:
+            claims = jwt.decode(
+                id_token,
+                cert,
+                algorithms=["RS256"],
+                audience=self.project_id,
+                issuer=self.issuer,
+                options={"leeway": CLOCK_SKEW_SECONDS},
+            )
+        except ExpiredSignatureError as e:
+            raise fb_auth.ExpiredIdTokenError("Token expired", cause=e)
+        except JWTError as e:
+            raise fb_auth.InvalidIdTokenError(f"Invalid token: {e}", cause=e)
+
+        sub = claims.get("sub")
+        if not isinstance(sub, str) or not sub or len(sub) > 128:
+            raise fb_auth.InvalidIdTokenError("Token has an invalid subject")
+        now = time.time()
+        for claim in ("iat", "auth_time"):
+            value = claims.get(claim)
+            if value is not None and value > now + CLOCK_SKEW_SECONDS:
+                raise fb_auth.InvalidIdTokenError(f"Token {claim} is in the future")
+
+        claims["uid"] = sub
+        return claims
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "keys": len(self._certs),
+            "expires_in": max(int(self._expires_at - time.time()), 0),
+            "stale": bool(self._certs) and time.time() > self._expires_at + self.max_staleness,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+        }
+
+
+# Shared instance for the whole process
+local_verifier = LocalTokenVerifier()
@@ -0,0 +1,102 @@
+"""
+Verified Firebase ID token cache
+Keeps decoded tokens in-process so repeated requests with the same bearer
+token skip the Firebase round trip
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+# Re-verify (and re-check revocation) at least this often, even if the token is still valid
+TOKEN_RECHECK_SECONDS = int(os.getenv("AUTH_TOKEN_RECHECK_SECONDS", "300"))
+
+
+def _token_key(id_token: str) -> str:
+    return hashlib.sha256(id_token.encode("utf-8")).hexdigest()
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of decoded tokens keyed by the SHA-256 of the raw token.
+    An entry expires at the token's `exp` or after `recheck_seconds`, whichever comes first.
+    """
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE, recheck_seconds: int = TOKEN_RECHECK_SECONDS):
+        self.max_size = max_size
+        self.recheck_seconds = recheck_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.recheck_seconds > 0
+
+    def get(self, id_token: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        key = _token_key(id_token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, decoded = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return decoded
+
+    def put(self, id_token: str, decoded: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        now = time.time()
+        expires_at = now + self.recheck_seconds
+        token_exp = decoded.get("exp")
+        if isinstance(token_exp, (int, float)):
+            expires_at = min(expires_at, float(token_exp))
+        if expires_at <= now:
+            return
+        key = _token_key(id_token)
+        with self._lock:
+            self._entries[key] = (expires_at, decoded)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, id_token: str) -> None:
+        with self._lock:
+            self._entries.pop(_token_key(id_token), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "recheck_seconds": self.recheck_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+# Shared instance for the whole process
+token_cache = VerifiedTokenCache()
@@ -0,0 +1,137 @@
+"""
+Async Firebase token verification
+Runs the blocking firebase_admin verify call in a dedicated, size-limited
+thread pool so a slow key fetch / revocation check never stalls the event loop
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+from firebase_admin import auth as fb_auth
+from core.auth.token_cache import token_cache
+from core.auth.jwks import local_verifier, SigningKeysUnavailable
+
+
+VERIFY_WORKERS = int(os.getenv("AUTH_VERIFY_WORKERS", "8"))
+# Max verifications waiting for a worker before new ones are rejected
+VERIFY_MAX_QUEUE = int(os.getenv("AUTH_VERIFY_MAX_QUEUE", "256"))
+VERIFY_TIMEOUT_SECONDS = float(os.getenv("AUTH_VERIFY_TIMEOUT_SECONDS", "5"))
+# "firebase": firebase_admin (with revocation check) | "local": in-memory Google certs, no I/O
+VERIFIER_MODE = os.getenv("AUTH_VERIFIER", "firebase").lower()
+
+
+class TokenVerifierBusy(Exception):
+    """Raised when the verification queue is full"""
+
+
+class TokenVerifierTimeout(Exception):
+    """Raised when a verification does not finish within the timeout"""
+
+
+class _VerifierStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.total_seconds = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = self.submitted - self.completed
+            return {
+                "workers": VERIFY_WORKERS,
+                "max_queue": VERIFY_MAX_QUEUE,
+                "timeout_seconds": VERIFY_TIMEOUT_SECONDS,
+                "active": self.active,
+                "queued": max(in_flight - self.active, 0),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "total_verify_seconds": round(self.total_seconds, 3),
+            }
+
+
+_executor = ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix="fb-verify")
+_stats = _VerifierStats()
+
+
+def _run_verify(id_token: str, check_revoked: bool) -> Dict[str, Any]:
+    with _stats._lock:
+        _stats.active += 1
+    started = time.perf_counter()
+    try:
+        return fb_auth.verify_id_token(id_token, check_revoked=check_revoked)
+    finally:
+        elapsed = time.perf_counter() - started
+        with _stats._lock:
+            _stats.active -= 1
+            _stats.total_seconds += elapsed
+
+
+def _on_done(_future) -> None:
+    # Also fires for jobs cancelled before a worker picked them up
+    with _stats._lock:
+        _stats.completed += 1
+
+
+async def verify_id_token_async(id_token: str, check_revoked: bool = True) -> Dict[str, Any]:
+    """
+    Verify a Firebase ID token without blocking the event loop.
+    Serves from the verified-token cache when possible; firebase_admin errors propagate unchanged.
+    """
+    cached = token_cache.get(id_token)
+    if cached is not None:
+        return cached
+
+    if VERIFIER_MODE == "local":
+        try:
+            decoded = local_verifier.verify(id_token)
+        except SigningKeysUnavailable as e:
+            raise TokenVerifierBusy(str(e))
+        token_cache.put(id_token, decoded)
+        return decoded
+
+    with _stats._lock:
+        if _stats.submitted - _stats.completed >= VERIFY_WORKERS + VERIFY_MAX_QUEUE:
+            _stats.rejected += 1
+            raise TokenVerifierBusy("Token verification queue is full")
+        _stats.submitted += 1
+
+    job = _executor.submit(_run_verify, id_token, check_revoked)
+    job.add_done_callback(_on_done)
+    try:
+        decoded = await asyncio.wait_for(asyncio.wrap_future(job), timeout=VERIFY_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        # A queued job is cancelled; one already running finishes in its worker
+        with _stats._lock:
+            _stats.timeouts += 1
+        raise TokenVerifierTimeout(f"Token verification exceeded {VERIFY_TIMEOUT_SECONDS}s")
+
+    token_cache.put(id_token, decoded)
+    return decoded
+
+
+def verifier_stats() -> Dict[str, Any]:
+    stats = _stats.snapshot()
+    stats["mode"] = VERIFIER_MODE
+    if VERIFIER_MODE == "local":
+        stats["local_keys"] = local_verifier.stats()
+    return stats
+
+
+async def start_verifier() -> None:
+    if VERIFIER_MODE == "local":
+        await local_verifier.start()
+
+
+async def shutdown_verifier() -> None:
+    if VERIFIER_MODE == "local":
+        await local_verifier.stop()
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1 @@
+# Dish Management Core Module
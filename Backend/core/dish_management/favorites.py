@@ -0,0 +1,155 @@
+"""
+Per-dish favorite counter
+A user's favorites live in one place, users.favorite_dishes (dish ids as str);
+user_activity.favorite_dishes is legacy and merged into it once by
+migrate_activity_favorites(). dishes.favorite_count moves with every favorite /
+un-favorite in the same transaction as the user's list change. Milestone notifications are decided from
+the post-increment value returned by that update, so no favorites scan is needed;
+favorite_milestone is the highest milestone already announced, so un-favorite /
+favorite around a step does not notify the owner again.
+"""
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+from core.user_management import notifications
+from database.mongo import dishes_collection, user_activity_collection, users_collection
+
+logger = logging.getLogger(__name__)
+
+# Gửi thông báo cho chủ món mỗi khi đạt bội số này
+FAVORITE_MILESTONE_STEP = 5
+
+_COUNT_PROJECTION = {"name": 1, "favorite_count": 1, "owner_id": 1, "creator_id": 1}
+
+
+async def change_favorite_count(dish_id: ObjectId, delta: int, session=None) -> Optional[Dict[str, Any]]:
+    """$inc favorite_count (không xuống dưới 0); trả về dish sau khi đổi, None nếu không tồn tại"""
+    return await dishes_collection.find_one_and_update(
+        {"_id": dish_id},
+        [{"$set": {"favorite_count": {"$max": [
+            {"$add": [{"$ifNull": ["$favorite_count", 0]}, delta]}, 0,
+        ]}}}],
+        projection=_COUNT_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+        session=session,
+    )
+
+
+async def add_favorite(user_oid: ObjectId, dish_oid: ObjectId, session=None) -> Tuple[bool, Dict[str, Any]]:
+    """
+    Thêm dish vào users.favorite_dishes và +1 favorite_count. Trả về (đã thêm?, dish);
+    dish hoặc user không tồn tại -> 404, không để lại id trong danh sách.
+    """
+    dish = await dishes_collection.find_one({"_id": dish_oid}, _COUNT_PROJECTION, session=session)
+    if not dish:
+        raise HTTPException(status_code=404, detail="Dish not found")
+    dish_id = str(dish_oid)
+    # Điều kiện trên favorite_dishes giúp 2 lần bấm đồng thời không đếm 2 lần
+    added = await users_collection.update_one(
+        {"_id": user_oid, "favorite_dishes": {"$ne": dish_id}},
+        {"$addToSet": {"favorite_dishes": dish_id}},
+        session=session,
+    )
+    if not added.modified_count:
+        if not await users_collection.find_one({"_id": user_oid}, {"_id": 1}, session=session):
+            raise HTTPException(status_code=404, detail="User not found")
+        return False, dish
+    updated = await change_favorite_count(dish_oid, 1, session)
+    if not updated:
+        # Dish bị xóa ngay sau khi kiểm tra (không có transaction thì phải tự gỡ lại)
+        await users_collection.update_one({"_id": user_oid}, {"$pull": {"favorite_dishes": dish_id}}, session=session)
+        raise HTTPException(status_code=404, detail="Dish not found")
+    return True, updated
+
+
+async def remove_favorite(user_oid: ObjectId, dish_oid: ObjectId, session=None) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """Gỡ dish khỏi users.favorite_dishes và -1 favorite_count; (False, None) nếu chưa có trong danh sách"""
+    dish_id = str(dish_oid)
+    removed = await users_collection.update_one(
+        {"_id": user_oid, "favorite_dishes": dish_id},
+        {"$pull": {"favorite_dishes": dish_id}},
+        session=session,
+    )
+    if not removed.modified_count:
+        return False, None
+    return True, await change_favorite_count(dish_oid, -1, session)
+
+
+async def notify_milestone(dish: Dict[str, Any]) -> bool:
+    """Thông báo cho chủ món nếu favorite_count (sau khi tăng) vừa vượt 1 mốc chưa từng thông báo"""
+    count = int(dish.get("favorite_count") or 0)
+    owner_id = dish.get("owner_id") or dish.get("creator_id")
+    milestone = count - count % FAVORITE_MILESTONE_STEP
+    if not owner_id or milestone <= 0:
+        return False
+    # Nhận mốc bằng update có điều kiện: mỗi mốc chỉ 1 request gửi thông báo
+    claimed = await dishes_collection.update_one(
+        {"_id": dish["_id"], "favorite_milestone": {"$not": {"$gte": milestone}}},
+        {"$set": {"favorite_milestone": milestone}},
+    )
+    if not claimed.modified_count:
+        return False
+    try:
+        await notifications.notify(
+            str(owner_id),
+            "milestone",
+            f"Món ăn '{dish.get('name', '')}' của bạn đã nhận được {milestone} lượt thả tim!",
+            {"dish_id": str(dish["_id"]), "favorite_count": milestone},
+        )
+    except Exception as e:
+        # Thông báo hỏng không được làm hỏng lượt thả tim
+        logger.error(f"Favorite milestone notification failed for dish {dish['_id']}: {e}")
+        return False
+    return True
+
+
+async def backfill_favorite_counts() -> Dict[str, int]:
+    """
+    Đặt favorite_count cho mọi dish từ users.favorite_dishes (mỗi user tính 1 lần).
+    Dish bị thả tim ghi xen được bỏ qua; chạy lại để chỉnh nốt.
+    """
+    fans: Dict[str, set] = {}
+    async for user in users_collection.find({"favorite_dishes.0": {"$exists": True}}, {"favorite_dishes": 1}):
+        for dish_id in user.get("favorite_dishes") or []:
+            fans.setdefault(str(dish_id), set()).add(str(user["_id"]))
+
+    # Không reset toàn bộ về 0: mỗi dish chỉ được $set 1 lần, và chỉ khi counter vẫn là giá trị
+    # vừa đọc, để không đè $inc của lượt thả tim ghi xen
+    updated = 0
+    async for dish in dishes_collection.find({}, {"favorite_count": 1}):
+        expected = len(fans.get(str(dish["_id"]), ()))
+        current = dish.get("favorite_count")
+        if current == expected:
+            continue
+        result = await dishes_collection.update_one(
+            {"_id": dish["_id"], "favorite_count": current},
+            {"$set": {"favorite_count": expected}},
+        )
+        updated += result.modified_count
+    return {"dishes_with_favorites": len(fans), "updated": updated}
+
+
+async def migrate_activity_favorites() -> Dict[str, int]:
+    """
+    Gộp user_activity.favorite_dishes (dữ liệu cũ) vào users.favorite_dishes rồi $unset,
+    sau đó tính lại favorite_count từ danh sách đã gộp. Idempotent, tự resume.
+    """
+    merged = 0
+    legacy_q = {"favorite_dishes": {"$exists": True}}
+    async for activity in user_activity_collection.find(legacy_q, {"user_id": 1, "favorite_dishes": 1}):
+        dish_ids = [str(d) for d in activity.get("favorite_dishes") or [] if ObjectId.is_valid(str(d))]
+        if dish_ids and ObjectId.is_valid(str(activity.get("user_id"))):
+            await users_collection.update_one(
+                {"_id": ObjectId(activity["user_id"])},
+                {"$addToSet": {"favorite_dishes": {"$each": dish_ids}}},
+            )
+        await user_activity_collection.update_one({"_id": activity["_id"]}, {"$unset": {"favorite_dishes": ""}})
+        merged += 1
+    counts = await backfill_favorite_counts()
+    if merged:
+        logger.info(f"Merged activity favorites of {merged} users into users.favorite_dishes: {counts}")
+    return {"users": merged, **counts}
@@ -0,0 +1,172 @@
+"""
+Dish ownership normalization
+Legacy dishes store their creator in one of several fields (creator_id as str or
+ObjectId, created_by as email/id/username, user_id, owner_id). New dishes and a
+resumable backfill write one canonical `owner_id` (user _id as str) so "my dishes"
+becomes an indexed equality query on (owner_id, created_at).
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from database.mongo import dishes_collection, migrations_collection, users_collection
+
+BACKFILL_ID = "dish_owner_id_backfill"
+BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+_backfill_complete = False
+_backfill_task: Optional[asyncio.Task] = None
+
+
+def legacy_owner_filter(user: Dict[str, Any]) -> Dict[str, Any]:
+    """The old 7-way $or used before owner_id existed"""
+    user_id = str(user["_id"])
+    clauses = [
+        {"creator_id": user_id},
+        {"creator_id": ObjectId(user_id)},
+        {"created_by": user_id},
+        {"user_id": user_id},
+        {"owner_id": user_id},
+    ]
+    if user.get("email"):
+        clauses.append({"created_by": user["email"]})
+    if user.get("username"):
+        clauses.append({"created_by": user["username"]})
+    return {"$or": clauses}
+
+
+async def owner_filter(user: Dict[str, Any]) -> Dict[str, Any]:
+    """Indexed equality once the backfill is done, legacy $or until then"""
+    if await is_backfill_complete():
+        return {"owner_id": str(user["_id"])}
+    return legacy_owner_filter(user)
+
+
+async def is_backfill_complete() -> bool:
+    global _backfill_complete
+    if not _backfill_complete:
+        state = await migrations_collection.find_one({"_id": BACKFILL_ID}, {"done": 1})
+        _backfill_complete = bool(state and state.get("done"))
+    return _backfill_complete
+
+
+class _OwnerResolver:
+    """Maps legacy owner fields to a user id, memoizing user lookups for the run"""
+
+    def __init__(self):
+        self._by_email: Dict[str, Optional[str]] = {}
+        self._by_username: Dict[str, Optional[str]] = {}
+        self._known_ids: Dict[str, bool] = {}
+
+    async def _user_exists(self, user_id: str) -> bool:
+        if user_id not in self._known_ids:
+            found = await users_collection.find_one({"_id": ObjectId(user_id)}, {"_id": 1})
+            self._known_ids[user_id] = found is not None
+        return self._known_ids[user_id]
+
+    async def _lookup(self, cache: Dict[str, Optional[str]], field: str, value: str) -> Optional[str]:
+        if value not in cache:
+            found = await users_collection.find_one({field: value}, {"_id": 1})
+            cache[value] = str(found["_id"]) if found else None
+        return cache[value]
+
+    async def resolve(self, dish: Dict[str, Any]) -> Optional[str]:
+        for field in ("creator_id", "user_id", "owner_id"):
+            value = dish.get(field)
+            if isinstance(value, ObjectId):
+                return str(value)
+            if isinstance(value, str) and value:
+                return value
+
+        created_by = dish.get("created_by")
+        if isinstance(created_by, ObjectId):
+            return str(created_by)
+        if isinstance(created_by, str) and created_by:
+            if ObjectId.is_valid(created_by) and await self._user_exists(created_by):
+                return created_by
+            if "@" in created_by:
+                return await self._lookup(self._by_email, "email", created_by)
+            return await self._lookup(self._by_username, "username", created_by)
+        return None
+
+
+async def backfill_owner_ids(batch_size: int = BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Populate owner_id on every dish, in _id order, checkpointing after each batch
+    so an interrupted run resumes where it stopped. Unresolvable dishes get owner_id=None.
+    """
+    global _backfill_complete
+    state = await migrations_collection.find_one({"_id": BACKFILL_ID}) or {}
+    if state.get("done"):
+        _backfill_complete = True
+        return state
+
+    last_id = state.get("last_id")
+    processed = state.get("processed", 0)
+    unresolved = state.get("unresolved", 0)
+    resolver = _OwnerResolver()
+
+    while True:
+        query: Dict[str, Any] = {"_id": {"$gt": last_id}} if last_id else {}
+        batch = await dishes_collection.find(
+            query,
+            {"owner_id": 1, "creator_id": 1, "created_by": 1, "user_id": 1},
+        ).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+
+        ops = []
+        for dish in batch:
+            owner_id = await resolver.resolve(dish)
+            if owner_id is None:
+                unresolved += 1
+            if dish.get("owner_id") != owner_id or "owner_id" not in dish:
+                ops.append(UpdateOne({"_id": dish["_id"]}, {"$set": {"owner_id": owner_id}}))
+        if ops:
+            await dishes_collection.bulk_write(ops, ordered=False)
+
+        last_id = batch[-1]["_id"]
+        processed += len(batch)
+        await migrations_collection.update_one(
+            {"_id": BACKFILL_ID},
+            {"$set": {
+                "last_id": last_id,
+                "processed": processed,
+                "unresolved": unresolved,
+                "updated_at": datetime.now(timezone.utc),
+            }},
+            upsert=True,
+        )
+
+    await migrations_collection.update_one(
+        {"_id": BACKFILL_ID},
+        {"$set": {"done": True, "finished_at": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+    _backfill_complete = True
+    logger.info(f"owner_id backfill finished: {processed} dishes, {unresolved} without a resolvable owner")
+    return await migrations_collection.find_one({"_id": BACKFILL_ID})
+
+
+def start_backfill() -> bool:
+    """Run the backfill in the background; returns False if one is already running"""
+    global _backfill_task
+    if _backfill_task and not _backfill_task.done():
+        return False
+    _backfill_task = asyncio.create_task(backfill_owner_ids())
+    return True
+
+
+async def backfill_status() -> Dict[str, Any]:
+    state = await migrations_collection.find_one({"_id": BACKFILL_ID}) or {}
+    state.pop("_id", None)
+    if isinstance(state.get("last_id"), ObjectId):
+        state["last_id"] = str(state["last_id"])
+    state["running"] = bool(_backfill_task and not _backfill_task.done())
+    return state
@@ -0,0 +1,94 @@
+"""
+Dish rating aggregates
+A dish keeps rating_count / rating_sum / rating_histogram (per star) from /rate and
+comments_count / comment_rating_sum from rated comments (routes/comment_route.py).
+average_rating is derived from both pairs together by average_rating_stage(), which
+every writer of either pair appends, so the field doesn't depend on who wrote last.
+The raw rating history is optional and lives in its own collection.
+"""
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from database.mongo import db, dishes_collection
+
+# Ghi lịch sử từng lượt rate vào collection riêng (tắt mặc định)
+RATING_HISTORY_ENABLED = os.getenv("DISH_RATING_HISTORY", "False").lower() == "true"
+
+dish_ratings_collection = db["dish_ratings"]
+
+STARS = (1, 2, 3, 4, 5)
+RATING_PROJECTION = {"average_rating": 1, "rating_count": 1, "rating_sum": 1, "rating_histogram": 1}
+
+_LEGACY_RATINGS = {"$ifNull": ["$ratings", []]}
+
+
+def _legacy_star_count(star: int) -> Dict[str, Any]:
+    return {"$size": {"$filter": {"input": _LEGACY_RATINGS, "cond": {"$eq": ["$$this", star]}}}}
+
+
+def average_rating_stage() -> Dict[str, Any]:
+    """Stage $set average_rating = (rating_sum + comment_rating_sum) / (rating_count + comments_count)"""
+    return {"$set": {"average_rating": {"$let": {
+        "vars": {
+            "n": {"$add": [
+                {"$ifNull": ["$rating_count", {"$size": _LEGACY_RATINGS}]},
+                {"$ifNull": ["$comments_count", 0]},
+            ]},
+            "s": {"$add": [
+                {"$ifNull": ["$rating_sum", {"$sum": _LEGACY_RATINGS}]},
+                {"$ifNull": ["$comment_rating_sum", 0]},
+            ]},
+        },
+        "in": {"$cond": [{"$gt": ["$$n", 0]}, {"$divide": ["$$s", "$$n"]}, 0.0]},
+    }}}}
+
+
+def rating_update_pipeline(rating: int) -> List[Dict[str, Any]]:
+    """
+    Update pipeline adding one rating. Dishes that still only have the legacy
+    `ratings` array are seeded from it on their first new rating.
+    """
+    seed_fields: Dict[str, Any] = {
+        "rating_count": {"$add": [{"$ifNull": ["$rating_count", {"$size": _LEGACY_RATINGS}]}, 1]},
+        "rating_sum": {"$add": [{"$ifNull": ["$rating_sum", {"$sum": _LEGACY_RATINGS}]}, rating]},
+    }
+    for star in STARS:
+        seed_fields[f"rating_histogram.{star}"] = {"$add": [
+            {"$ifNull": [f"$rating_histogram.{star}", _legacy_star_count(star)]},
+            1 if star == rating else 0,
+        ]}
+    return [
+        {"$set": seed_fields},
+        average_rating_stage(),
+    ]
+
+
+async def add_dish_rating(dish_id: ObjectId, rating: int, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Apply one rating atomically; returns the updated aggregates or None if the dish doesn't exist"""
+    updated = await dishes_collection.find_one_and_update(
+        {"_id": dish_id},
+        rating_update_pipeline(rating),
+        projection=RATING_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
+    if updated and RATING_HISTORY_ENABLED:
+        await dish_ratings_collection.insert_one({
+            "dish_id": str(dish_id),
+            "user_id": user_id,
+            "rating": rating,
+            "created_at": datetime.now(timezone.utc),
+        })
+    return updated
+
+
+def rating_summary(doc: Dict[str, Any]) -> Dict[str, Any]:
+    histogram = doc.get("rating_histogram") or {}
+    return {
+        "average_rating": float(doc.get("average_rating") or 0.0),
+        "rating_count": int(doc.get("rating_count") or 0),
+        "histogram": {str(star): int(histogram.get(str(star), 0)) for star in STARS},
+    }
@@ -0,0 +1,121 @@
+"""
+Entity hydration for id lists (history, favorites, feeds)
+Resolves typed references ("dish" / "user") with one projected `$in` query per
+type, run concurrently, behind a short-lived process-wide cache.
+"""
+import asyncio
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+
+from database.mongo import dishes_collection, users_collection
+from utils.ttl_cache import TTLCache
+
+HYDRATION_CACHE_SIZE = int(os.getenv("HYDRATION_CACHE_SIZE", "10000"))
+HYDRATION_CACHE_TTL_SECONDS = float(os.getenv("HYDRATION_CACHE_TTL_SECONDS", "30"))
+
+# Only what a list item needs - never legacy image_b64 blobs or big arrays
+DISH_SUMMARY_PROJECTION = {
+    "name": 1,
+    "image_url": 1,
+    "cooking_time": 1,
+    "average_rating": 1,
+    "difficulty": 1,
+    "creator_id": 1,
+    "owner_id": 1,
+    "recipe_id": 1,
+    "created_at": 1,
+}
+USER_SUMMARY_PROJECTION = {"display_id": 1, "name": 1, "avatar": 1}
+
+_SOURCES = {
+    "dish": (dishes_collection, DISH_SUMMARY_PROJECTION),
+    "user": (users_collection, USER_SUMMARY_PROJECTION),
+}
+
+_entity_cache = TTLCache(HYDRATION_CACHE_SIZE, HYDRATION_CACHE_TTL_SECONDS)
+
+EntityRef = Tuple[str, str]
+
+
+def _summary(entity_type: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+    if entity_type == "dish":
+        return {
+            "id": str(doc["_id"]),
+            "name": doc.get("name", ""),
+            "image_url": doc.get("image_url"),
+            "cooking_time": int(doc.get("cooking_time") or 0),
+            "average_rating": float(doc.get("average_rating") or 0.0),
+            "difficulty": doc.get("difficulty"),
+            "creator_id": doc.get("creator_id"),
+            "owner_id": doc.get("owner_id"),
+            "recipe_id": doc.get("recipe_id"),
+            "created_at": doc.get("created_at"),
+        }
+    return {
+        "id": str(doc["_id"]),
+        "display_id": doc.get("display_id"),
+        "name": doc.get("name", ""),
+        "avatar": doc.get("avatar"),
+    }
+
+
+async def _fetch(entity_type: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    collection, projection = _SOURCES[entity_type]
+    object_ids = [ObjectId(i) for i in ids]
+    found: Dict[str, Dict[str, Any]] = {}
+    async for doc in collection.find({"_id": {"$in": object_ids}}, projection):
+        summary = _summary(entity_type, doc)
+        found[summary["id"]] = summary
+        _entity_cache.set((entity_type, summary["id"]), summary)
+    return found
+
+
+async def hydrate(refs: Iterable[EntityRef]) -> Dict[EntityRef, Dict[str, Any]]:
+    """
+    Map (type, id) -> summary dict for every ref that exists.
+    Unknown types, invalid ids and deleted entities are simply absent from the result.
+    """
+    resolved: Dict[EntityRef, Dict[str, Any]] = {}
+    missing: Dict[str, List[str]] = {}
+    for entity_type, entity_id in refs:
+        if entity_type not in _SOURCES or not ObjectId.is_valid(entity_id):
+            continue
+        key = (entity_type, entity_id)
+        if key in resolved:
+            continue
+        cached = _entity_cache.get(key)
+        if cached is not None:
+            resolved[key] = dict(cached)
+        elif entity_id not in missing.setdefault(entity_type, []):
+            missing[entity_type].append(entity_id)
+
+    types = [t for t, ids in missing.items() if ids]
+    results = await asyncio.gather(*(_fetch(t, missing[t]) for t in types))
+    for entity_type, found in zip(types, results):
+        for entity_id, summary in found.items():
+            resolved[(entity_type, entity_id)] = dict(summary)
+    return resolved
+
+
+async def hydrate_dishes(dish_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """dish id -> dish summary"""
+    hydrated = await hydrate(("dish", str(i)) for i in dish_ids)
+    return {entity_id: summary for (_, entity_id), summary in hydrated.items()}
+
+
+async def hydrate_users(user_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """user id -> user summary"""
+    hydrated = await hydrate(("user", str(i)) for i in user_ids)
+    return {entity_id: summary for (_, entity_id), summary in hydrated.items()}
+
+
+def invalidate_entity(entity_type: str, entity_id: Optional[str]) -> None:
+    """Call after writes that change a hydrated field (name, avatar, image, rating...)"""
+    if entity_id:
+        _entity_cache.pop((entity_type, str(entity_id)))
+
+
+def hydration_cache_stats() -> Dict[str, Any]:
+    return _entity_cache.stats()
@@ -0,0 +1 @@
+# Search Core Module
@@ -0,0 +1,163 @@
+"""
+Combined dish filtering with facet counts
+One filter (max time, min rating, difficulty, must-have / excluded ingredients,
+text) drives both the result page and the facets. Pages are keyset-paginated on
+the chosen sort (utils/pagination.py), served by the compound dish indexes in
+database/indexes.py. Facets come from a single $facet aggregation and are
+disjunctive: each facet applies every filter except its own, so the client can
+show how many dishes the other difficulties / time / rating choices would give.
+Facet results are cached briefly per filter, since they scan the whole match set.
+"""
+import asyncio
+import os
+from typing import Any, Dict, List, Optional
+
+from core.search.ingredients import query_keys
+from core.search.text import query_tokens
+from database.mongo import dishes_collection
+from utils.pagination import apply_cursor, next_cursor, sort_spec
+from utils.ttl_cache import TTLCache
+
+FACET_CACHE_SIZE = int(os.getenv("DISH_FACET_CACHE_SIZE", "256"))
+FACET_CACHE_TTL_SECONDS = float(os.getenv("DISH_FACET_CACHE_TTL_SECONDS", "60"))
+
+DIFFICULTIES = ("easy", "medium", "hard")
+
+# sort key -> (field, direction)
+SORTS = {
+    "rating": ("average_rating", -1),
+    "time": ("cooking_time", 1),
+    "newest": ("created_at", -1),
+    "popular": ("favorite_count", -1),
+}
+
+# Biên của bucket (phút / sao); giá trị ngoài khoảng rơi vào bucket "other"
+TIME_BUCKETS = [0, 15, 30, 60, 120, 100000]
+RATING_BUCKETS = [0, 3, 4, 4.5, 5.01]
+
+_facet_cache = TTLCache(FACET_CACHE_SIZE, FACET_CACHE_TTL_SECONDS)
+
+
+class DishFilter:
+    """Các điều kiện lọc dish; mỗi điều kiện là 1 mệnh đề riêng để facet có thể bỏ bớt"""
+
+    def __init__(
+        self,
+        max_time: Optional[int] = None,
+        min_rating: Optional[float] = None,
+        difficulties: Optional[List[str]] = None,
+        ingredients: Optional[List[str]] = None,
+        exclude: Optional[List[str]] = None,
+        q: Optional[str] = None,
+    ):
+        self.max_time = max_time
+        self.min_rating = min_rating
+        self.difficulties = sorted(set(difficulties or []))
+        self.ingredient_keys = query_keys(ingredients or [])
+        self.exclude_keys = query_keys(exclude or [])
+        self.tokens = query_tokens(q or "")
+
+    def cache_key(self):
+        return (self.max_time, self.min_rating, tuple(self.difficulties),
+                tuple(self.ingredient_keys), tuple(self.exclude_keys), tuple(self.tokens))
+
+    def base(self) -> Dict[str, Any]:
+        """Điều kiện không thuộc facet nào (text + nguyên liệu)"""
+        query: Dict[str, Any] = {}
+        if self.tokens:
+            query["search_tokens"] = {"$all": self.tokens}
+        keys: Dict[str, Any] = {}
+        if self.ingredient_keys:
+            keys["$all"] = self.ingredient_keys
+        if self.exclude_keys:
+            keys["$nin"] = self.exclude_keys
+        if keys:
+            query["ingredient_keys"] = keys
+        return query
+
+    def facet_clauses(self) -> Dict[str, Dict[str, Any]]:
+        clauses: Dict[str, Dict[str, Any]] = {}
+        if self.difficulties:
+            clauses["difficulty"] = {"difficulty": {"$in": self.difficulties}}
+        if self.max_time is not None:
+            clauses["time"] = {"cooking_time": {"$lte": self.max_time}}
+        if self.min_rating:
+            clauses["rating"] = {"average_rating": {"$gte": self.min_rating}}
+        return clauses
+
+    def query(self) -> Dict[str, Any]:
+        query = self.base()
+        for clause in self.facet_clauses().values():
+            query.update(clause)
+        return query
+
+
+def _except(dish_filter: DishFilter, facet: str) -> List[Dict[str, Any]]:
+    clauses = [c for name, c in dish_filter.facet_clauses().items() if name != facet]
+    return [{"$match": {"$and": clauses}}] if clauses else []
+
+
+def _bucket_label(boundaries: List[float], lower: Any) -> str:
+    if lower == "other":
+        return "other"
+    upper = boundaries[boundaries.index(lower) + 1]
+    return f"{lower}-{upper}" if upper != boundaries[-1] else f"{lower}+"
+
+
+async def facets(dish_filter: DishFilter) -> Dict[str, Any]:
+    """Số dish theo độ khó / khoảng thời gian / khoảng rating, trong 1 lần $facet"""
+    key = dish_filter.cache_key()
+    cached = _facet_cache.get(key)
+    if cached is not None:
+        return cached
+
+    pipeline = [
+        {"$match": dish_filter.base()},
+        {"$project": {"difficulty": 1, "cooking_time": 1, "average_rating": 1}},
+        {"$facet": {
+            "difficulty": _except(dish_filter, "difficulty") + [{"$sortByCount": "$difficulty"}],
+            "time": _except(dish_filter, "time") + [{"$bucket": {
+                "groupBy": "$cooking_time", "boundaries": TIME_BUCKETS, "default": "other",
+            }}],
+            "rating": _except(dish_filter, "rating") + [{"$bucket": {
+                "groupBy": "$average_rating", "boundaries": RATING_BUCKETS, "default": "other",
+            }}],
+            "total": _except(dish_filter, None) + [{"$count": "n"}],
+        }},
+    ]
+    raw = (await dishes_collection.aggregate(pipeline).to_list(length=1))[0]
+    result = {
+        "difficulty": {str(b["_id"] or "unknown"): b["count"] for b in raw["difficulty"]},
+        "time": {_bucket_label(TIME_BUCKETS, b["_id"]): b["count"] for b in raw["time"]},
+        "rating": {_bucket_label(RATING_BUCKETS, b["_id"]): b["count"] for b in raw["rating"]},
+        "total": raw["total"][0]["n"] if raw["total"] else 0,
+    }
+    _facet_cache.set(key, result)
+    return result
+
+
+async def filter_dishes(
+    dish_filter: DishFilter,
+    sort: str = "rating",
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    projection: Optional[Dict[str, Any]] = None,
+    with_facets: bool = True,
+) -> Dict[str, Any]:
+    """1 trang dish khớp filter (keyset theo `sort`), kèm facets nếu with_facets"""
+    field, direction = SORTS[sort]
+    page = dishes_collection.find(apply_cursor(dish_filter.query(), field, direction, cursor), projection) \
+        .sort(sort_spec(field, direction)).limit(limit).to_list(length=limit)
+    if with_facets:
+        docs, facet_counts = await asyncio.gather(page, facets(dish_filter))
+    else:
+        docs, facet_counts = await page, None
+    return {
+        "dishes": docs,
+        "facets": facet_counts,
+        "next_cursor": next_cursor(docs, field, limit),
+    }
+
+
+def facet_cache_stats() -> Dict[str, Any]:
+    return _facet_cache.stats()
@@ -0,0 +1,218 @@
+"""
+Token index for dish / recipe / user / ingredient search
+Each searchable document carries two derived fields:
+  search_tokens - every prefix of every folded word of its searchable fields (multikey-indexed)
+  search_words  - the folded words of its primary field(s), used for ranking
+A query matches documents whose search_tokens contain all of its folded tokens
+(`$all`, served by the multikey index), so "ca ch" finds "Cà chua" without a scan.
+Every match is scored before the page is cut, so the best results are never lost
+to an arbitrary candidate cap; $sort + $limit run as one top-k sort.
+Writers set the fields via search_fields(), which also stamps search_version;
+documents written elsewhere, or indexed by an older search_fields() (bump
+SEARCH_FIELDS_VERSION when it changes), are picked up by backfill_search_fields(),
+which runs at startup and periodically. Queries need a token of at least
+MIN_QUERY_TOKEN_LENGTH characters: a 1-letter prefix matches most of a collection.
+Dishes also get `ingredient_keys` (core/search/ingredients.py) through the same path.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from core.search.ingredients import ingredient_keys
+from core.search.text import prefixes, query_tokens, words
+from database.mongo import dishes_collection, ingredients_collection, recipe_collection, users_collection
+
+logger = logging.getLogger(__name__)
+
+# Tăng khi search_fields() đổi (tokenize, field nguồn...) để backfill index lại mọi document
+SEARCH_FIELDS_VERSION = 1
+# Token dài nhất của query phải có ít nhất bấy nhiêu ký tự
+MIN_QUERY_TOKEN_LENGTH = 2
+# Chu kỳ index các document chưa index / index từ phiên bản cũ (giây); 0 = chỉ chạy lúc startup
+SEARCH_BACKFILL_SECONDS = int(os.getenv("SEARCH_BACKFILL_SECONDS", "300"))
+
+# kind -> collection, field chính (xếp hạng), field phụ, field độ phổ biến (tie-break)
+SEARCH_SOURCES: Dict[str, Dict[str, Any]] = {
+    "dishes": {
+        "collection": dishes_collection,
+        "primary": ["name"],
+        "secondary": ["ingredients"],
+        "popularity": "average_rating",
+        "derived": ["ingredient_keys"],
+    },
+    "recipes": {
+        "collection": recipe_collection,
+        "primary": ["name"],
+        "secondary": ["description"],
+        "popularity": "average_rating",
+    },
+    "users": {
+        "collection": users_collection,
+        "primary": ["display_id", "name"],
+        "secondary": [],
+        "popularity": None,
+    },
+    "ingredients": {
+        "collection": ingredients_collection,
+        "primary": ["name"],
+        "secondary": [],
+        "popularity": None,
+    },
+}
+
+_SOURCE_FIELDS = {
+    kind: {f: 1 for f in source["primary"] + source["secondary"]}
+    for kind, source in SEARCH_SOURCES.items()
+}
+
+# Mọi field do search_fields() sinh ra, theo kind
+_DERIVED_FIELDS = {
+    kind: ["search_tokens", "search_words", "search_version"] + source.get("derived", [])
+    for kind, source in SEARCH_SOURCES.items()
+}
+
+
+def _missing_filter(kind: str) -> Dict[str, Any]:
+    """Document chưa index, hoặc index bởi search_fields() phiên bản cũ (dùng index search_version)"""
+    return {"search_version": {"$ne": SEARCH_FIELDS_VERSION}}
+
+
+def _texts(doc: Dict[str, Any], fields: List[str]) -> List[str]:
+    texts: List[str] = []
+    for field in fields:
+        value = doc.get(field)
+        if isinstance(value, str):
+            texts.append(value)
+        elif isinstance(value, list):
+            texts.extend(v for v in value if isinstance(v, str))
+    return texts
+
+
+def search_fields(kind: str, doc: Dict[str, Any]) -> Dict[str, List[str]]:
+    """search_tokens / search_words cho 1 document (merge vào insert hoặc $set)"""
+    source = SEARCH_SOURCES[kind]
+    primary = words(_texts(doc, source["primary"]))
+    secondary = words(_texts(doc, source["secondary"]))
+    fields = {
+        "search_tokens": prefixes(primary + [w for w in secondary if w not in primary]),
+        "search_words": primary,
+        "search_version": SEARCH_FIELDS_VERSION,
+    }
+    if "ingredient_keys" in source.get("derived", []):
+        fields["ingredient_keys"] = ingredient_keys(doc.get("ingredients") or [])
+    return fields
+
+
+async def reindex_document(kind: str, doc_id: ObjectId) -> None:
+    """Tính lại search fields sau khi sửa field được index của 1 document"""
+    collection = SEARCH_SOURCES[kind]["collection"]
+    doc = await collection.find_one({"_id": doc_id}, _SOURCE_FIELDS[kind])
+    if doc:
+        await collection.update_one({"_id": doc_id}, {"$set": search_fields(kind, doc)})
+
+
+async def search(
+    kind: str,
+    q: str,
+    limit: int = 10,
+    projection: Optional[Dict[str, Any]] = None,
+    extra_filter: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Document khớp mọi token của q, xếp theo số từ khớp nguyên vẹn ở field chính,
+    rồi độ phổ biến, rồi tên ngắn hơn (khớp sát hơn).
+    """
+    # Token dài nhất đứng đầu $all: planner dùng phần tử đầu làm bound của index
+    tokens = sorted(query_tokens(q), key=len, reverse=True)
+    if not tokens or len(tokens[0]) < MIN_QUERY_TOKEN_LENGTH:
+        return []
+    source = SEARCH_SOURCES[kind]
+    match: Dict[str, Any] = {"search_tokens": {"$all": tokens}}
+    if extra_filter:
+        match = {"$and": [match, extra_filter]}
+
+    primary = source["primary"][0]
+    sort: Dict[str, int] = {"_score": -1}
+    if source["popularity"]:
+        sort[source["popularity"]] = -1
+    sort["_name_len"] = 1
+    sort["_id"] = 1
+
+    pipeline: List[Dict[str, Any]] = [
+        {"$match": match},
+        # Chấm điểm mọi document khớp rồi mới cắt: cắt trước khi xếp hạng sẽ bỏ sót kết quả tốt
+        {"$addFields": {
+            "_score": {"$size": {"$setIntersection": [{"$ifNull": ["$search_words", []]}, tokens]}},
+            "_name_len": {"$strLenCP": {"$ifNull": [{"$toString": f"${primary}"}, ""]}},
+        }},
+        # $sort + $limit liền nhau -> top-k, không sort toàn bộ tập khớp
+        {"$sort": sort},
+        {"$limit": limit},
+    ]
+    if projection:
+        pipeline.append({"$project": {**projection, "_score": 1}})
+    else:
+        pipeline.append({"$project": {**{f: 0 for f in _DERIVED_FIELDS[kind]}, "_name_len": 0}})
+    return await source["collection"].aggregate(pipeline).to_list(length=limit)
+
+
+async def backfill_search_fields(kind: str, batch_size: int = 500) -> int:
+    """Index các document còn thiếu search fields; trả về số document đã index"""
+    collection = SEARCH_SOURCES[kind]["collection"]
+    done = 0
+    while True:
+        batch = await collection.find(_missing_filter(kind), _SOURCE_FIELDS[kind]) \
+            .limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+        await collection.bulk_write(
+            [UpdateOne({"_id": d["_id"]}, {"$set": search_fields(kind, d)}) for d in batch],
+            ordered=False,
+        )
+        done += len(batch)
+    if done:
+        logger.info(f"Search index: indexed {done} {kind}")
+    return done
+
+
+async def backfill_all() -> Dict[str, int]:
+    return {kind: await backfill_search_fields(kind) for kind in SEARCH_SOURCES}
+
+
+async def reindex_all(kind: str, batch_size: int = 500) -> int:
+    """
+    Tính lại search fields cho mọi document. Chỉ bỏ search_version (không xóa token), nên
+    search vẫn trả kết quả trong lúc backfill chạy lại.
+    """
+    collection = SEARCH_SOURCES[kind]["collection"]
+    await collection.update_many({}, {"$unset": {"search_version": ""}})
+    return await backfill_search_fields(kind, batch_size)
+
+
+async def _backfill_loop():
+    while True:
+        try:
+            await backfill_all()
+        except Exception as e:
+            logger.error(f"Search index backfill failed: {e}")
+        if SEARCH_BACKFILL_SECONDS <= 0:
+            return
+        await asyncio.sleep(SEARCH_BACKFILL_SECONDS)
+
+
+_backfill_task: Optional[asyncio.Task] = None
+
+
+def start_backfill() -> None:
+    global _backfill_task
+    if _backfill_task is None or _backfill_task.done():
+        _backfill_task = asyncio.create_task(_backfill_loop())
+
+
+def stop_backfill() -> None:
+    if _backfill_task:
+        _backfill_task.cancel()
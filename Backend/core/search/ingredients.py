@@ -0,0 +1,106 @@
+"""
+Ingredient -> dish posting lists for "what can I cook with these" search
+Every dish carries `ingredient_keys`: each ingredient name and its leading word
+phrases ("Thịt bò xay" -> "thịt", "thịt bò", "thịt bò xay"), both as written
+(lowercased) and folded ("thit", ...). A query key keeps its diacritics when the
+user typed them, so "cá" never matches "cà chua" while "ca chua" still does, and
+asking for "thịt" finds "thịt bò". The multikey index on that field is the posting
+list; overlap is counted server-side with $setIntersection over every matching
+dish, and the top-k is taken by (overlap, rating, cooking time) in one sorted pass.
+The field is written by search_fields("dishes", ...) and backfilled with it.
+"""
+import asyncio
+import re
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional
+
+from core.search.text import tokenize
+from database.mongo import dishes_collection
+
+# Số từ đầu tối đa của 1 tên nguyên liệu được index thành key riêng
+MAX_KEY_WORDS = 4
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def _accented_tokens(text: str) -> List[str]:
+    """Từ lowercase, giữ dấu: "Cà Chua" -> ["cà", "chua"]"""
+    return [t for t in _NON_WORD.split(unicodedata.normalize("NFC", text or "").lower()) if t]
+
+
+def ingredient_key(name: str) -> str:
+    """Key của 1 nguyên liệu trong query: giữ dấu nếu có ("Cá" -> "cá"), "ca chua" -> "ca chua" """
+    return " ".join(_accented_tokens(name))
+
+
+def _phrases(tokens: List[str], out: Dict[str, None]) -> None:
+    for end in range(1, min(len(tokens), MAX_KEY_WORDS) + 1):
+        out.setdefault(" ".join(tokens[:end]), None)
+    if len(tokens) > MAX_KEY_WORDS:
+        out.setdefault(" ".join(tokens), None)
+
+
+def ingredient_keys(names: Iterable[Any]) -> List[str]:
+    """Key của mọi nguyên liệu của 1 dish (tên đầy đủ + các cụm từ đầu, có dấu và bỏ dấu), không trùng"""
+    out: Dict[str, None] = {}
+    for name in names or []:
+        if not isinstance(name, str):
+            continue
+        _phrases(_accented_tokens(name), out)
+        _phrases(tokenize(name), out)
+    return list(out)
+
+
+def query_keys(names: Iterable[str]) -> List[str]:
+    keys: Dict[str, None] = {}
+    for name in names:
+        key = ingredient_key(name)
+        if key:
+            keys.setdefault(key, None)
+    return list(keys)
+
+
+def ingredient_match(include: List[str], must: List[str], exclude: List[str]) -> Dict[str, Any]:
+    """Điều kiện trên ingredient_keys: có ít nhất 1 key của include/must, đủ mọi must, không có exclude"""
+    condition: Dict[str, Any] = {"$in": include + [k for k in must if k not in include]}
+    if must:
+        condition["$all"] = must
+    if exclude:
+        condition["$nin"] = exclude
+    return {"ingredient_keys": condition}
+
+
+async def dishes_by_ingredients(
+    include: Iterable[str],
+    must: Iterable[str] = (),
+    exclude: Iterable[str] = (),
+    limit: int = 20,
+    projection: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Top `limit` dish theo số nguyên liệu khớp (include + must), rồi average_rating cao,
+    rồi cooking_time ngắn; total là số dish khớp trên toàn bộ collection.
+    """
+    include_keys, must_keys, exclude_keys = query_keys(include), query_keys(must), query_keys(exclude)
+    wanted = include_keys + [k for k in must_keys if k not in include_keys]
+    if not wanted:
+        return {"dishes": [], "total": 0, "keys": []}
+
+    match = ingredient_match(include_keys, must_keys, exclude_keys)
+    pipeline: List[Dict[str, Any]] = [
+        {"$match": match},
+        {"$addFields": {"match_count": {"$size": {"$setIntersection": ["$ingredient_keys", wanted]}}}},
+        # $sort + $limit liền nhau -> top-k, không sort toàn bộ tập khớp
+        {"$sort": {"match_count": -1, "average_rating": -1, "cooking_time": 1, "_id": 1}},
+        {"$limit": limit},
+    ]
+    if projection:
+        pipeline.append({"$project": {**projection, "match_count": 1}})
+    else:
+        pipeline.append({"$project": {"search_tokens": 0, "search_words": 0, "search_version": 0, "ingredient_keys": 0}})
+
+    dishes, total = await asyncio.gather(
+        dishes_collection.aggregate(pipeline).to_list(length=limit),
+        dishes_collection.count_documents(match),
+    )
+    return {"dishes": dishes, "total": total, "keys": wanted}
@@ -0,0 +1,203 @@
+"""
+In-memory prefix autocomplete for dish names and ingredients
+Keys are folded names (core/search/text.py) kept in a sorted array; a prefix
+lookup is two bisects plus a popularity top-k over the matching slice, and the
+top-k of each (prefix, kinds) is memoized until an insert touches the prefix. Every word start is
+a key too, so "chua" suggests "Cà chua". Serving never touches Mongo: the index
+is built at startup, refreshed periodically (weights, other workers' inserts) and
+updated in place by the dish create endpoints (inserts made while a rebuild runs
+are replayed into the new index before it is swapped in).
+"""
+import asyncio
+import heapq
+import logging
+import os
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from core.search.text import tokenize
+from database.mongo import dishes_collection, ingredients_collection
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_REFRESH_SECONDS = int(os.getenv("SUGGEST_REFRESH_SECONDS", "600"))
+# Số kết quả tốt nhất được nhớ cho mỗi prefix
+_TOP_PER_PREFIX = 50
+# Chỉ index tối đa bấy nhiêu vị trí đầu từ trong 1 tên
+_MAX_WORD_STARTS = 4
+
+DISH = "dish"
+INGREDIENT = "ingredient"
+
+
+class _Entry:
+    __slots__ = ("kind", "ident", "text", "weight", "keys")
+
+    def __init__(self, kind: str, ident: str, text: str, weight: float, keys: List[str]):
+        self.kind = kind
+        self.ident = ident
+        self.text = text
+        self.weight = weight
+        self.keys = keys
+
+
+def _keys(text: str) -> List[str]:
+    tokens = tokenize(text)
+    return [" ".join(tokens[i:]) for i in range(min(len(tokens), _MAX_WORD_STARTS))]
+
+
+def dish_weight(dish: Dict[str, Any]) -> float:
+    """Độ phổ biến của 1 món: lượt thả tim + lượt đánh giá, cộng rating để phân định"""
+    return (
+        int(dish.get("favorite_count") or 0)
+        + int(dish.get("rating_count") or 0)
+        + float(dish.get("average_rating") or 0.0)
+    )
+
+
+class SuggestIndex:
+    """Sorted-array prefix index; dùng từ event loop (không khóa)"""
+
+    def __init__(self):
+        self._keys: List[str] = []
+        self._entries: List[_Entry] = []
+        self._by_ident: Dict[Tuple[str, str], _Entry] = {}
+        # prefix -> (kinds đã sort, None = mọi kind) -> top-k
+        self._top_cache: Dict[str, Dict[Optional[Tuple[str, ...]], List[_Entry]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_ident)
+
+    def _forget_prefixes(self, entry: _Entry) -> None:
+        for key in entry.keys:
+            for end in range(1, len(key) + 1):
+                self._top_cache.pop(key[:end], None)
+
+    def add(self, kind: str, ident: str, text: str, weight: float = 1.0) -> None:
+        """Thêm entry, hoặc cộng weight nếu (kind, ident) đã có"""
+        existing = self._by_ident.get((kind, ident))
+        if existing:
+            existing.weight += weight
+            self._forget_prefixes(existing)
+            return
+        keys = _keys(text)
+        if not keys:
+            return
+        entry = _Entry(kind, ident, text, weight, keys)
+        self._by_ident[(kind, ident)] = entry
+        for key in keys:
+            pos = bisect_right(self._keys, key)
+            self._keys.insert(pos, key)
+            self._entries.insert(pos, entry)
+        self._forget_prefixes(entry)
+
+    def has(self, kind: str, ident: str) -> bool:
+        return (kind, ident) in self._by_ident
+
+    def _top(self, prefix: str, kinds: Optional[Tuple[str, ...]]) -> List[_Entry]:
+        by_kinds = self._top_cache.setdefault(prefix, {})
+        cached = by_kinds.get(kinds)
+        if cached is None:
+            lo = bisect_left(self._keys, prefix)
+            hi = bisect_left(self._keys, prefix + "\uffff")
+            unique = {id(e): e for e in self._entries[lo:hi] if kinds is None or e.kind in kinds}.values()
+            # Lọc kind trước khi cắt top-k, để kind ít weight không bị kind khác đẩy ra ngoài
+            cached = heapq.nlargest(_TOP_PER_PREFIX, unique, key=lambda e: e.weight)
+            by_kinds[kinds] = cached
+        return cached
+
+    def suggest(self, q: str, limit: int = 8, kinds: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        prefix = " ".join(tokenize(q))
+        if not prefix:
+            return []
+        wanted = tuple(sorted(set(kinds))) if kinds else None
+        out: List[Dict[str, Any]] = []
+        for entry in self._top(prefix, wanted):
+            out.append({
+                "text": entry.text,
+                "type": entry.kind,
+                "id": entry.ident if entry.kind == DISH else None,
+                "weight": entry.weight,
+            })
+            if len(out) >= limit:
+                break
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._by_ident), "keys": len(self._keys), "cached_prefixes": len(self._top_cache)}
+
+
+def _add_dish(index: SuggestIndex, dish: Dict[str, Any]) -> None:
+    if dish.get("name"):
+        index.add(DISH, str(dish["_id"]), dish["name"], dish_weight(dish))
+    for name in {n for n in dish.get("ingredients") or [] if isinstance(n, str)}:
+        # Nguyên liệu càng xuất hiện trong nhiều món càng được ưu tiên
+        index.add(INGREDIENT, " ".join(tokenize(name)), name, 1.0)
+
+
+_index = SuggestIndex()
+# Dish được add trong lúc rebuild() đang chạy (None = không có rebuild nào)
+_pending: Optional[List[Dict[str, Any]]] = None
+
+
+def suggest(q: str, limit: int = 8, kinds: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    return _index.suggest(q, limit, kinds)
+
+
+def add_dish(dish: Dict[str, Any]) -> None:
+    """Gọi sau khi insert dish (create_dish, create_dish_with_recipe)"""
+    _add_dish(_index, dish)
+    if _pending is not None:
+        _pending.append(dish)
+
+
+async def rebuild() -> Dict[str, Any]:
+    """Dựng index mới từ Mongo rồi thay thế index đang phục vụ"""
+    global _index, _pending
+    _pending = []
+    try:
+        fresh = SuggestIndex()
+        projection = {"name": 1, "ingredients": 1, "favorite_count": 1, "rating_count": 1, "average_rating": 1}
+        async for dish in dishes_collection.find({}, projection):
+            _add_dish(fresh, dish)
+        async for ingredient in ingredients_collection.find({}, {"name": 1}):
+            name = ingredient.get("name")
+            if isinstance(name, str):
+                fresh.add(INGREDIENT, " ".join(tokenize(name)), name, 1.0)
+        # Phát lại các dish add_dish() trong lúc dựng; dish cursor đã đọc thì bỏ qua để không cộng weight 2 lần
+        for dish in _pending:
+            if not fresh.has(DISH, str(dish["_id"])):
+                _add_dish(fresh, dish)
+        _index = fresh
+    finally:
+        _pending = None
+    return fresh.stats()
+
+
+def suggest_stats() -> Dict[str, Any]:
+    return _index.stats()
+
+
+async def _refresh_loop():
+    while True:
+        try:
+            await rebuild()
+        except Exception as e:
+            logger.error(f"Suggest index rebuild failed: {e}")
+        if SUGGEST_REFRESH_SECONDS <= 0:
+            return
+        await asyncio.sleep(SUGGEST_REFRESH_SECONDS)
+
+
+_refresh_task: Optional[asyncio.Task] = None
+
+
+def start_refresh() -> None:
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(_refresh_loop())
+
+
+def stop_refresh() -> None:
+    if _refresh_task:
+        _refresh_task.cancel()
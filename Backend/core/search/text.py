@@ -0,0 +1,54 @@
+"""
+Text folding and tokenization shared by every search index
+Same folding as AICookingService.normalize_text (NFKD, drop combining marks,
+lowercase) plus đ -> d, which has no decomposition, so "ca chua" matches "Cà chua".
+"""
+import re
+import unicodedata
+from typing import Iterable, List
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+# Prefix độ dài tối đa được index (đủ cho 1 âm tiết tiếng Việt / từ tiếng Anh thông dụng)
+MAX_PREFIX_LENGTH = 12
+# Giới hạn số token / document để list ingredients dài không làm phình index
+MAX_TOKENS_PER_DOC = 400
+
+
+def fold(text: str) -> str:
+    """Bỏ dấu tiếng Việt + lowercase: "Đậu hũ chiên" -> "dau hu chien" """
+    if not text:
+        return ""
+    text = text.replace("đ", "d").replace("Đ", "D")
+    nfkd = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in nfkd if not unicodedata.combining(c)).lower().strip()
+
+
+def tokenize(text: str) -> List[str]:
+    """Các từ (đã fold) theo thứ tự, bỏ dấu câu"""
+    return [t for t in _NON_WORD.split(fold(text)) if t]
+
+
+def words(texts: Iterable[str]) -> List[str]:
+    """Tập từ (không trùng, giữ thứ tự) của nhiều đoạn text"""
+    seen = {}
+    for text in texts:
+        for token in tokenize(text or ""):
+            seen.setdefault(token, None)
+    return list(seen)
+
+
+def prefixes(tokens: Iterable[str]) -> List[str]:
+    """Mọi prefix của từng token (tối đa MAX_PREFIX_LENGTH ký tự), không trùng"""
+    out = {}
+    for token in tokens:
+        for end in range(1, min(len(token), MAX_PREFIX_LENGTH) + 1):
+            out.setdefault(token[:end], None)
+        if len(out) >= MAX_TOKENS_PER_DOC:
+            break
+    return list(out)[:MAX_TOKENS_PER_DOC]
+
+
+def query_tokens(q: str) -> List[str]:
+    """Token của câu truy vấn, cắt theo độ dài prefix đã index"""
+    return [t[:MAX_PREFIX_LENGTH] for t in words([q])]
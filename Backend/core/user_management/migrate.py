@@ -52,8 +52,7 @@ async def check_migration_status():
         "$or": [
             {"followers": {"$exists": True}},
             {"following": {"$exists": True}},
-            {"recipes": {"$exists": True}},
-            {"favorite_dishes": {"$exists": True}}
+            {"recipes": {"$exists": True}}
         ]
     })
     
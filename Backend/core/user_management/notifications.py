@@ -0,0 +1,194 @@
+"""
+Notifications as individual documents
+Each notification is one `notifications` document {user_id, type, message, data,
+read, created_at}, listed newest-first off the (user_id, created_at) index with
+keyset cursors. unread_count lives on the user's user_notifications document and
+moves with $inc in the same transaction as the write that changes it.
+Read notifications expire through a partial TTL index; unread ones are kept, so
+unread_count never counts documents the TTL monitor removed.
+"""
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from database.client import run_in_transaction
+from database.mongo import notifications_collection, user_notifications_collection
+from utils.pagination import apply_cursor, next_cursor, sort_spec
+
+logger = logging.getLogger(__name__)
+
+# Notification đã đọc bị xóa sau số ngày này (TTL index, xem database/indexes.py)
+NOTIFICATION_TTL_DAYS = int(os.getenv("NOTIFICATION_TTL_DAYS", "30"))
+
+
+async def _inc_unread(user_id: str, delta: int, session) -> None:
+    await user_notifications_collection.update_one(
+        {"user_id": user_id},
+        {"$inc": {"unread_count": delta}},
+        upsert=True,
+        session=session,
+    )
+
+
+async def notify(user_id: str, type: str, message: str, data: Optional[Dict[str, Any]] = None) -> str:
+    """Tạo 1 notification chưa đọc cho user_id; trả về id"""
+    doc = {
+        "user_id": user_id,
+        "type": type,
+        "message": message,
+        "data": data or {},
+        "read": False,
+        "created_at": datetime.now(timezone.utc),
+    }
+
+    async def _txn(session):
+        result = await notifications_collection.insert_one(doc, session=session)
+        await _inc_unread(user_id, 1, session)
+        return str(result.inserted_id)
+
+    return await run_in_transaction(_txn)
+
+
+def _to_out(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": str(doc["_id"]),
+        "type": doc.get("type"),
+        "message": doc.get("message", ""),
+        "data": doc.get("data") or {},
+        "read": bool(doc.get("read")),
+        "created_at": doc.get("created_at"),
+    }
+
+
+async def unread_count(user_id: str) -> int:
+    doc = await user_notifications_collection.find_one({"user_id": user_id}, {"_id": 0, "unread_count": 1})
+    return max(int((doc or {}).get("unread_count") or 0), 0)
+
+
+async def list_notifications(
+    user_id: str,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    unread_only: bool = False,
+) -> Dict[str, Any]:
+    """1 trang notification (mới nhất trước) kèm unread_count"""
+    query: Dict[str, Any] = {"user_id": user_id}
+    if unread_only:
+        query["read"] = False
+    docs = await notifications_collection.find(apply_cursor(query, "created_at", -1, cursor)) \
+        .sort(sort_spec("created_at", -1)).limit(limit).to_list(length=limit)
+    return {
+        "notifications": [_to_out(d) for d in docs],
+        "unread_count": await unread_count(user_id),
+        "next_cursor": next_cursor(docs, "created_at", limit),
+    }
+
+
+async def mark_read(user_id: str, ids: Optional[List[str]] = None) -> Dict[str, int]:
+    """Đánh dấu đã đọc các notification trong `ids` (hoặc tất cả nếu ids=None)"""
+    query: Dict[str, Any] = {"user_id": user_id, "read": False}
+    if ids is not None:
+        query["_id"] = {"$in": [ObjectId(i) for i in ids if ObjectId.is_valid(i)]}
+
+    async def _txn(session):
+        result = await notifications_collection.update_many(
+            query,
+            {"$set": {"read": True, "read_at": datetime.now(timezone.utc)}},
+            session=session,
+        )
+        if result.modified_count:
+            await _inc_unread(user_id, -result.modified_count, session)
+        return result.modified_count
+
+    marked = await run_in_transaction(_txn)
+    return {"marked": marked, "unread_count": await unread_count(user_id)}
+
+
+def _legacy_created_at(item: Dict[str, Any], fallback: datetime) -> datetime:
+    created_at = item.get("created_at")
+    # Bản cũ ghi chuỗi "now" thay vì thời gian thật
+    return created_at if isinstance(created_at, datetime) else fallback
+
+
+def _legacy_docs(user_id: str, items, fallback: datetime) -> List[Dict[str, Any]]:
+    """Document notifications cho các phần tử của 1 mảng notifications nhúng kiểu cũ"""
+    return [{
+        "user_id": user_id,
+        "type": item.get("type"),
+        "message": item.get("message", ""),
+        "data": item.get("data") or {},
+        "read": bool(item.get("read")),
+        "created_at": _legacy_created_at(item, fallback),
+    } for item in items or [] if isinstance(item, dict)]
+
+
+async def import_notifications(user_id: str, items) -> int:
+    """
+    Ghi mảng notifications cũ của 1 user (vd. trên users) thành document riêng;
+    unread_count tăng đúng bằng số document chưa đọc vừa ghi. Trả về số document đã ghi.
+    """
+    docs = _legacy_docs(user_id, items, datetime.now(timezone.utc))
+    if not docs:
+        return 0
+
+    async def _txn(session):
+        await notifications_collection.insert_many(docs, session=session)
+        unread = sum(1 for d in docs if not d["read"])
+        if unread:
+            await _inc_unread(user_id, unread, session)
+
+    await run_in_transaction(_txn)
+    return len(docs)
+
+
+async def migrate_embedded_notifications(batch_size: int = 200) -> Dict[str, int]:
+    """
+    Chuyển mảng `notifications` nhúng trong user_notifications (dữ liệu cũ) sang collection
+    notifications. Mỗi user chạy trong 1 transaction (nhận mảng bằng $unset + insert + đặt lại
+    unread_count); mảng chỉ được insert bởi lệnh $unset được nó nên không tạo bản trùng.
+    Lúc startup chạy 1 lần cho cả cluster qua run_once.
+    """
+    legacy_q = {"notifications": {"$exists": True}}
+    users = moved = 0
+    while True:
+        batch = await user_notifications_collection.find(
+            legacy_q, {"user_id": 1, "notifications": 1}
+        ).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+        for holder in batch:
+            async def _txn(session, holder_id=holder["_id"]):
+                # Đọc và $unset trong 1 lệnh: chỉ ai lấy được mảng mới insert, nên worker khác
+                # hoặc lần chạy lại (kể cả không có transaction) không insert trùng
+                claimed = await user_notifications_collection.find_one_and_update(
+                    {"_id": holder_id, "notifications": {"$exists": True}},
+                    {"$unset": {"notifications": ""}},
+                    projection={"user_id": 1, "notifications": 1},
+                    return_document=ReturnDocument.BEFORE,
+                    session=session,
+                )
+                if not claimed:
+                    return None
+                docs = _legacy_docs(claimed["user_id"], claimed.get("notifications"), holder_id.generation_time)
+                if docs:
+                    await notifications_collection.insert_many(docs, session=session)
+                unread = await notifications_collection.count_documents(
+                    {"user_id": claimed["user_id"], "read": False}, session=session
+                )
+                await user_notifications_collection.update_one(
+                    {"_id": holder_id}, {"$set": {"unread_count": unread}}, session=session
+                )
+                return len(docs)
+
+            count = await run_in_transaction(_txn)
+            if count is not None:
+                users += 1
+                moved += count
+
+    if users:
+        logger.info(f"Moved {moved} embedded notifications of {users} users to notifications")
+    return {"users": users, "notifications": moved}
@@ -12,9 +12,42 @@ from database.mongo import (
 from models.user_model import UserSocial, UserActivity, UserNotifications, UserPreferences
 from fastapi import HTTPException, Request
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from typing import Optional, Dict, Any
+import asyncio
+import secrets
 import firebase_admin
 from firebase_admin import auth as fb_auth
+from core.auth.verifier import verify_id_token_async, TokenVerifierBusy, TokenVerifierTimeout
+from utils.history import append_unique_pipeline
+from database.client import run_in_transaction
+from core.user_management import notifications, social
+from core.search.index import search_fields
+
+
+# Document mặc định của các collections phụ (user_id được thêm khi upsert)
+DEFAULT_USER_SOCIAL = {
+    # Danh sách follow nằm trong user_follows (core/user_management/social.py)
+    "follower_count": 0,
+    "following_count": 0
+}
+DEFAULT_USER_ACTIVITY = {
+    "favorite_dishes": [],
+    "cooked_dishes": [],
+    "viewed_dishes": [],
+    "created_recipes": [],
+    "created_dishes": []
+}
+DEFAULT_USER_NOTIFICATIONS = {
+    # Từng notification nằm trong collection notifications (core/user_management/notifications.py)
+    "unread_count": 0
+}
+DEFAULT_USER_PREFERENCES = {
+    "reminders": [],
+    "dietary_restrictions": [],
+    "cuisine_preferences": [],
+    "difficulty_preference": "all"
+}
 
 
 # ==================== AUTH HELPERS ====================
@@ -30,9 +63,11 @@ async def get_current_user_async(request: Request) -> Dict[str, Any]:
     id_token = auth_header.split(" ", 1)[1].strip()
 
     try:
-        # Firebase verify is sync, but we can make it async-compatible
-        decoded = fb_auth.verify_id_token(id_token, check_revoked=True)
+        # Firebase verify is sync -> chạy trong thread pool riêng, không block event loop
+        decoded = await verify_id_token_async(id_token, check_revoked=True)
         return decoded
+    except (TokenVerifierBusy, TokenVerifierTimeout):
+        raise HTTPException(status_code=503, detail="Authentication service busy, please retry")
     except fb_auth.ExpiredIdTokenError:
         raise HTTPException(status_code=401, detail="Token expired")
     except fb_auth.RevokedIdTokenError:
@@ -91,6 +126,53 @@ def user_helper(user) -> dict:
     }
 
 
+# ==================== USER CREATION ====================
+
+# Số hậu tố 1, 2, ... được thử cho display_id trước khi dùng hậu tố ngẫu nhiên
+DISPLAY_ID_ATTEMPTS = 20
+
+
+def is_duplicate_on(error: DuplicateKeyError, field: str) -> bool:
+    """DuplicateKeyError này có phải do unique index trên `field` không"""
+    details = error.details or {}
+    return field in (details.get("keyPattern") or details.get("keyValue") or {}) or f"{field}_1" in str(error)
+
+
+async def _free_display_id(base: str, counter: int):
+    """base, base1, base2, ... (bắt đầu từ hậu tố `counter`): giá trị đầu tiên chưa có user nào dùng"""
+    while True:
+        candidate = f"{base}{counter}" if counter else base
+        if not await users_collection.find_one({"display_id": candidate}, {"_id": 1}):
+            return candidate, counter
+        counter += 1
+
+
+async def insert_user(user_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Insert user mới, chọn display_id chưa bị dùng (user_data["display_id"] là giá trị gốc).
+    Nếu request khác chiếm display_id giữa lúc kiểm tra và insert thì thử hậu tố kế tiếp;
+    DuplicateKeyError trên email (user đã được tạo song song) được raise cho caller xử lý.
+    Trả về document đã insert (có _id).
+    """
+    base = user_data.get("display_id") or "user"
+    counter = 0
+    for attempt in range(DISPLAY_ID_ATTEMPTS + 1):
+        if attempt < DISPLAY_ID_ATTEMPTS:
+            display_id, counter = await _free_display_id(base, counter)
+        else:
+            display_id = f"{base}{secrets.token_hex(3)}"
+        doc = {**user_data, "display_id": display_id}
+        doc.update(search_fields("users", doc))
+        try:
+            await users_collection.insert_one(doc)
+            return doc
+        except DuplicateKeyError as e:
+            if not is_duplicate_on(e, "display_id"):
+                raise
+            counter += 1
+    raise HTTPException(status_code=409, detail="Could not allocate a display ID")
+
+
 # ==================== USER DATA SERVICE ====================
 
 class UserDataService:
@@ -130,139 +212,104 @@ class UserDataService:
     
     @staticmethod
     async def init_user_data(user_id: str):
-        """Khởi tạo data cho user mới"""
-        # Tạo social data
-        await user_social_collection.insert_one({
-            "user_id": user_id,
-            "followers": [],
-            "following": [],
-            "follower_count": 0,
-            "following_count": 0
-        })
-        
-        # Tạo activity data
-        await user_activity_collection.insert_one({
-            "user_id": user_id,
-            "favorite_dishes": [],
-            "cooked_dishes": [],
-            "viewed_dishes": [],
-            "created_recipes": [],
-            "created_dishes": []
-        })
-        
-        # Tạo notifications data
-        await user_notifications_collection.insert_one({
-            "user_id": user_id,
-            "notifications": [],
-            "unread_count": 0
-        })
-        
-        # Tạo preferences data
-        await user_preferences_collection.insert_one({
-            "user_id": user_id,
-            "reminders": [],
-            "dietary_restrictions": [],
-            "cuisine_preferences": [],
-            "difficulty_preference": "all"
-        })
+        """
+        Khởi tạo data cho user mới: 4 upsert chạy song song trên index unique user_id.
+        Idempotent - gọi lại cho user đã có (hoặc mới có một phần) data chỉ tạo phần còn thiếu.
+        """
+        async def _provision(collection, defaults: Dict[str, Any]):
+            try:
+                await collection.update_one(
+                    {"user_id": user_id},
+                    {"$setOnInsert": defaults},
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                # Request khác vừa tạo cùng document
+                pass
+
+        await asyncio.gather(*(
+            _provision(collection, defaults)
+            for collection, defaults in (
+                (user_social_collection, DEFAULT_USER_SOCIAL),
+                (user_activity_collection, DEFAULT_USER_ACTIVITY),
+                (user_notifications_collection, DEFAULT_USER_NOTIFICATIONS),
+                (user_preferences_collection, DEFAULT_USER_PREFERENCES),
+            )
+        ))
     
+    @staticmethod
+    async def _append_history(field: str, user_id: str, dish_id: str, max_history: int) -> bool:
+        """
+        Thêm dish_id vào cuối list `field` (bỏ qua nếu đã có, giữ max_history món mới nhất)
+        trong 1 update pipeline. Trả về False nếu món đã có sẵn trong list.
+        """
+        pipeline = append_unique_pipeline(field, dish_id, max_history)
+        result = await user_activity_collection.update_one({"user_id": user_id}, pipeline)
+        if not result.matched_count:
+            # User chưa có activity doc (tạo dở) -> khởi tạo rồi thử lại
+            await UserDataService.init_user_data(user_id)
+            result = await user_activity_collection.update_one({"user_id": user_id}, pipeline)
+        return bool(result.modified_count)
+
     @staticmethod
     async def add_to_cooked(user_id: str, dish_id: str, max_history: int = 50):
         """Thêm món ăn vào lịch sử đã nấu"""
-        activity = await user_activity_collection.find_one({"user_id": user_id})
-        
-        if not activity:
-            await UserDataService.init_user_data(user_id)
-            activity = {"cooked_dishes": []}
-        
-        cooked = activity.get("cooked_dishes", [])
-        
-        if dish_id in cooked:
+        if not await UserDataService._append_history("cooked_dishes", user_id, dish_id, max_history):
             return {"msg": "Dish already in cooked history"}
-        
-        if len(cooked) >= max_history:
-            cooked = cooked[1:]  # Xóa món cũ nhất
-        
-        cooked.append(dish_id)
-        
-        await user_activity_collection.update_one(
-            {"user_id": user_id},
-            {"$set": {"cooked_dishes": cooked}}
-        )
-        
         return {"msg": "Dish added to cooked history"}
     
     @staticmethod
     async def add_to_viewed(user_id: str, dish_id: str, max_history: int = 50):
         """Thêm món ăn vào lịch sử đã xem"""
-        activity = await user_activity_collection.find_one({"user_id": user_id})
-        
-        if not activity:
-            await UserDataService.init_user_data(user_id)
-            activity = {"viewed_dishes": []}
-        
-        viewed = activity.get("viewed_dishes", [])
-        
-        if dish_id in viewed:
+        if not await UserDataService._append_history("viewed_dishes", user_id, dish_id, max_history):
             return {"msg": "Dish already in viewed history"}
-        
-        if len(viewed) >= max_history:
-            viewed = viewed[1:]  # Xóa món cũ nhất
-        
-        viewed.append(dish_id)
-        
-        await user_activity_collection.update_one(
-            {"user_id": user_id},
-            {"$set": {"viewed_dishes": viewed}}
-        )
-        
         return {"msg": "Dish added to viewed history"}
     
     @staticmethod
     async def add_to_favorites(user_id: str, dish_id: str):
-        """Thêm món ăn vào danh sách yêu thích"""
-        await user_activity_collection.update_one(
-            {"user_id": user_id},
-            {"$addToSet": {"favorite_dishes": dish_id}}
+        """Thêm món ăn vào danh sách yêu thích (+ favorite_count của dish, thông báo milestone)"""
+        from core.dish_management.favorites import add_favorite, notify_milestone
+
+        if not ObjectId.is_valid(dish_id):
+            raise HTTPException(status_code=400, detail="Invalid dish ID")
+        if not ObjectId.is_valid(user_id):
+            raise HTTPException(status_code=400, detail="Invalid user ID")
+        added, dish = await run_in_transaction(
+            lambda session: add_favorite(ObjectId(user_id), ObjectId(dish_id), session)
         )
-        return {"msg": "Dish added to favorites"}
-    
+        if not added:
+            return {"msg": "Dish already in favorites", "favorite_count": dish.get("favorite_count", 0)}
+        await notify_milestone(dish)
+        return {"msg": "Dish added to favorites", "favorite_count": dish.get("favorite_count", 0)}
+
     @staticmethod
-    async def follow_user(follower_id: str, following_id: str):
-        """User follow user khác"""
-        # Thêm vào following list của follower
-        await user_social_collection.update_one(
-            {"user_id": follower_id},
-            {"$addToSet": {"following": following_id}}
-        )
-        
-        # Thêm vào followers list của người được follow
-        await user_social_collection.update_one(
-            {"user_id": following_id},
-            {"$addToSet": {"followers": follower_id}}
+    async def remove_from_favorites(user_id: str, dish_id: str):
+        """Bỏ món ăn khỏi danh sách yêu thích (- favorite_count của dish)"""
+        from core.dish_management.favorites import remove_favorite
+
+        if not ObjectId.is_valid(dish_id) or not ObjectId.is_valid(user_id):
+            raise HTTPException(status_code=400, detail="Invalid ID")
+        removed, dish = await run_in_transaction(
+            lambda session: remove_favorite(ObjectId(user_id), ObjectId(dish_id), session)
         )
-        
-        # Cập nhật counter
-        await UserDataService._update_social_counters(follower_id)
-        await UserDataService._update_social_counters(following_id)
-        
-        return {"msg": "Successfully followed user"}
+        if not removed:
+            return {"msg": "Dish not in favorites"}
+        return {"msg": "Dish removed from favorites", "favorite_count": (dish or {}).get("favorite_count", 0)}
+
+    @staticmethod
+    async def follow_user(follower_id: str, following_id: str):
+        """User follow user khác (edge trong user_follows + $inc counter)"""
+        follower_count = await social.follow(follower_id, following_id)
+        if follower_count is None:
+            return {"msg": "Already following", "follower_count": None}
+        return {"msg": "Successfully followed user", "follower_count": follower_count}
     
     @staticmethod
-    async def _update_social_counters(user_id: str):
-        """Cập nhật số lượng followers/following"""
-        social = await user_social_collection.find_one({"user_id": user_id})
-        if social:
-            follower_count = len(social.get("followers", []))
-            following_count = len(social.get("following", []))
-            
-            await user_social_collection.update_one(
-                {"user_id": user_id},
-                {"$set": {
-                    "follower_count": follower_count,
-                    "following_count": following_count
-                }}
-            )
+    async def unfollow_user(follower_id: str, following_id: str):
+        """Bỏ follow"""
+        if not await social.unfollow(follower_id, following_id):
+            return {"msg": "Not following"}
+        return {"msg": "Successfully unfollowed user"}
 
     # ==================== MIGRATION HELPERS ====================
     
@@ -271,24 +318,12 @@ class UserDataService:
         """Migration một user từ structure cũ sang mới"""
         user_id = str(user["_id"])
         
-        # Migrate social data
-        social_data = {
-            "user_id": user_id,
-            "followers": user.get("followers", []),
-            "following": user.get("following", []),
-            "follower_count": len(user.get("followers", [])),
-            "following_count": len(user.get("following", []))
-        }
-        await user_social_collection.update_one(
-            {"user_id": user_id},
-            {"$set": social_data},
-            upsert=True
-        )
+        # Migrate social data: edge trong user_follows, counter đếm lại từ edges
+        await social.import_follows(user_id, user.get("followers", []), user.get("following", []))
         
         # Migrate activity data
         activity_data = {
             "user_id": user_id,
-            "favorite_dishes": user.get("favorite_dishes", []),
             "cooked_dishes": user.get("cooked_dishes", []),
             "viewed_dishes": user.get("viewed_dishes", []),
             "created_recipes": user.get("recipes", []),
@@ -300,17 +335,8 @@ class UserDataService:
             upsert=True
         )
         
-        # Migrate notifications data
-        notif_data = {
-            "user_id": user_id,
-            "notifications": user.get("notifications", []),
-            "unread_count": len(user.get("notifications", []))
-        }
-        await user_notifications_collection.update_one(
-            {"user_id": user_id},
-            {"$set": notif_data},
-            upsert=True
-        )
+        # Migrate notifications data: document riêng, unread_count tăng theo số chưa đọc
+        await notifications.import_notifications(user_id, user.get("notifications", []))
         
         # Migrate preferences data
         pref_data = {
@@ -326,14 +352,13 @@ class UserDataService:
             upsert=True
         )
         
-        # Clean up old fields from users collection
+        # Clean up old fields from users collection (favorite_dishes ở lại users: nơi duy nhất lưu yêu thích)
         await users_collection.update_one(
             {"_id": user["_id"]},
             {"$unset": {
                 "followers": "",
                 "following": "",
                 "recipes": "",
-                "favorite_dishes": "",
                 "cooked_dishes": "",
                 "viewed_dishes": "",
                 "notifications": "",
@@ -354,7 +379,7 @@ class UserDataService:
         for user in users:
             try:
                 # Check if already migrated (no old fields)
-                if not any(field in user for field in ["followers", "following", "recipes", "favorite_dishes"]):
+                if not any(field in user for field in ["followers", "following", "recipes"]):
                     continue
                 
                 result = await UserDataService.migrate_single_user(user)
@@ -0,0 +1,218 @@
+"""
+Social graph stored as edge documents
+One `user_follows` document per follow {follower_id, following_id, created_at},
+unique on the pair. follower_count / following_count on user_social are kept
+with $inc in the same transaction as the edge write, and follower / following
+lists are keyset-paginated straight off the (user, created_at) indexes.
+Follower milestones are notified once each: follower_milestone on user_social is
+the highest one already announced, so unfollow/follow around a step stays quiet.
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from core.user_management import notifications
+from database.client import run_in_transaction
+from database.mongo import user_follows_collection, user_social_collection
+from utils.pagination import apply_cursor, next_cursor, sort_spec
+
+logger = logging.getLogger(__name__)
+
+_COUNTERS_PROJECTION = {"_id": 0, "follower_count": 1, "following_count": 1}
+
+# Thông báo cho user mỗi khi số follower vượt qua bội số này
+FOLLOWER_MILESTONE_STEP = 5
+
+
+async def _inc_counter(user_id: str, field: str, delta: int, session) -> Optional[Dict[str, Any]]:
+    return await user_social_collection.find_one_and_update(
+        {"user_id": user_id},
+        {"$inc": {field: delta}},
+        projection=_COUNTERS_PROJECTION,
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+        session=session,
+    )
+
+
+async def follow(follower_id: str, following_id: str) -> Optional[int]:
+    """
+    Tạo edge follower -> following. Trả về follower_count mới của người được follow,
+    hoặc None nếu đã follow từ trước.
+    """
+    async def _txn(session):
+        await user_follows_collection.insert_one(
+            {"follower_id": follower_id, "following_id": following_id, "created_at": datetime.now(timezone.utc)},
+            session=session,
+        )
+        await _inc_counter(follower_id, "following_count", 1, session)
+        followee = await _inc_counter(following_id, "follower_count", 1, session)
+        return int(followee.get("follower_count") or 0)
+
+    try:
+        return await run_in_transaction(_txn)
+    except DuplicateKeyError:
+        return None
+
+
+async def unfollow(follower_id: str, following_id: str) -> bool:
+    """Xóa edge; False nếu chưa follow"""
+    async def _txn(session):
+        removed = await user_follows_collection.delete_one(
+            {"follower_id": follower_id, "following_id": following_id}, session=session
+        )
+        if not removed.deleted_count:
+            return False
+        await _inc_counter(follower_id, "following_count", -1, session)
+        await _inc_counter(following_id, "follower_count", -1, session)
+        return True
+
+    return await run_in_transaction(_txn)
+
+
+async def notify_follower_milestone(user_id: str, follower_count: int) -> bool:
+    """
+    Thông báo nếu follower_count (ngay sau $inc) đạt mốc chưa từng thông báo;
+    mốc được nhận bằng update có điều kiện nên mỗi mốc chỉ gửi 1 lần
+    """
+    milestone = follower_count - follower_count % FOLLOWER_MILESTONE_STEP
+    if milestone <= 0:
+        return False
+    claimed = await user_social_collection.update_one(
+        {"user_id": user_id, "follower_milestone": {"$not": {"$gte": milestone}}},
+        {"$set": {"follower_milestone": milestone}},
+    )
+    if not claimed.modified_count:
+        return False
+    try:
+        await notifications.notify(
+            user_id,
+            "milestone",
+            f"Bạn đã có {milestone} người theo dõi!",
+            {"follower_count": milestone},
+        )
+    except Exception as e:
+        # Thông báo hỏng không được làm hỏng lượt follow
+        logger.error(f"Follower milestone notification failed for user {user_id}: {e}")
+        return False
+    return True
+
+
+async def is_following(follower_id: str, following_id: str) -> bool:
+    edge = await user_follows_collection.find_one(
+        {"follower_id": follower_id, "following_id": following_id}, {"_id": 1}
+    )
+    return edge is not None
+
+
+async def get_counters(user_id: str) -> Dict[str, int]:
+    doc = await user_social_collection.find_one({"user_id": user_id}, _COUNTERS_PROJECTION) or {}
+    return {
+        "follower_count": max(int(doc.get("follower_count") or 0), 0),
+        "following_count": max(int(doc.get("following_count") or 0), 0),
+    }
+
+
+async def _list_edges(key: str, user_id: str, other: str, limit: int, cursor: Optional[str]) -> Dict[str, Any]:
+    query = apply_cursor({key: user_id}, "created_at", -1, cursor)
+    edges = await user_follows_collection.find(query, {other: 1, "created_at": 1}) \
+        .sort(sort_spec("created_at", -1)).limit(limit).to_list(length=limit)
+    return {
+        "items": [{"user_id": e[other], "followed_at": e.get("created_at")} for e in edges],
+        "next_cursor": next_cursor(edges, "created_at", limit),
+    }
+
+
+async def list_followers(user_id: str, limit: int = 20, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """Người follow user_id, mới nhất trước"""
+    return await _list_edges("following_id", user_id, "follower_id", limit, cursor)
+
+
+async def list_following(user_id: str, limit: int = 20, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """Người mà user_id đang follow, mới nhất trước"""
+    return await _list_edges("follower_id", user_id, "following_id", limit, cursor)
+
+
+def _edge_ops(user_id: str, followers, following, created_at: datetime, touched: set) -> List[UpdateOne]:
+    """Upsert edge cho danh sách followers/following nhúng của 1 user; ghi các user liên quan vào `touched`"""
+    pairs = [(user_id, str(f)) for f in following or []]
+    pairs += [(str(f), user_id) for f in followers or []]
+    ops: List[UpdateOne] = []
+    for follower_id, following_id in pairs:
+        if follower_id == following_id:
+            continue
+        touched.update((follower_id, following_id))
+        ops.append(UpdateOne(
+            {"follower_id": follower_id, "following_id": following_id},
+            {"$setOnInsert": {"created_at": created_at}},
+            upsert=True,
+        ))
+    return ops
+
+
+async def import_follows(user_id: str, followers, following) -> Dict[str, int]:
+    """
+    Ghi followers/following cũ của 1 user (vd. mảng trên users) thành edge trong user_follows
+    rồi đếm lại counter của các user liên quan; không tạo mảng nhúng nào
+    """
+    touched: set = set()
+    ops = _edge_ops(user_id, followers, following, datetime.now(timezone.utc), touched)
+    if ops:
+        await user_follows_collection.bulk_write(ops, ordered=False)
+    for other in touched - {user_id}:
+        await recount(other)
+    return await recount(user_id)
+
+
+async def migrate_embedded_follows(batch_size: int = 500) -> Dict[str, int]:
+    """
+    Chuyển followers/following (mảng nhúng trong user_social, dữ liệu cũ) sang user_follows,
+    đếm lại counter của các user liên quan rồi $unset 2 mảng. Idempotent (upsert theo
+    unique index) và tự resume: document đã chuyển không còn khớp filter.
+    """
+    legacy_q = {"$or": [{"followers": {"$exists": True}}, {"following": {"$exists": True}}]}
+    migrated_docs = recounted = 0
+    while True:
+        batch = await user_social_collection.find(
+            legacy_q, {"user_id": 1, "followers": 1, "following": 1}
+        ).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+
+        ops: List[UpdateOne] = []
+        touched: set = set()
+        for social in batch:
+            ops += _edge_ops(
+                social["user_id"], social.get("followers"), social.get("following"),
+                social["_id"].generation_time, touched,
+            )
+        if ops:
+            await user_follows_collection.bulk_write(ops, ordered=False)
+        await user_social_collection.update_many(
+            {"_id": {"$in": [s["_id"] for s in batch]}},
+            {"$unset": {"followers": "", "following": ""}},
+        )
+        # Đếm lại ngay trong batch để lần chạy sau (nếu bị ngắt) không bỏ sót
+        for user_id in touched:
+            await recount(user_id)
+        migrated_docs += len(batch)
+        recounted += len(touched)
+
+    if migrated_docs:
+        logger.info(f"Moved embedded follows of {migrated_docs} users to user_follows")
+    return {"social_docs": migrated_docs, "users_recounted": recounted}
+
+
+async def recount(user_id: str) -> Dict[str, int]:
+    """Đặt lại counter từ edges (dùng cho migration / đối soát)"""
+    follower_count = await user_follows_collection.count_documents({"following_id": user_id})
+    following_count = await user_follows_collection.count_documents({"follower_id": user_id})
+    await user_social_collection.update_one(
+        {"user_id": user_id},
+        {"$set": {"follower_count": follower_count, "following_count": following_count}},
+        upsert=True,
+    )
+    return {"follower_count": follower_count, "following_count": following_count}
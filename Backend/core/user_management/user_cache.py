@@ -0,0 +1,35 @@
+"""
+Process-wide cache of resolved user documents, keyed by Firebase uid
+Short TTL keeps other workers' writes visible; local writes call invalidate_user()
+"""
+import os
+from typing import Any, Dict, Optional
+
+from utils.ttl_cache import TTLCache
+
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+
+_user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+
+
+def get_cached_user(uid: str) -> Optional[Dict[str, Any]]:
+    user = _user_cache.get(uid)
+    # Copy so a handler mutating its document can't corrupt the shared entry
+    return dict(user) if user is not None else None
+
+
+def cache_user(uid: str, user: Dict[str, Any]) -> None:
+    if uid and user:
+        _user_cache.set(uid, dict(user))
+
+
+def invalidate_user(uid: Optional[str]) -> None:
+    """Call after any write to the users document (profile update, favorites, ...)"""
+    if uid:
+        _user_cache.pop(uid)
+
+
+def user_cache_stats() -> Dict[str, Any]:
+    return _user_cache.stats()
@@ -0,0 +1,191 @@
+"""
+Shared MongoDB client factory
+One AsyncIOMotorClient (one connection pool) per worker process, created on app
+startup (connect_client) and closed on shutdown (close_client).
+Pool / compression / read preference are tuned from the environment.
+Modules hold LazyCollection / LazyDatabase handles (database/mongo.py) that resolve
+through get_client() on use, so importing them never opens a client and nothing
+keeps pointing at a closed one; use after close_client() raises instead.
+"""
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import motor.motor_asyncio
+from pymongo import monitoring
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MONGODB_URI = os.getenv("MONGODB_URI")
+DB_NAME = os.getenv("DATABASE_NAME", "cook_app")
+
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+# e.g. "zstd,snappy" (needs the zstandard / python-snappy packages), "zlib", or empty for none
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+MONGO_TLS = os.getenv("MONGO_TLS", "True").lower() == "true"
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000"))
+# Multi-document transactions need a replica set (Atlas); turn off for a standalone dev server
+MONGO_TRANSACTIONS = os.getenv("MONGO_TRANSACTIONS", "True").lower() == "true"
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Counts pool events; pymongo calls these from its own threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {
+            "connections_created": 0,
+            "connections_closed": 0,
+            "checked_out": 0,
+            "checkout_failed": 0,
+            "pool_cleared": 0,
+        }
+        self.in_use = 0
+
+    def _inc(self, name: str, in_use_delta: int = 0):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+            self.in_use += in_use_delta
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+    def pool_cleared(self, event):
+        self._inc("pool_cleared")
+
+    def connection_created(self, event):
+        self._inc("connections_created")
+
+    def connection_closed(self, event):
+        self._inc("connections_closed")
+
+    def connection_check_out_failed(self, event):
+        self._inc("checkout_failed")
+
+    def connection_checked_out(self, event):
+        self._inc("checked_out", 1)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            open_connections = self.counters["connections_created"] - self.counters["connections_closed"]
+            return {
+                **self.counters,
+                "open_connections": open_connections,
+                "in_use": self.in_use,
+                "idle": max(open_connections - self.in_use, 0),
+                "max_pool_size": MONGO_MAX_POOL_SIZE,
+                "min_pool_size": MONGO_MIN_POOL_SIZE,
+            }
+
+
+pool_metrics = PoolMetrics()
+_client: Optional[motor.motor_asyncio.AsyncIOMotorClient] = None
+_closed = False
+
+
+def _client_options() -> Dict[str, Any]:
+    options: Dict[str, Any] = {
+        "tls": MONGO_TLS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "readPreference": MONGO_READ_PREFERENCE,
+        "event_listeners": [pool_metrics],
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
+
+def get_client() -> motor.motor_asyncio.AsyncIOMotorClient:
+    """Return the process-wide client, creating it on first use (Motor connects lazily)"""
+    global _client
+    if _client is None:
+        if _closed:
+            raise RuntimeError("MongoDB client is closed (used after app shutdown)")
+        _client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URI, **_client_options())
+    return _client
+
+
+def get_database():
+    return get_client()[DB_NAME]
+
+
+class LazyCollection:
+    """Collection handle resolved through get_client() on use (re-resolved if the client changed)"""
+
+    __slots__ = ("name", "_client", "_collection")
+
+    def __init__(self, name: str):
+        self.name = name
+        self._client = None
+        self._collection = None
+
+    def _resolve(self):
+        client = get_client()
+        if self._client is not client:
+            self._collection = client[DB_NAME][self.name]
+            self._client = client
+        return self._collection
+
+    def __getattr__(self, attr: str):
+        return getattr(self._resolve(), attr)
+
+    def __repr__(self) -> str:
+        return f"LazyCollection({DB_NAME}.{self.name})"
+
+
+class LazyDatabase:
+    """Database handle: db["name"] gives a LazyCollection, anything else resolves the database"""
+
+    def __getitem__(self, name: str) -> LazyCollection:
+        return LazyCollection(name)
+
+    def __getattr__(self, attr: str):
+        return getattr(get_database(), attr)
+
+    def __repr__(self) -> str:
+        return f"LazyDatabase({DB_NAME})"
+
+
+async def connect_client():
+    """Create the client on app startup and warm the pool so the first request doesn't pay for TLS handshakes"""
+    global _closed
+    _closed = False
+    await get_client().admin.command("ping")
+
+
+def close_client():
+    """Close the client on app shutdown; later use of any handle raises until connect_client()"""
+    global _client, _closed
+    _closed = True
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+async def run_in_transaction(callback: Callable[[Any], Awaitable[Any]]) -> Any:
+    """
+    Run `callback(session)` in a transaction (retried on transient errors).
+    With MONGO_TRANSACTIONS off, runs it once with session=None.
+    """
+    if not MONGO_TRANSACTIONS:
+        return await callback(None)
+    async with await get_client().start_session() as session:
+        return await session.with_transaction(callback)
+
+
+def pool_stats() -> Dict[str, Any]:
+    return pool_metrics.snapshot()
@@ -0,0 +1,148 @@
+"""
+Declarative index registry
+Every hot query path declares its index here; ensure_indexes() applies the whole
+registry idempotently at startup and index_report() diffs it against the server.
+Index names are pymongo's defaults (e.g. "dish_id_1_created_at_-1") so indexes
+created earlier by hand or by older code are recognised instead of conflicting.
+"""
+import logging
+import os
+from typing import Any, Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+logger = logging.getLogger(__name__)
+
+# Only index non-empty strings so legacy "" values don't collide on unique indexes
+_NON_EMPTY = {"$gt": ""}
+
+# TTL của notification đã đọc (core/user_management/notifications.py)
+_NOTIFICATION_TTL_SECONDS = int(os.getenv("NOTIFICATION_TTL_DAYS", "30")) * 86400
+
+INDEX_REGISTRY: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True,
+                   partialFilterExpression={"email": _NON_EMPTY}),
+        IndexModel([("display_id", ASCENDING)], unique=True,
+                   partialFilterExpression={"display_id": _NON_EMPTY}),
+        IndexModel([("firebase_uid", ASCENDING)], sparse=True),
+        # /search/users (core/search/index.py)
+        IndexModel([("search_tokens", ASCENDING)]),
+        # Backfill document có search fields từ phiên bản cũ
+        IndexModel([("search_version", ASCENDING)]),
+    ],
+    "user_social": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+    ],
+    # Edge 1 lượt follow; list followers / following theo thứ tự mới nhất
+    "user_follows": [
+        IndexModel([("follower_id", ASCENDING), ("following_id", ASCENDING)], unique=True),
+        IndexModel([("following_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("follower_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ],
+    "user_activity": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+    ],
+    "user_notifications": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+    ],
+    "notifications": [
+        # List mới nhất trước (+ keyset), lọc unread
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("read", ASCENDING), ("created_at", DESCENDING)]),
+        # Chỉ notification đã đọc mới hết hạn -> unread_count luôn khớp
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=_NOTIFICATION_TTL_SECONDS,
+                   partialFilterExpression={"read": True}),
+    ],
+    "user_preferences": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+    ],
+    "dishes": [
+        # Feed / suggest-today: newest first, _id tie-break for keyset pagination
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)]),
+        # /dishes/high-rated: rating range + sort
+        IndexModel([("average_rating", DESCENDING), ("_id", DESCENDING)]),
+        # /search/dishes/by-time(-rating)
+        IndexModel([("cooking_time", ASCENDING), ("average_rating", DESCENDING)]),
+        # /search/dishes/filter (core/search/filters.py): difficulty equality first, then the
+        # sort field (+ _id for keyset pages); the other range filter is applied on the keys
+        IndexModel([("difficulty", ASCENDING), ("average_rating", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("difficulty", ASCENDING), ("cooking_time", ASCENDING), ("_id", ASCENDING)]),
+        # /search/dishes/filter?sort=time without difficulty
+        IndexModel([("cooking_time", ASCENDING), ("_id", ASCENDING)]),
+        # /users/{id}/dishes (legacy field, until the owner_id backfill is done)
+        IndexModel([("creator_id", ASCENDING), ("created_at", DESCENDING)]),
+        # /dishes/my-dishes, /dishes?my_dishes=true
+        IndexModel([("owner_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        # /search/dishes, /search/all (token prefixes, core/search/index.py)
+        IndexModel([("search_tokens", ASCENDING)]),
+        IndexModel([("search_version", ASCENDING)]),
+        # /search/dishes-by-ingredients: ingredient -> dish posting lists (core/search/ingredients.py)
+        IndexModel([("ingredient_keys", ASCENDING)]),
+    ],
+    # Optional raw rating history (DISH_RATING_HISTORY)
+    "dish_ratings": [
+        IndexModel([("dish_id", ASCENDING), ("created_at", DESCENDING)]),
+    ],
+    "recipes": [
+        IndexModel([("created_by", ASCENDING)]),
+        IndexModel([("dish_id", ASCENDING)]),
+        IndexModel([("search_tokens", ASCENDING)]),
+        IndexModel([("search_version", ASCENDING)]),
+    ],
+    "ingredients": [
+        IndexModel([("search_tokens", ASCENDING)]),
+        IndexModel([("search_version", ASCENDING)]),
+    ],
+    "comments": [
+        IndexModel([("dish_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("parent_comment_id", ASCENDING), ("created_at", ASCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)]),
+        # Kiểm tra duplicate rating
+        IndexModel([("dish_id", ASCENDING), ("user_id", ASCENDING), ("parent_comment_id", ASCENDING)]),
+    ],
+    # 1 like / (comment, user); cũng phục vụ isLiked: comment_id $in + user_id
+    "comment_likes": [
+        IndexModel([("comment_id", ASCENDING), ("user_id", ASCENDING)], unique=True),
+    ],
+}
+
+# Failures from the last ensure_indexes() run, keyed by "collection.index"
+_last_errors: Dict[str, str] = {}
+
+
+async def ensure_indexes(db) -> Dict[str, List[str]]:
+    """
+    Create every registered index. Safe to run on each startup (existing identical
+    indexes are a no-op); a failing index (e.g. duplicates blocking a unique index)
+    is logged and reported instead of aborting startup.
+    """
+    created: Dict[str, List[str]] = {}
+    _last_errors.clear()
+    for coll_name, models in INDEX_REGISTRY.items():
+        coll = db[coll_name]
+        for model in models:
+            name = model.document["name"]
+            try:
+                await coll.create_indexes([model])
+                created.setdefault(coll_name, []).append(name)
+            except Exception as e:
+                _last_errors[f"{coll_name}.{name}"] = str(e)
+                logger.error(f"Failed to create index {coll_name}.{name}: {e}")
+    return created
+
+
+async def index_report(db) -> Dict[str, Any]:
+    """Compare the registry with the indexes that actually exist on the server"""
+    report: Dict[str, Any] = {}
+    for coll_name, models in INDEX_REGISTRY.items():
+        expected = {m.document["name"] for m in models}
+        existing = set()
+        async for idx in db[coll_name].list_indexes():
+            if idx["name"] != "_id_":
+                existing.add(idx["name"])
+        report[coll_name] = {
+            "missing": sorted(expected - existing),
+            "extra": sorted(existing - expected),
+        }
+    return {"collections": report, "errors": dict(_last_errors)}
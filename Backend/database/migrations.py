@@ -0,0 +1,111 @@
+"""
+One-shot data migrations shared by every worker process
+Each worker calls run_once() from its startup task; a lease on the migration's
+document in the `migrations` collection lets exactly one of them run it while the
+others poll until it is marked done. The lease is renewed while the migration runs,
+so a worker that dies mid-run only blocks the others until the lease expires, after
+which one of them takes over (migrations passed here must be resumable).
+Periodic jobs use acquire_lease() on the same collection so each pass runs in one
+worker only.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from database.mongo import migrations_collection
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_LEASE_SECONDS = int(os.getenv("MIGRATION_LEASE_SECONDS", "300"))
+MIGRATION_POLL_SECONDS = float(os.getenv("MIGRATION_POLL_SECONDS", "10"))
+
+
+async def is_done(migration_id: str) -> bool:
+    state = await migrations_collection.find_one({"_id": migration_id}, {"done": 1})
+    return bool(state and state.get("done"))
+
+
+async def _take_lease(doc_id: str, owner: str, seconds: float, extra: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Lấy lease nếu không ai giữ lease còn hạn (và khớp `extra`); None nếu không lấy được"""
+    now = datetime.now(timezone.utc)
+    try:
+        return await migrations_collection.find_one_and_update(
+            {
+                "_id": doc_id,
+                **(extra or {}),
+                "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}],
+            },
+            {"$set": {
+                "lease_owner": owner,
+                "lease_until": now + timedelta(seconds=seconds),
+                "started_at": now,
+            }},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # Document đã có nhưng không khớp filter: đã xong hoặc worker khác đang giữ lease
+        return None
+
+
+async def _acquire(migration_id: str, owner: str) -> Optional[Dict[str, Any]]:
+    return await _take_lease(migration_id, owner, MIGRATION_LEASE_SECONDS, {"done": {"$ne": True}})
+
+
+async def acquire_lease(job_id: str, seconds: float) -> bool:
+    """
+    Cho job định kỳ: True nếu worker này được chạy lượt hiện tại. Lease không được trả lại,
+    nên trong `seconds` giây tới không worker nào khác chạy lại job.
+    """
+    return await _take_lease(job_id, uuid.uuid4().hex, seconds) is not None
+
+
+async def _renew_lease(migration_id: str, owner: str):
+    while True:
+        await asyncio.sleep(MIGRATION_LEASE_SECONDS / 3)
+        await migrations_collection.update_one(
+            {"_id": migration_id, "lease_owner": owner},
+            {"$set": {"lease_until": datetime.now(timezone.utc) + timedelta(seconds=MIGRATION_LEASE_SECONDS)}},
+        )
+
+
+async def run_once(migration_id: str, migrate: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    Chạy `migrate()` đúng 1 lần trên toàn cluster; worker khác đang chạy thì chờ nó xong.
+    Trả về kết quả đã lưu của lần chạy thành công.
+    """
+    owner = uuid.uuid4().hex
+    while True:
+        state = await migrations_collection.find_one({"_id": migration_id})
+        if state and state.get("done"):
+            return state.get("result") or {}
+        if await _acquire(migration_id, owner):
+            break
+        await asyncio.sleep(MIGRATION_POLL_SECONDS)
+
+    renew = asyncio.create_task(_renew_lease(migration_id, owner))
+    try:
+        result = await migrate()
+    except BaseException as e:
+        renew.cancel()
+        await migrations_collection.update_one(
+            {"_id": migration_id, "lease_owner": owner},
+            {"$set": {"last_error": str(e)}, "$unset": {"lease_owner": "", "lease_until": ""}},
+        )
+        raise
+    renew.cancel()
+    await migrations_collection.update_one(
+        {"_id": migration_id, "lease_owner": owner},
+        {
+            "$set": {"done": True, "result": result, "finished_at": datetime.now(timezone.utc)},
+            "$unset": {"lease_owner": "", "lease_until": ""},
+        },
+    )
+    logger.info(f"Migration {migration_id} finished: {result}")
+    return result
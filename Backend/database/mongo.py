@@ -1,29 +1,23 @@
-import motor.motor_asyncio
-import os
-from dotenv import load_dotenv
+# Shared MongoDB collections
+from database.client import LazyCollection, LazyDatabase
 
-load_dotenv()
-
-# Use same MongoDB config as main_async.py
-MONGODB_URI = os.getenv("MONGODB_URI")
-DB_NAME = os.getenv("DATABASE_NAME", "cook_app")
-
-# ASYNC MongoDB client (Motor) - consistent with main_async.py
-client = motor.motor_asyncio.AsyncIOMotorClient(
-    MONGODB_URI,
-    tls=True,
-    serverSelectionTimeoutMS=30000,
-)
-db = client[DB_NAME]
+# Handles only: the client is created on app startup (database/client.py connect_client)
+# and every collection resolves through it when used
+db = LazyDatabase()
 
 # Core collections (ALL ASYNC)
-ingredients_collection = db["ingredients"]
-recipe_collection = db["recipes"]
-users_collection = db["users"]
-dishes_collection = db["dishes"]
+ingredients_collection = LazyCollection("ingredients")
+recipe_collection = LazyCollection("recipes")
+users_collection = LazyCollection("users")
+dishes_collection = LazyCollection("dishes")
 
 # User-related collections (ALL ASYNC)
-user_social_collection = db["user_social"]  # followers, following
-user_activity_collection = db["user_activity"]  # favorites, cooked, viewed
-user_notifications_collection = db["user_notifications"]  # notifications
-user_preferences_collection = db["user_preferences"]  # reminders, preferences
\ No newline at end of file
+user_social_collection = LazyCollection("user_social")  # follower/following counters
+user_follows_collection = LazyCollection("user_follows")  # follow edges (follower_id -> following_id)
+user_activity_collection = LazyCollection("user_activity")  # favorites, cooked, viewed
+user_notifications_collection = LazyCollection("user_notifications")  # unread_count
+notifications_collection = LazyCollection("notifications")  # 1 document / notification
+user_preferences_collection = LazyCollection("user_preferences")  # reminders, preferences
+
+# Bookkeeping
+migrations_collection = LazyCollection("migrations")  # backfill checkpoints, run-once migration leases
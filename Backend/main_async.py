@@ -11,7 +11,9 @@ from fastapi.responses import JSONResponse
 import firebase_admin
 from firebase_admin import auth as fb_auth, credentials
 from datetime import datetime, timezone
-import motor.motor_asyncio
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from core.search.index import reindex_document
 import logging
 
 load_dotenv()
@@ -24,17 +26,8 @@ if not firebase_admin._apps:
     })
 
 # ==== Init MongoDB (ASYNC ONLY) ====
-MONGODB_URI = os.getenv("MONGODB_URI")
-DB_NAME = os.getenv("DATABASE_NAME", "cook_app")
-
-# ASYNC MongoDB client (Motor)
-client = motor.motor_asyncio.AsyncIOMotorClient(
-    MONGODB_URI,
-    tls=True,
-    serverSelectionTimeoutMS=30000,
-)
-
-db = client[DB_NAME]
+# Dùng chung 1 client/pool với database.mongo (xem database/client.py)
+from database.mongo import db
 
 # ASYNC collections
 users_col = db["users"]
@@ -43,12 +36,26 @@ user_activity_col = db["user_activity"]
 user_notifications_col = db["user_notifications"]
 user_preferences_col = db["user_preferences"]
 
+# Tạo index theo database/indexes.py lúc startup (idempotent)
+MONGO_ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "True").lower() == "true"
+
+# /me chỉ ghi lastLoginAt nếu lần ghi trước đã cũ hơn khoảng này (giây)
+LAST_LOGIN_WRITE_INTERVAL_SECONDS = int(os.getenv("LAST_LOGIN_WRITE_INTERVAL_SECONDS", "900"))
+
+# key trong response /me -> collection phụ (khóa bằng user_id = str(users._id))
+USER_SIDE_COLLECTIONS = {
+    "social": "user_social",
+    "activity": "user_activity",
+    "notifications": "user_notifications",
+    "preferences": "user_preferences",
+}
+
 # ==== FastAPI app ====
 app = FastAPI()
 
 # Include các routers từ routes
 from routes import user_route, dish_route, recipe_route, search_route,comment_route
-from core.auth.dependencies import get_current_user
+from core.auth.dependencies import get_current_user, require_metrics_access
 app.include_router(comment_route.router)
 app.include_router(user_route.router, prefix="/users", tags=["Users"])
 app.include_router(dish_route.router, prefix="/dishes", tags=["Dishes"])
@@ -66,6 +73,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # keyset pagination token (utils/pagination.py)
 )
 
 # ==== ASYNC Helper: ensure user exists in Mongo ====
@@ -79,14 +87,11 @@ async def ensure_user_document_async(decoded: Dict[str, Any]) -> Dict[str, Any]:
     existing_user = await users_col.find_one({"email": email})
     
     if existing_user:
-        # Chỉ update lastLoginAt cho user cũ (ASYNC)
-        await users_col.update_one(
-            {"email": email}, 
-            {"$set": {"lastLoginAt": datetime.now(timezone.utc)}}
-        )
+        # Chỉ update lastLoginAt cho user cũ (ASYNC), tối đa 1 lần / interval
+        await touch_last_login_async(existing_user)
         return existing_user
     
-    # Tạo user mới với structure đơn giản hóa
+    # Tạo user mới với structure đơn giản hóa; insert_user thêm hậu tố nếu display_id đã có người dùng
     display_id = email.split('@')[0] if email else f"user_{uid[:8]}"
     
     new_user = {
@@ -100,51 +105,91 @@ async def ensure_user_document_async(decoded: Dict[str, Any]) -> Dict[str, Any]:
         "firebase_uid": uid,
     }
     
-    # ASYNC insert
-    result = await users_col.insert_one(new_user)
-    user_id = str(result.inserted_id)
+    # ASYNC insert; email là unique nên 2 request đăng nhập lần đầu cùng lúc chỉ tạo 1 user
+    from core.user_management.service import insert_user
+    try:
+        inserted = await insert_user(new_user)
+        user_id = str(inserted["_id"])
+    except DuplicateKeyError:
+        existing_user = await users_col.find_one({"email": email})
+        if not existing_user:
+            raise
+        user_id = str(existing_user["_id"])
     
-    # Tạo các collections phụ cho user mới (ASYNC)
+    # Tạo các collections phụ cho user (ASYNC); chạy lại cũng an toàn
     await init_user_collections_async(user_id)
     
-    return await users_col.find_one({"_id": result.inserted_id})
+    return await users_col.find_one({"_id": ObjectId(user_id)})
+
+async def touch_last_login_async(user: Dict[str, Any]) -> None:
+    """Ghi lastLoginAt nếu giá trị đang lưu cũ hơn LAST_LOGIN_WRITE_INTERVAL_SECONDS"""
+    now = datetime.now(timezone.utc)
+    last = user.get("lastLoginAt")
+    if isinstance(last, datetime):
+        if last.tzinfo is None:
+            last = last.replace(tzinfo=timezone.utc)
+        if (now - last).total_seconds() < LAST_LOGIN_WRITE_INTERVAL_SECONDS:
+            return
+    await users_col.update_one({"_id": user["_id"]}, {"$set": {"lastLoginAt": now}})
+    user["lastLoginAt"] = now
+
+async def load_user_profile_async(email: str) -> Optional[Dict[str, Any]]:
+    """
+    User + 4 document phụ trong 1 aggregation ($lookup theo index unique user_id).
+    Trả về user doc kèm key "_side" = {social, activity, notifications, preferences}, hoặc None.
+    """
+    pipeline = [
+        {"$match": {"email": email}},
+        {"$limit": 1},
+        {"$addFields": {"_uid": {"$toString": "$_id"}}},
+    ]
+    for key, coll_name in USER_SIDE_COLLECTIONS.items():
+        pipeline.append({"$lookup": {
+            "from": coll_name, "localField": "_uid", "foreignField": "user_id", "as": f"_side_{key}",
+        }})
+    docs = await users_col.aggregate(pipeline).to_list(length=1)
+    if not docs:
+        return None
+
+    doc = docs[0]
+    doc.pop("_uid", None)
+    doc["_side"] = {}
+    for key in USER_SIDE_COLLECTIONS:
+        matches = doc.pop(f"_side_{key}", None) or []
+        doc["_side"][key] = matches[0] if matches else None
+    return doc
 
 async def init_user_collections_async(user_id: str):
-    """Khởi tạo các collections phụ cho user mới (ASYNC)"""
-    # Tạo social data (ASYNC)
-    await user_social_col.insert_one({
-        "user_id": user_id,
-        "followers": [],
-        "following": [],
-        "follower_count": 0,
-        "following_count": 0
-    })
-    
-    # Tạo activity data (ASYNC)
-    await user_activity_col.insert_one({
-        "user_id": user_id,
-        "favorite_dishes": [],
-        "cooked_dishes": [],
-        "viewed_dishes": [],
-        "created_recipes": [],
-        "created_dishes": []
-    })
-    
-    # Tạo notifications data (ASYNC)
-    await user_notifications_col.insert_one({
-        "user_id": user_id,
-        "notifications": [],
-        "unread_count": 0
-    })
-    
-    # Tạo preferences data (ASYNC)
-    await user_preferences_col.insert_one({
-        "user_id": user_id,
-        "reminders": [],
-        "dietary_restrictions": [],
-        "cuisine_preferences": [],
-        "difficulty_preference": "all"
-    })
+    """Khởi tạo các collections phụ cho user mới (ASYNC, idempotent upsert)"""
+    from core.user_management.service import UserDataService
+    await UserDataService.init_user_data(user_id)
+
+
+@app.on_event("startup")
+async def _connect_mongo():
+    from database.client import connect_client
+    try:
+        await connect_client()
+    except Exception as e:
+        logger.warning(f"MongoDB warm-up ping failed: {e}")
+    if MONGO_ENSURE_INDEXES:
+        from database.indexes import ensure_indexes
+        await ensure_indexes(db)
+
+@app.on_event("shutdown")
+async def _close_mongo():
+    from database.client import close_client
+    close_client()
+
+@app.on_event("startup")
+async def _start_auth_verifier():
+    from core.auth.verifier import start_verifier
+    await start_verifier()
+
+@app.on_event("shutdown")
+async def _shutdown_auth_verifier():
+    from core.auth.verifier import shutdown_verifier
+    await shutdown_verifier()
 
 
 # ==== Logging middleware ====
@@ -164,22 +209,55 @@ async def log_requests(request: Request, call_next):
 async def health():
     return {"ok": True, "async": True}
 
+@app.get("/metrics", dependencies=[Depends(require_metrics_access)])
+async def metrics():
+    """
+    In-process cache/pool counters for monitoring (DEBUG hoặc Bearer METRICS_TOKEN)
+    """
+    from core.auth.token_cache import token_cache
+    from core.auth.verifier import verifier_stats
+    from core.user_management.user_cache import user_cache_stats
+    from core.hydration import hydration_cache_stats
+    from core.search.suggest import suggest_stats
+    from core.search.filters import facet_cache_stats
+    from database.client import pool_stats
+    return {
+        "auth_token_cache": token_cache.stats(),
+        "auth_verifier": verifier_stats(),
+        "user_cache": user_cache_stats(),
+        "hydration_cache": hydration_cache_stats(),
+        "search_suggest": suggest_stats(),
+        "dish_facet_cache": facet_cache_stats(),
+        "mongo_pool": pool_stats(),
+    }
+
 @app.get("/me")
 async def me(decoded=Depends(get_current_user)):
     """
     Trả về hồ sơ user trong Mongo (và auto tạo nếu chưa có) - ASYNC VERSION
     """
-    doc = await ensure_user_document_async(decoded)
-    user_id = str(doc["_id"])
-    
-    # Import user_helper nếu chưa có
     from core.user_management.service import user_helper
-    
-    # Load additional data từ các collections riêng (ALL ASYNC)
-    social_data = await user_social_col.find_one({"user_id": user_id})
-    activity_data = await user_activity_col.find_one({"user_id": user_id})
-    notifications_data = await user_notifications_col.find_one({"user_id": user_id})
-    preferences_data = await user_preferences_col.find_one({"user_id": user_id})
+
+    # User + dữ liệu phụ trong 1 round trip; lần đăng nhập đầu tiên mới phải tạo rồi đọc lại
+    email = decoded.get("email", "")
+    doc = await load_user_profile_async(email)
+    if doc is None:
+        await ensure_user_document_async(decoded)
+        doc = await load_user_profile_async(email)
+        if doc is None:
+            raise HTTPException(500, "Failed to create user profile")
+    else:
+        await touch_last_login_async(doc)
+        if any(v is None for v in doc["_side"].values()):
+            # User tạo dở (crash giữa chừng) -> bổ sung phần còn thiếu
+            await init_user_collections_async(str(doc["_id"]))
+            doc = await load_user_profile_async(email) or doc
+
+    side = doc.pop("_side")
+    social_data = side["social"]
+    activity_data = side["activity"]
+    notifications_data = side["notifications"]
+    preferences_data = side["preferences"]
     
     return {
         "user": user_helper(doc),
@@ -214,8 +292,17 @@ async def update_profile(payload: Dict[str, Any], decoded=Depends(get_current_us
     if not allowed:
         raise HTTPException(400, "No valid fields")
     
-    # ASYNC update
-    await users_col.update_one({"email": email}, {"$set": allowed})
+    # ASYNC update; display_id là unique (database/indexes.py)
+    try:
+        await users_col.update_one({"email": email}, {"$set": allowed})
+    except DuplicateKeyError:
+        raise HTTPException(400, "Display ID already taken")
+    if "name" in allowed or "display_id" in allowed:
+        updated = await users_col.find_one({"email": email}, {"_id": 1})
+        if updated:
+            await reindex_document("users", updated["_id"])
+    from core.user_management.user_cache import invalidate_user
+    invalidate_user(decoded.get("uid"))
     return {"ok": True, "updated_fields": list(allowed.keys())}
 
 
@@ -244,24 +331,13 @@ async def reorganize_single_user_async(user_id: str):
         # Migrate data từ user document sang các collections riêng
         user_id_str = str(user["_id"])
         
-        # 1. Migrate social data (ASYNC)
-        social_data = {
-            "user_id": user_id_str,
-            "followers": user.get("followers", []),
-            "following": user.get("following", []),
-            "follower_count": len(user.get("followers", [])),
-            "following_count": len(user.get("following", []))
-        }
-        await user_social_col.update_one(
-            {"user_id": user_id_str},
-            {"$set": social_data},
-            upsert=True
-        )
+        # 1. Migrate social data (ASYNC): edge trong user_follows, counter đếm lại từ edges
+        from core.user_management.social import import_follows
+        await import_follows(user_id_str, user.get("followers", []), user.get("following", []))
         
         # 2. Migrate activity data (ASYNC)
         activity_data = {
             "user_id": user_id_str,
-            "favorite_dishes": user.get("favorite_dishes", []),
             "cooked_dishes": user.get("cooked_dishes", []),
             "viewed_dishes": user.get("viewed_dishes", []),
             "created_recipes": user.get("recipes", []),
@@ -273,17 +349,9 @@ async def reorganize_single_user_async(user_id: str):
             upsert=True
         )
         
-        # 3. Migrate notifications data (ASYNC)
-        notifications_data = {
-            "user_id": user_id_str,
-            "notifications": user.get("notifications", []),
-            "unread_count": len([n for n in user.get("notifications", []) if isinstance(n, dict) and not n.get("read", True)])
-        }
-        await user_notifications_col.update_one(
-            {"user_id": user_id_str},
-            {"$set": notifications_data},
-            upsert=True
-        )
+        # 3. Migrate notifications data (ASYNC): document riêng, unread_count tăng theo số chưa đọc
+        from core.user_management.notifications import import_notifications
+        await import_notifications(user_id_str, user.get("notifications", []))
         
         # 4. Create preferences data (ASYNC)
         preferences_data = {
@@ -299,7 +367,8 @@ async def reorganize_single_user_async(user_id: str):
             upsert=True
         )
         
-        # 5. Clean up user document - chỉ giữ basic info (ASYNC)
+        # 5. Clean up user document - chỉ giữ basic info (ASYNC); favorite_dishes ở lại users
+        # (nơi duy nhất lưu danh sách yêu thích, xem core/dish_management/favorites.py)
         clean_user_doc = {
             "email": user.get("email", ""),
             "display_id": user.get("display_id", ""),
@@ -309,6 +378,7 @@ async def reorganize_single_user_async(user_id: str):
             "createdAt": user.get("createdAt", datetime.now(timezone.utc)),
             "lastLoginAt": user.get("lastLoginAt", datetime.now(timezone.utc)),
             "firebase_uid": user.get("firebase_uid", ""),
+            "favorite_dishes": user.get("favorite_dishes", []),
         }
         
         await users_col.replace_one({"_id": user["_id"]}, clean_user_doc)
@@ -316,12 +386,20 @@ async def reorganize_single_user_async(user_id: str):
         return {
             "message": f"Successfully migrated user {user_id} to new structure",
             "migrated_collections": ["user_social", "user_activity", "user_notifications", "user_preferences"],
-            "cleaned_fields": ["followers", "following", "recipes", "liked_dishes", "favorite_dishes", "cooked_dishes", "viewed_dishes", "notifications"]
+            "cleaned_fields": ["followers", "following", "recipes", "liked_dishes", "cooked_dishes", "viewed_dishes", "notifications"]
         }
         
     except Exception as e:
         raise HTTPException(400, f"Migration failed: {str(e)}")
 
+@app.get("/admin/indexes")
+async def get_index_report():
+    """So sánh index registry với index thực tế trên server (missing/extra)"""
+    if not DEBUG:
+        raise HTTPException(403, "Only available in debug mode")
+    from database.indexes import index_report
+    return await index_report(db)
+
 @app.post("/admin/migrate-all-users")
 async def migrate_all_users_async():
     """Migrate tất cả users sang structure mới - ASYNC VERSION"""
@@ -340,7 +418,7 @@ async def migrate_all_users_async():
                 user_id = str(user["_id"])
                 
                 # Check if already migrated (no old fields)
-                if not any(field in user for field in ["followers", "following", "recipes", "favorite_dishes"]):
+                if not any(field in user for field in ["followers", "following", "recipes"]):
                     continue
                 
                 # Perform migration (same logic as single user)
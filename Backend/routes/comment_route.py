@@ -1,10 +1,19 @@
 # routes/comment_route.py
+import asyncio
+import logging
+import os
 from fastapi import APIRouter, Depends, HTTPException, Body, Query
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime, timezone
 from bson import ObjectId
 from pydantic import BaseModel, Field
-from core.auth.dependencies import get_current_user
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from core.auth.dependencies import get_current_user, require_debug
+from database.client import MONGO_TRANSACTIONS, run_in_transaction
+from database.migrations import acquire_lease, run_once
+from utils.pagination import apply_cursor, sort_spec, next_cursor
+from core.dish_management.ratings import average_rating_stage
 from main_async import db
 from starlette.responses import Response
 from fastapi import Request
@@ -12,6 +21,10 @@ router = APIRouter(prefix="/comments", tags=["Comments"])
 
 comments_col = db["comments"]
 dishes_col = db["dishes"]
+# 1 document / lượt like, unique (comment_id, user_id); comments chỉ giữ counter `likes`
+comment_likes_col = db["comment_likes"]
+
+logger = logging.getLogger(__name__)
 
 # ================== Models ==================
 class CommentPermissionOut(BaseModel):
@@ -45,6 +58,7 @@ class CommentOut(BaseModel):
     updated_at: Optional[datetime] = None
     isLiked: Optional[bool] = None
     replies: Optional[List['CommentOut']] = None
+    reply_count: Optional[int] = None  # Tổng số reply (replies có thể bị cắt bớt theo reply_limit)
     can_edit: Optional[bool] = None  # Thêm để FE biết có thể edit không
 
 # ================== Helpers ==================
@@ -55,20 +69,46 @@ def oid(s: str) -> ObjectId:
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid ObjectId")
 
-def to_out(doc: Dict[str, Any], current_user_id: Optional[str] = None) -> CommentOut:
+def to_out(doc: Dict[str, Any], current_user_id: Optional[str] = None, liked_ids: Optional[set] = None) -> CommentOut:
+    """liked_ids: id các comment mà current_user đã like (xem liked_comment_ids)"""
     d = {**doc, "id": str(doc["_id"])}
     d.pop("_id", None)
+    liked_by = d.pop("liked_by", None) or []
 
-    liked_by = doc.get("liked_by", []) or []
-    is_liked = bool(current_user_id and current_user_id in liked_by)
+    if liked_ids is not None:
+        is_liked = d["id"] in liked_ids
+    else:
+        # Comment cũ chưa migrate sang comment_likes
+        is_liked = bool(current_user_id and current_user_id in liked_by)
 
     d["isLiked"] = is_liked
-    print(f"current_user_id: '{current_user_id}', doc_user_id: '{doc.get('user_id')}', equal: {current_user_id == doc.get('user_id')}")
     d["can_edit"] = bool(current_user_id and doc.get("user_id") == current_user_id)
 
     return CommentOut(**d)
 
 
+async def liked_comment_ids(user_id: Optional[str], comment_ids: List[str]) -> set:
+    """Các comment (trong comment_ids) mà user đã like - 1 query $in cho cả trang"""
+    if not user_id or not comment_ids:
+        return set()
+    cursor = comment_likes_col.find(
+        {"comment_id": {"$in": comment_ids}, "user_id": user_id},
+        {"_id": 0, "comment_id": 1},
+    )
+    return {like["comment_id"] async for like in cursor}
+
+
+async def to_out_for_user(doc: Dict[str, Any], current_user_id: Optional[str]) -> CommentOut:
+    liked = await liked_comment_ids(current_user_id, [str(doc["_id"])])
+    return to_out(doc, current_user_id, liked | _legacy_likes(doc, current_user_id))
+
+
+def _legacy_likes(doc: Dict[str, Any], user_id: Optional[str]) -> set:
+    if user_id and user_id in (doc.get("liked_by") or []):
+        return {str(doc["_id"])}
+    return set()
+
+
     owned = (c.get("user_id") == user_id)
     # Nếu sau này có role admin/moderator thì có thể mở rộng ở đây
     can_edit = owned
@@ -109,46 +149,333 @@ async def current_user_optional(request: Request):
     except Exception as e:
         print(f"=== current_user_optional FAILED: {e} ===")
         return None
-async def ensure_indexes():
-    await comments_col.create_index([("dish_id", 1), ("created_at", -1)])
-    await comments_col.create_index([("parent_comment_id", 1), ("created_at", 1)])
-    await comments_col.create_index([("user_id", 1), ("created_at", -1)])
-    # Index để kiểm tra duplicate rating
-    await comments_col.create_index([("dish_id", 1), ("user_id", 1), ("parent_comment_id", 1)])
-
-async def recalc_dish_rating(dish_id: str):
+ROOT_RATED_MATCH = {
+    "$or": [{"parent_comment_id": None}, {"parent_comment_id": ""}],
+    "rating": {"$gt": 0},
+}
+
+# Chu kỳ job đối soát rating (giây); 0 = tắt
+RATING_RECONCILE_SECONDS = int(os.getenv("COMMENT_RATING_RECONCILE_SECONDS", "3600"))
+
+# Số reply mặc định kèm theo mỗi comment gốc khi list; 0 = tối đa MAX_REPLIES_PER_PARENT
+REPLY_PREVIEW_LIMIT = int(os.getenv("COMMENT_REPLY_PREVIEW_LIMIT", "0"))
+# Trần số reply đọc cho mỗi comment gốc trong 1 lần list (xem thêm bằng parent_comment_id)
+MAX_REPLIES_PER_PARENT = int(os.getenv("COMMENT_MAX_REPLIES_PER_PARENT", "50"))
+
+
+def _rating_delta_pipeline(count_delta: int, sum_delta: int) -> List[Dict[str, Any]]:
+    return [
+        {"$set": {
+            "comments_count": {"$add": [{"$ifNull": ["$comments_count", 0]}, count_delta]},
+            "comment_rating_sum": {"$add": ["$comment_rating_sum", sum_delta]},
+        }},
+        average_rating_stage(),
+    ]
+
+
+def _rating_fields_pipeline(count: int, total: int) -> List[Dict[str, Any]]:
+    """Đặt counter của comment rồi tính lại average_rating (gộp với counter của /rate)"""
+    return [
+        {"$set": {"comments_count": count, "comment_rating_sum": total}},
+        average_rating_stage(),
+    ]
+
+
+async def _comment_rating_stats(dish_id: str, session=None) -> Tuple[int, int]:
+    """(số comment gốc có rating, tổng rating) của dish, tính từ comments"""
+    pipeline = [
+        {"$match": {"dish_id": dish_id, **ROOT_RATED_MATCH}},
+        {"$group": {"_id": "$dish_id", "count": {"$sum": 1}, "sum": {"$sum": "$rating"}}},
+    ]
+    stats = await comments_col.aggregate(pipeline, session=session).to_list(length=1)
+    if not stats:
+        return 0, 0
+    return int(stats[0]["count"]), int(stats[0]["sum"])
+
+
+async def apply_dish_rating_delta(dish_id: str, count_delta: int, sum_delta: int, session=None):
     """
-    Chỉ tính trung bình từ comment gốc (parent_comment_id rỗng/None và rating > 0).
+    Cập nhật tăng dần comments_count / comment_rating_sum của dish và tính lại average_rating (O(1)).
+    Gọi trong cùng transaction với thao tác ghi comment (sau thao tác đó).
     """
+    if not count_delta and not sum_delta:
+        return
+    dish_oid = ObjectId(dish_id)
+    res = await dishes_col.update_one(
+        {"_id": dish_oid, "comment_rating_sum": {"$type": "number"}},
+        _rating_delta_pipeline(count_delta, sum_delta),
+        session=session,
+    )
+    if res.matched_count:
+        return
+    # Dish cũ chưa có counter: seed từ comments. average_rating hiện có gộp cả /rate
+    # (rating_sum / rating_count) nên không suy ra được tổng rating của comment từ nó.
+    # Aggregate chạy trong cùng session nên đã gồm thao tác ghi hiện tại -> không áp delta nữa.
+    count, total = await _comment_rating_stats(dish_id, session)
+    await dishes_col.update_one(
+        {"_id": dish_oid, "comment_rating_sum": {"$not": {"$type": "number"}}},
+        _rating_fields_pipeline(count, total),
+        session=session,
+    )
+
+
+async def recalc_dish_rating(dish_id: str, seen: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    Tính lại toàn bộ từ comment gốc (parent_comment_id rỗng/None và rating > 0).
+    Chỉ dùng để sửa sai lệch; đường ghi bình thường dùng apply_dish_rating_delta.
+    `seen` là counter đọc được trên dish trước khi aggregate: chỉ ghi nếu dish vẫn còn
+    đúng giá trị đó, để không đè một delta ghi xen vào. Trả về False nếu bỏ qua vì bị ghi xen.
+    """
+    dish_oid = ObjectId(dish_id)
+    if seen is None:
+        seen = await dishes_col.find_one({"_id": dish_oid}, {"comments_count": 1, "comment_rating_sum": 1}) or {}
+    count, total = await _comment_rating_stats(dish_id)
+    res = await dishes_col.update_one(
+        {
+            "_id": dish_oid,
+            "comments_count": seen.get("comments_count"),
+            "comment_rating_sum": seen.get("comment_rating_sum"),
+        },
+        _rating_fields_pipeline(count, total),
+        upsert=False,
+    )
+    return bool(res.matched_count)
+
+
+async def reconcile_dish_ratings(fix: bool = True) -> Dict[str, Any]:
+    """
+    Đối soát: tính lại count/sum từ comments (nguồn gốc) cho mọi dish,
+    so với giá trị tăng dần trên dish và báo cáo (và sửa nếu fix=True) các dish bị lệch.
+    """
+    truth: Dict[str, Dict[str, int]] = {}
     pipeline = [
-        {"$match": {
-            "dish_id": dish_id,
-            "$or": [{"parent_comment_id": None}, {"parent_comment_id": ""}],
-            "rating": {"$gt": 0}
-        }},
-        {"$group": {"_id": "$dish_id", "count": {"$sum": 1}, "avg": {"$avg": "$rating"}}},
+        {"$match": ROOT_RATED_MATCH},
+        {"$group": {"_id": "$dish_id", "count": {"$sum": 1}, "sum": {"$sum": "$rating"}}},
     ]
-    agg = comments_col.aggregate(pipeline)
-    stats = await agg.to_list(length=1)
-    if stats:
-        s = stats[0]
-        await dishes_col.update_one(
-            {"_id": ObjectId(dish_id)},
-            {"$set": {"average_rating": float(s["avg"]), "comments_count": int(s["count"])}},
-            upsert=False,
+    async for row in comments_col.aggregate(pipeline):
+        truth[str(row["_id"])] = {"count": int(row["count"]), "sum": int(row["sum"])}
+
+    drift: List[Dict[str, Any]] = []
+    checked = 0
+    projection = {"comments_count": 1, "comment_rating_sum": 1}
+    async for dish in dishes_col.find({}, projection):
+        checked += 1
+        dish_id = str(dish["_id"])
+        expected = truth.get(dish_id, {"count": 0, "sum": 0})
+        actual_count = int(dish.get("comments_count") or 0)
+        actual_sum = dish.get("comment_rating_sum")
+        if actual_count == expected["count"] == 0:
+            # Không có comment đánh giá -> không có gì để sửa (average_rating còn lại là của /dishes/{id}/rate)
+            continue
+        if actual_count == expected["count"] and actual_sum is not None and abs(actual_sum - expected["sum"]) < 1e-6:
+            continue
+        drift.append({
+            "dish_id": dish_id,
+            "expected": expected,
+            "actual": {"count": actual_count, "sum": actual_sum},
+        })
+        if fix:
+            # Tính lại từ comments, chỉ ghi nếu counter vẫn là giá trị vừa đọc (không đè $inc ghi xen);
+            # dish bị ghi xen sẽ được kiểm tra lại ở lượt sau
+            await recalc_dish_rating(dish_id, dish)
+
+    if drift:
+        logger.warning(f"Dish rating drift on {len(drift)}/{checked} dishes (fixed={fix})")
+    return {"checked": checked, "drifted": len(drift), "fixed": fix and bool(drift), "drift": drift[:100]}
+
+
+async def _update_comment_and_rating(comment_id: str, user_id: str, upd: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    $set các field của comment; nếu đổi rating thì áp delta (mới - cũ) lên dish trong cùng transaction.
+    Trả về document sau khi cập nhật.
+    """
+    c_oid = oid(comment_id)
+
+    async def _txn(session):
+        before = await comments_col.find_one_and_update(
+            {"_id": c_oid, "user_id": user_id},
+            {"$set": upd},
+            return_document=ReturnDocument.BEFORE,
+            session=session,
         )
-    else:
-        await dishes_col.update_one(
-            {"_id": ObjectId(dish_id)},
-            {"$set": {"average_rating": 0.0, "comments_count": 0}},
-            upsert=False,
+        if before and "rating" in upd:
+            sum_delta = upd["rating"] - int(before.get("rating") or 0)
+            await apply_dish_rating_delta(before["dish_id"], 0, sum_delta, session)
+        return before
+
+    before = await run_in_transaction(_txn)
+    if not before:
+        raise HTTPException(404, "Comment not found or not owned by user")
+    return {**before, **upd}
+
+
+# ================== Likes ==================
+
+async def toggle_comment_like(comment_id: str, user_id: str) -> Dict[str, Any]:
+    """
+    Like/un-like trong 1 transaction: xoá like nếu có, ngược lại tạo like;
+    counter `likes` trên comment đổi bằng $inc và trả về giá trị sau khi đổi.
+    """
+    c_oid = oid(comment_id)
+
+    async def _inc_likes(delta: int, session, extra: Optional[Dict[str, Any]] = None):
+        update: Dict[str, Any] = {"$inc": {"likes": delta}, **(extra or {})}
+        return await comments_col.find_one_and_update(
+            {"_id": c_oid}, update,
+            projection={"likes": 1},
+            return_document=ReturnDocument.AFTER,
+            session=session,
+        )
+
+    async def _txn(session):
+        removed = await comment_likes_col.delete_one(
+            {"comment_id": comment_id, "user_id": user_id}, session=session
+        )
+        if removed.deleted_count:
+            return False, await _inc_likes(-1, session)
+
+        if not _likes_migrated:
+            # Like cũ còn nằm trong liked_by
+            legacy = await comments_col.find_one_and_update(
+                {"_id": c_oid, "liked_by": user_id},
+                {"$pull": {"liked_by": user_id}, "$inc": {"likes": -1}},
+                projection={"likes": 1},
+                return_document=ReturnDocument.AFTER,
+                session=session,
+            )
+            if legacy:
+                return False, legacy
+
+        updated = await _inc_likes(1, session)
+        if not updated:
+            return True, None
+        await comment_likes_col.insert_one(
+            {"comment_id": comment_id, "user_id": user_id, "created_at": datetime.now(timezone.utc)},
+            session=session,
         )
+        return True, updated
+
+    try:
+        liked, updated = await run_in_transaction(_txn)
+    except DuplicateKeyError:
+        # 2 request like cùng lúc, request kia đã ghi like trước. Không có transaction thì
+        # $inc của request này đã được ghi -> trả lại; có transaction thì nó đã bị rollback.
+        if not MONGO_TRANSACTIONS:
+            await _inc_likes(-1, None)
+        liked, updated = True, await comments_col.find_one({"_id": c_oid}, {"likes": 1})
+    if not updated:
+        raise HTTPException(404, "Comment not found")
+    return {"liked": liked, "likes_count": max(int(updated.get("likes") or 0), 0)}
+
+
+_likes_migrated = False
+
+LIKES_MIGRATION_ID = "comment_embedded_likes"
+
+
+async def _move_embedded_like(c_oid: ObjectId, user_id: str, session=None) -> int:
+    """
+    Chuyển 1 like trong liked_by sang comment_likes. Like cũ chỉ được coi là chuyển khi $pull
+    được chính nó, nên toggle ghi xen không bị ghi đè; counter `likes` đã đếm like cũ từ trước
+    và chỉ được chỉnh bằng $inc. Trả về số like đã chuyển (0/1).
+    """
+    created = await comment_likes_col.update_one(
+        {"comment_id": str(c_oid), "user_id": user_id},
+        {"$setOnInsert": {"created_at": c_oid.generation_time}},
+        upsert=True,
+        session=session,
+    )
+    pulled = await comments_col.update_one(
+        {"_id": c_oid, "liked_by": user_id}, {"$pull": {"liked_by": user_id}}, session=session
+    )
+    if not pulled.modified_count:
+        # User đã un-like qua liked_by sau khi batch được đọc -> bỏ like vừa tạo
+        if created.upserted_id is not None:
+            await comment_likes_col.delete_one({"_id": created.upserted_id}, session=session)
+        return 0
+    if created.upserted_id is None:
+        # Like đã có sẵn ở comment_likes -> counter đang đếm 2 lần
+        await comments_col.update_one({"_id": c_oid}, {"$inc": {"likes": -1}}, session=session)
+        return 0
+    return 1
+
+
+async def migrate_embedded_likes(batch_size: int = 500) -> Dict[str, int]:
+    """
+    Chuyển liked_by (mảng nhúng, dữ liệu cũ) sang comment_likes rồi $unset khỏi comment.
+    Idempotent (upsert theo unique index) và tự resume: comment đã chuyển không còn khớp filter.
+    Chạy 1 lần cho cả cluster qua run_once (lúc startup).
+    """
+    moved_comments = moved_likes = 0
+    legacy_q = {"liked_by.0": {"$exists": True}}
+    while True:
+        batch = await comments_col.find(legacy_q, {"liked_by": 1}).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+        for c in batch:
+            for uid in set(c["liked_by"]):
+                moved_likes += await run_in_transaction(
+                    lambda session, c_oid=c["_id"], uid=uid: _move_embedded_like(c_oid, uid, session)
+                )
+            await comments_col.update_one({"_id": c["_id"], "liked_by": {"$size": 0}}, {"$unset": {"liked_by": ""}})
+        moved_comments += len(batch)
+
+    # Dọn các mảng liked_by rỗng còn sót
+    await comments_col.update_many({"liked_by": {"$size": 0}}, {"$unset": {"liked_by": ""}})
+    if moved_comments:
+        logger.info(f"Moved {moved_likes} embedded likes from {moved_comments} comments to comment_likes")
+    return {"comments": moved_comments, "likes": moved_likes}
+
+
+async def _migrate_likes_in_background():
+    global _likes_migrated
+    try:
+        # Chỉ 1 worker chạy; các worker khác chờ tới khi xong rồi mới bỏ nhánh liked_by
+        await run_once(LIKES_MIGRATION_ID, migrate_embedded_likes)
+        _likes_migrated = True
+    except Exception as e:
+        logger.error(f"Embedded likes migration failed: {e}")
+
+
+RATING_RECONCILE_LEASE_ID = "dish_rating_reconcile"
+
+
+async def _reconcile_loop():
+    while True:
+        await asyncio.sleep(RATING_RECONCILE_SECONDS)
+        try:
+            # Mỗi chu kỳ chỉ 1 worker quét toàn bộ comments
+            if await acquire_lease(RATING_RECONCILE_LEASE_ID, RATING_RECONCILE_SECONDS):
+                await reconcile_dish_ratings(fix=True)
+        except Exception as e:
+            logger.error(f"Dish rating reconciliation failed: {e}")
 
 # ================== Routes ==================
 
+# Index của comments được khai báo trong database/indexes.py (tạo lúc app startup)
+
+_reconcile_task: Optional[asyncio.Task] = None
+
+_likes_migration_task: Optional[asyncio.Task] = None
+
 @router.on_event("startup")
-async def _on_startup():
-    await ensure_indexes()
+async def _start_rating_reconciler():
+    global _reconcile_task, _likes_migration_task
+    if RATING_RECONCILE_SECONDS > 0:
+        _reconcile_task = asyncio.create_task(_reconcile_loop())
+    _likes_migration_task = asyncio.create_task(_migrate_likes_in_background())
+
+@router.on_event("shutdown")
+async def _stop_rating_reconciler():
+    if _reconcile_task:
+        _reconcile_task.cancel()
+
+@router.post("/admin/reconcile-ratings", dependencies=[Depends(require_debug)])
+async def reconcile_ratings(fix: bool = True, decoded=Depends(get_current_user)):
+    """
+    Đối soát comments_count/comment_rating_sum của dish với comments, trả về danh sách lệch
+    """
+    return await reconcile_dish_ratings(fix=fix)
 
 @router.post("/", response_model=CommentOut)
 async def create_comment(payload: CommentIn, decoded=Depends(get_current_user)):
@@ -206,20 +533,71 @@ async def create_comment(payload: CommentIn, decoded=Depends(get_current_user)):
         "user_avatar": user_avatar,
         "rating": rating_val,
         "content": payload.content,
-        "liked_by": [],  # Array chứa user_id đã like
-        "likes": 0,      # Số lượng likes
+        "likes": 0,      # Counter; từng lượt like nằm trong comment_likes
         "created_at": now,
         "updated_at": None,
     }
 
-    res = await comments_col.insert_one(doc)
+    async def _txn(session):
+        res = await comments_col.insert_one(doc, session=session)
+        # Chỉ comment gốc mới tính vào rating của dish
+        if not payload.parent_comment_id:
+            await apply_dish_rating_delta(payload.dish_id, 1, rating_val, session)
+        return res
+
+    res = await run_in_transaction(_txn)
     doc["_id"] = res.inserted_id
 
-    # Chỉ recalc cho comment gốc
-    if not payload.parent_comment_id:
-        await recalc_dish_rating(payload.dish_id)
+    return to_out(doc, user_id, set())
+
+async def _replies_of(root_id: ObjectId, reply_limit: int) -> List[Dict[str, Any]]:
+    # parent_comment_id được lưu dạng str, dữ liệu cũ có thể là ObjectId
+    return await comments_col.find(
+        {"parent_comment_id": {"$in": [str(root_id), root_id]}}, {"liked_by": 0}
+    ).sort("created_at", 1).limit(reply_limit).to_list(length=reply_limit)
+
+
+async def _load_replies(root_ids: List[ObjectId], reply_limit: int = 0) -> Dict[str, Dict[str, Any]]:
+    """
+    Reply của nhiều comment gốc: mỗi comment gốc 1 query sort + limit trên index
+    (parent_comment_id, created_at), chạy song song, nên mỗi comment chỉ đọc tối đa
+    reply_limit reply (0 hoặc lớn hơn MAX_REPLIES_PER_PARENT -> MAX_REPLIES_PER_PARENT);
+    tổng reply đếm bằng 1 $group chỉ đếm, không gom document.
+    Trả về {parent_id: {"count": tổng reply, "replies": [reply cũ nhất trước]}}.
+    """
+    if reply_limit <= 0 or reply_limit > MAX_REPLIES_PER_PARENT:
+        reply_limit = MAX_REPLIES_PER_PARENT
+    parent_ids: List[Any] = [str(i) for i in root_ids] + list(root_ids)
+    count_pipeline: List[Dict[str, Any]] = [
+        {"$match": {"parent_comment_id": {"$in": parent_ids}}},
+        {"$group": {"_id": {"$toString": "$parent_comment_id"}, "count": {"$sum": 1}}},
+    ]
+    counts, *replies = await asyncio.gather(
+        comments_col.aggregate(count_pipeline).to_list(length=None),
+        *(_replies_of(root_id, reply_limit) for root_id in root_ids),
+    )
+
+    grouped: Dict[str, Dict[str, Any]] = {}
+    for row in counts:
+        grouped[row["_id"]] = {"count": row["count"], "replies": []}
+    for root_id, docs in zip(root_ids, replies):
+        if docs:
+            grouped.setdefault(str(root_id), {"count": len(docs), "replies": []})["replies"] = docs
+    return grouped
+
 
-    return to_out(doc, user_id)
+async def _comment_total(dish_id: str, q: Dict[str, Any], parent_comment_id: Optional[str]) -> int:
+    """
+    Tổng comment gốc lấy từ counter comments_count của dish (comment gốc luôn có rating),
+    chỉ đếm lại khi dish chưa có counter hoặc đang list reply.
+    """
+    if parent_comment_id is None and ObjectId.is_valid(dish_id):
+        dish = await dishes_col.find_one(
+            {"_id": ObjectId(dish_id)}, {"comments_count": 1, "comment_rating_sum": 1}
+        )
+        if dish and dish.get("comment_rating_sum") is not None:
+            return int(dish.get("comments_count") or 0)
+    return await comments_col.count_documents(q)
 
 @router.get("/by-dish/{dish_id}")
 async def list_comments_by_dish(
@@ -227,6 +605,10 @@ async def list_comments_by_dish(
     parent_comment_id: Optional[str] = Query(default=None, description="Để lấy reply của 1 comment, truyền id comment cha"),
     limit: int = Query(default=10, description="Số comment tối đa trả về; truyền 0 để lấy tất cả"),
     skip: int = 0,
+    cursor: Optional[str] = Query(default=None, description="next_cursor của trang trước (thay cho skip)"),
+    include_replies: bool = Query(default=True, description="Kèm reply của các comment gốc trong trang"),
+    reply_limit: int = Query(default=REPLY_PREVIEW_LIMIT, ge=0, description="Số reply tối đa mỗi comment gốc; 0 = tối đa MAX_REPLIES_PER_PARENT"),
+    include_total: bool = Query(default=True, description="Kèm tổng số comment"),
     decoded=Depends(current_user_optional)
 ):
     user_id = decoded.get("uid") if decoded else None
@@ -238,46 +620,45 @@ async def list_comments_by_dish(
     else:
         q["parent_comment_id"] = parent_comment_id
 
-    cursor = comments_col.find(q).sort("created_at", -1).skip(skip)
+    page_q = apply_cursor(q, "created_at", -1, cursor)
+    db_cursor = comments_col.find(page_q, {"liked_by": 0}).sort(sort_spec("created_at", -1))
+    if not cursor and skip:
+        db_cursor = db_cursor.skip(skip)
 
     if limit > 0:
-        cursor = cursor.limit(limit)
+        db_cursor = db_cursor.limit(limit)
+
+    page_docs: List[Dict[str, Any]] = [c async for c in db_cursor]
+
+    # Reply của cả trang: query song song, mỗi comment gốc đọc tối đa reply_limit reply
+    replies_by_parent: Dict[str, Dict[str, Any]] = {}
+    if include_replies and parent_comment_id is None and page_docs:
+        replies_by_parent = await _load_replies([c["_id"] for c in page_docs], reply_limit)
+
+    # isLiked của cả trang (comment + reply) trong 1 query $in
+    page_ids = [str(c["_id"]) for c in page_docs]
+    for group in replies_by_parent.values():
+        page_ids.extend(str(r["_id"]) for r in group["replies"])
+    liked = await liked_comment_ids(user_id, page_ids)
 
     items: List[CommentOut] = []
-    async for c in cursor:
-        # Convert main comment
-        comment_out = to_out(c, user_id)
-        
-        # Load replies if it's a main comment
-        if not c.get("parent_comment_id"):
-            reply_cursor = comments_col.find({
-                "parent_comment_id": str(c["_id"])  # ← Đây là chỗ ĐÚNG
-            }).sort("created_at", 1)
-            # Thử cả ObjectId và string để đảm bảo
-            comment_id_str = str(c["_id"])
-            reply_cursor = comments_col.find({
-                "$or": [
-                    {"parent_comment_id": comment_id_str},
-            {"parent_comment_id": c["_id"]}
-        ]
-    }).sort("created_at", 1)
-            
-            replies = []
-            async for reply in reply_cursor:
-                replies.append(to_out(reply, user_id))
-            
-            # Set replies to comment
-            comment_dict = comment_out.dict()
-            comment_dict["replies"] = replies
-            comment_out = CommentOut(**comment_dict)
-        
+    for c in page_docs:
+        comment_out = to_out(c, user_id, liked)
+        group = replies_by_parent.get(str(c["_id"]))
+        if group is not None:
+            comment_out.replies = [to_out(r, user_id, liked) for r in group["replies"]]
+            comment_out.reply_count = group["count"]
+        elif include_replies and parent_comment_id is None:
+            comment_out.replies = []
+            comment_out.reply_count = 0
         items.append(comment_out)
 
-    total = await comments_col.count_documents(q)
+    total = await _comment_total(dish_id, q, parent_comment_id) if include_total else None
     return {
         "items": items,
         "count": len(items),
-        "total": total
+        "total": total,
+        "next_cursor": next_cursor(page_docs, "created_at", limit),
     }
 
 @router.get("/check-user-rating/{dish_id}")
@@ -307,44 +688,11 @@ async def check_user_rating(dish_id: str, decoded=Depends(current_user_optional)
 @router.post("/{comment_id}/like")
 async def toggle_like_comment(comment_id: str, decoded=Depends(get_current_user)):
     user_id = decoded["uid"]
-    try:
-        c_oid = ObjectId(comment_id)
-    except Exception:
+    if not ObjectId.is_valid(comment_id):
         raise HTTPException(400, "Invalid comment_id")
 
-    c = await comments_col.find_one({"_id": c_oid}, {"_id": 1, "liked_by": 1})
-    if not c:
-        raise HTTPException(404, "Comment not found")
-
-    liked_by: List[str] = c.get("liked_by", [])
-    if user_id in liked_by:
-        # Đã like -> un-like
-        await comments_col.update_one(
-            {"_id": c_oid},
-            {
-                "$pull": {"liked_by": user_id}, 
-                "$inc": {"likes": -1},
-                "$set": {"updated_at": datetime.now(timezone.utc)}
-            }
-        )
-        liked = False
-    else:
-        # Chưa like -> like
-        await comments_col.update_one(
-            {"_id": c_oid},
-            {
-                "$addToSet": {"liked_by": user_id}, 
-                "$inc": {"likes": 1},
-                "$set": {"updated_at": datetime.now(timezone.utc)}
-            }
-        )
-        liked = True
-
-    # Get updated likes count
-    c2 = await comments_col.find_one({"_id": c_oid}, {"likes": 1})
-    likes_count = c2.get("likes", 0)
-
-    return {"ok": True, "liked": liked, "likes_count": likes_count}
+    result = await toggle_comment_like(comment_id, user_id)
+    return {"ok": True, **result}
 
 @router.patch("/{comment_id}", response_model=CommentOut)
 async def update_comment(comment_id: str, payload: CommentUpdate, decoded=Depends(get_current_user)):
@@ -373,17 +721,8 @@ async def update_comment(comment_id: str, payload: CommentUpdate, decoded=Depend
         raise HTTPException(400, "No fields to update")
     upd["updated_at"] = datetime.now(timezone.utc)
 
-    c = await comments_col.find_one_and_update(
-        {"_id": oid(comment_id), "user_id": user_id},
-        {"$set": upd},
-        return_document=True,
-    )
-
-    # Recalc rating nếu có thay đổi rating
-    if "rating" in upd:
-        await recalc_dish_rating(c["dish_id"])
-    
-    return to_out(c, user_id)
+    c = await _update_comment_and_rating(comment_id, user_id, upd)
+    return await to_out_for_user(c, user_id)
 
 @router.delete("/{comment_id}")
 async def delete_comment(comment_id: str, decoded=Depends(get_current_user)):
@@ -394,19 +733,38 @@ async def delete_comment(comment_id: str, decoded=Depends(get_current_user)):
     if c["user_id"] != user_id:
         raise HTTPException(403, "You can only delete your own comment")
 
-    # Xóa cả comment và các reply của nó
-    await comments_col.delete_many({
-        "$or": [
-            {"_id": oid(comment_id)},
-            {"parent_comment_id": comment_id}
-        ]
-    })
-    
-    await recalc_dish_rating(c["dish_id"])
+    # Xóa cả comment và các reply của nó, trừ rating khỏi dish trong cùng transaction
+    async def _txn(session):
+        removed = await comments_col.find_one_and_delete({"_id": c["_id"], "user_id": user_id}, session=session)
+        if not removed:
+            return None
+        reply_ids = [str(r["_id"]) async for r in comments_col.find(
+            {"parent_comment_id": comment_id}, {"_id": 1}, session=session
+        )]
+        await comments_col.delete_many({"parent_comment_id": comment_id}, session=session)
+        await comment_likes_col.delete_many({"comment_id": {"$in": [comment_id, *reply_ids]}}, session=session)
+        if not removed.get("parent_comment_id") and (removed.get("rating") or 0) > 0:
+            await apply_dish_rating_delta(removed["dish_id"], -1, -int(removed["rating"]), session)
+        return removed
+
+    await run_in_transaction(_txn)
     return {"ok": True}
 
 @router.get("/summary/{dish_id}")
 async def get_dish_comment_summary(dish_id: str):
+    # Đọc counter tăng dần trên dish (O(1)); dish cũ chưa có counter thì fallback aggregate
+    if ObjectId.is_valid(dish_id):
+        dish = await dishes_col.find_one(
+            {"_id": ObjectId(dish_id)}, {"comments_count": 1, "comment_rating_sum": 1}
+        )
+        if dish and dish.get("comment_rating_sum") is not None:
+            count = int(dish.get("comments_count") or 0)
+            return {
+                "dish_id": dish_id,
+                "count": count,
+                "avg": float(dish["comment_rating_sum"] / count) if count else 0.0,
+            }
+
     pipeline = [
         {"$match": {
             "dish_id": dish_id,
@@ -477,17 +835,9 @@ async def put_update_comment(comment_id: str, payload: CommentPutIn, decoded=Dep
     upd["updated_at"] = datetime.now(timezone.utc)
 
     # Cập nhật và trả về
-    c = await comments_col.find_one_and_update(
-        {"_id": oid(comment_id), "user_id": user_id},
-        {"$set": upd},
-        return_document=True,
-    )
-
-    # Nếu có chỉnh rating -> tính lại điểm trung bình món ăn
-    if "rating" in upd:
-        await recalc_dish_rating(c["dish_id"])
-
-    return to_out(c, user_id)
+    # Cập nhật (và áp delta rating nếu có) trong 1 transaction
+    c = await _update_comment_and_rating(comment_id, user_id, upd)
+    return await to_out_for_user(c, user_id)
 @router.get("/{comment_id}/permissions", response_model=CommentPermissionOut)
 async def get_comment_permissions(comment_id: str, decoded=Depends(get_current_user)):
     """
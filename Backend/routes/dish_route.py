@@ -1,12 +1,20 @@
 # routers/dishes.py - FIXED VERSION
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
 from models.dish_model import Dish, DishOut, DishIn
 from models.dish_with_recipe_model import DishWithRecipeIn, DishWithRecipeOut
-from database.mongo import dishes_collection, users_collection, recipe_collection
+from database.mongo import dishes_collection, recipe_collection
 from bson import ObjectId
 from datetime import datetime
-from core.auth.dependencies import get_current_user, get_user_by_email, extract_user_email
+from core.auth.dependencies import get_current_user, CurrentUser, CurrentUid, require_debug, resolve_current_user
+from core.user_management.user_cache import invalidate_user
+from core.dish_management.ownership import owner_filter, start_backfill, backfill_status
+from core.dish_management.ratings import add_dish_rating, rating_summary
+from core.dish_management.favorites import add_favorite, backfill_favorite_counts, notify_milestone, remove_favorite
+from core.search.index import search_fields
+from core.search import suggest as suggest_index
+from database.client import run_in_transaction
 from typing import List, Optional, Dict
+from utils.pagination import apply_cursor, sort_spec, next_cursor, NEXT_CURSOR_HEADER
 from pydantic import BaseModel
 import cloudinary
 import cloudinary.uploader
@@ -68,6 +76,33 @@ class DishDetailOut(BaseModel):
     difficulty: Optional[str] = None
     created_at: Optional[datetime] = None
 
+class DishCardOut(BaseModel):
+    """Compact dish for feeds/lists - no liked_by/ingredients arrays"""
+    id: str
+    name: str
+    image_url: Optional[str] = None
+    cooking_time: int
+    average_rating: float
+    creator_id: Optional[str] = None
+    recipe_id: Optional[str] = None
+    difficulty: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+# Fields needed to build a DishCardOut (plus _id); never loads liked_by/ingredients/legacy image_b64
+DISH_CARD_PROJECTION = {
+    "name": 1,
+    "image_url": 1,
+    "cooking_time": 1,
+    "average_rating": 1,
+    "creator_id": 1,
+    "recipe_id": 1,
+    "difficulty": 1,
+    "created_at": 1,
+}
+
+# Detail view: everything except legacy inline image blobs
+DISH_DETAIL_PROJECTION = {"image_b64": 0, "image_mime": 0}
+
 class CheckFavoritesRequest(BaseModel):
     dish_ids: List[str]
 
@@ -87,15 +122,31 @@ def _to_detail_out(d) -> DishDetailOut:
         created_at=d.get("created_at"),
     )
 
+def _to_card_out(d) -> DishCardOut:
+    """Convert a projected MongoDB document to the compact list DTO"""
+    return DishCardOut(
+        id=str(d["_id"]),
+        name=d.get("name", ""),
+        image_url=d.get("image_url"),
+        cooking_time=int(d.get("cooking_time") or 0),
+        average_rating=float(d.get("average_rating") or 0.0),
+        creator_id=d.get("creator_id"),
+        recipe_id=d.get("recipe_id"),
+        difficulty=d.get("difficulty"),
+        created_at=d.get("created_at"),
+    )
+
 def _clean_dish_data(dish_dict: dict) -> dict:
     cleaned = {}
     for k in ["name", "cooking_time", "ingredients"]:
         if k in dish_dict and dish_dict[k] not in (None, "", [], {}):
             cleaned[k] = dish_dict[k]
-    for k in ["image_url", "creator_id", "recipe_id", "difficulty"]:
+    for k in ["image_url", "creator_id", "owner_id", "recipe_id", "difficulty"]:
         if k in dish_dict and dish_dict[k] not in (None, "", [], {}):
             cleaned[k] = dish_dict[k]
-    cleaned.setdefault("ratings", [])
+    cleaned.setdefault("rating_count", 0)
+    cleaned.setdefault("rating_sum", 0)
+    cleaned.setdefault("favorite_count", 0)
     cleaned.setdefault("average_rating", 0.0)
     cleaned.setdefault("liked_by", [])
     cleaned.setdefault("created_at", datetime.utcnow())
@@ -167,10 +218,7 @@ def _get_user_identification(user_doc):
 
 # POST routes first
 @router.post("/", response_model=DishOut)
-async def create_dish(dish: DishIn, decoded=Depends(get_current_user)):
-    user_email = extract_user_email(decoded)
-    user = await get_user_by_email(user_email)
-
+async def create_dish(dish: DishIn, user: CurrentUser):
     payload = dish.dict()
     
     image_url = None
@@ -188,11 +236,14 @@ async def create_dish(dish: DishIn, decoded=Depends(get_current_user)):
         "difficulty": payload.get("difficulty", "easy"),
         "image_url": image_url,
         "creator_id": str(user["_id"]),
+        "owner_id": str(user["_id"]),
     })
+    new_doc.update(search_fields("dishes", new_doc))
 
     result = await dishes_collection.insert_one(new_doc)
     if not result.inserted_id:
         raise HTTPException(status_code=500, detail="Insert failed")
+    suggest_index.add_dish(new_doc)
 
     return DishOut(
         id=str(result.inserted_id),
@@ -202,9 +253,8 @@ async def create_dish(dish: DishIn, decoded=Depends(get_current_user)):
     )
 
 @router.post("/with-recipe", response_model=DishWithRecipeOut)
-async def create_dish_with_recipe(data: DishWithRecipeIn, decoded=Depends(get_current_user)):
-    user_email = extract_user_email(decoded)
-    user = await get_user_by_email(user_email)
+async def create_dish_with_recipe(data: DishWithRecipeIn, user: CurrentUser):
+    user_email = user.get("email")
 
     difficulty_map = {
         "Dễ": "easy",
@@ -232,13 +282,16 @@ async def create_dish_with_recipe(data: DishWithRecipeIn, decoded=Depends(get_cu
         "difficulty": normalized_difficulty,
         "image_url": image_url,
         "creator_id": str(user["_id"]),
+        "owner_id": str(user["_id"]),
     })
+    dish_doc.update(search_fields("dishes", dish_doc))
     
     dish_result = await dishes_collection.insert_one(dish_doc)
     if not dish_result.inserted_id:
         raise HTTPException(status_code=500, detail="Failed to create dish")
 
     dish_id = str(dish_result.inserted_id)
+    suggest_index.add_dish(dish_doc)
 
     recipe_doc = {
         "name": data.recipe_name or f"Cách làm {data.name}",
@@ -253,6 +306,7 @@ async def create_dish_with_recipe(data: DishWithRecipeIn, decoded=Depends(get_cu
         "image_url": image_url,
         "created_at": datetime.utcnow(),
     }
+    recipe_doc.update(search_fields("recipes", recipe_doc))
     
     recipe_result = await recipe_collection.insert_one(recipe_doc)
     if not recipe_result.inserted_id:
@@ -273,14 +327,8 @@ async def create_dish_with_recipe(data: DishWithRecipeIn, decoded=Depends(get_cu
     )
 
 @router.post("/check-favorites", response_model=Dict[str, bool])
-async def check_favorites(request: CheckFavoritesRequest, decoded=Depends(get_current_user)):
+async def check_favorites(request: CheckFavoritesRequest, user: CurrentUser):
     try:
-        user_email = extract_user_email(decoded)
-        user = await get_user_by_email(user_email)
-        
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
         favorite_dish_ids = user.get("favorite_dishes", [])
         
         result = {}
@@ -297,38 +345,39 @@ async def check_favorites(request: CheckFavoritesRequest, decoded=Depends(get_cu
 async def rate_dish(dish_id: str, rating: int, decoded=Depends(get_current_user)):
     if rating < 1 or rating > 5:
         raise HTTPException(status_code=400, detail="Rating must be 1-5")
-    d = await dishes_collection.find_one({"_id": ObjectId(dish_id)})
-    if not d:
+    if not ObjectId.is_valid(dish_id):
+        raise HTTPException(status_code=400, detail="Invalid dish ID")
+    # 1 round trip, atomic: $inc count/sum/histogram + tính lại average trên server
+    updated = await add_dish_rating(ObjectId(dish_id), rating, decoded.get("uid"))
+    if not updated:
         raise HTTPException(status_code=404, detail="Dish not found")
-    ratings = d.get("ratings", [])
-    ratings.append(rating)
-    avg = sum(ratings) / len(ratings)
-    await dishes_collection.update_one(
-        {"_id": ObjectId(dish_id)},
-        {"$set": {"ratings": ratings, "average_rating": avg}}
-    )
-    return {"msg": "Rating added", "average_rating": avg}
+    return {"msg": "Rating added", **rating_summary(updated)}
 
 @router.post("/{dish_id}/toggle-favorite")
-async def toggle_favorite_dish(dish_id: str, decoded=Depends(get_current_user)):
-    user_email = decoded.get("email")
-    user = await users_collection.find_one({"email": user_email})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    favorite_ids = user.get("favorite_dishes") or []
-    dish_id_str = str(dish_id)
-    if dish_id_str in favorite_ids:
-        await users_collection.update_one(
-            {"_id": user["_id"]},
-            {"$pull": {"favorite_dishes": dish_id_str}}
-        )
-        return {"isFavorite": False}
-    else:
-        await users_collection.update_one(
-            {"_id": user["_id"]},
-            {"$addToSet": {"favorite_dishes": dish_id_str}}
-        )
-        return {"isFavorite": True}
+async def toggle_favorite_dish(dish_id: str, user: CurrentUser, uid: CurrentUid):
+    if not ObjectId.is_valid(dish_id):
+        raise HTTPException(status_code=400, detail="Invalid dish ID")
+    dish_oid = ObjectId(dish_id)
+
+    # Đổi danh sách của user và favorite_count của dish trong cùng transaction;
+    # add_favorite kiểm tra dish tồn tại trước khi ghi nên 404 không để lại id trong danh sách
+    async def _txn(session):
+        removed, dish = await remove_favorite(user["_id"], dish_oid, session)
+        if removed:
+            return False, dish
+        _, dish = await add_favorite(user["_id"], dish_oid, session)
+        return True, dish
+
+    is_favorite, dish = await run_in_transaction(_txn)
+    invalidate_user(uid)
+    if is_favorite and dish:
+        await notify_milestone(dish)
+    return {"isFavorite": is_favorite, "favorite_count": int((dish or {}).get("favorite_count") or 0)}
+
+@router.post("/admin/backfill-favorite-counts", dependencies=[Depends(require_debug)])
+async def backfill_dish_favorite_counts(decoded=Depends(get_current_user)):
+    """Tính lại favorite_count của mọi dish từ danh sách yêu thích của user"""
+    return await backfill_favorite_counts()
 
 # Admin routes
 @router.post("/admin/cleanup")
@@ -358,6 +407,18 @@ async def cleanup_dishes(decoded=Depends(get_current_user)):
         "message": "Cleanup and migration completed"
     }
 
+@router.post("/admin/backfill-owner", dependencies=[Depends(require_debug)])
+async def backfill_dish_owner(decoded=Depends(get_current_user)):
+    """
+    Chạy nền backfill owner_id cho các dish cũ (resumable, có checkpoint)
+    """
+    started = start_backfill()
+    return {"started": started, **(await backfill_status())}
+
+@router.get("/admin/backfill-owner", dependencies=[Depends(require_debug)])
+async def get_backfill_dish_owner_status(decoded=Depends(get_current_user)):
+    return await backfill_status()
+
 @router.post("/admin/migrate-difficulty")
 async def migrate_difficulty_to_dishes(decoded=Depends(get_current_user)):
     migrated_count = 0
@@ -443,11 +504,18 @@ async def migrate_existing_images(decoded=Depends(get_current_user)):
 # ============= GET ROUTES (SPECIFIC FIRST, DYNAMIC LAST) =============
 
 # FIXED: High-rated dishes endpoint for Recipe screen
-@router.get("/high-rated", response_model=List[DishDetailOut])
-async def get_high_rated_dishes(min_rating: float = 4.0, limit: int = 50, skip: int = 0):
+@router.get("/high-rated", response_model=List[DishCardOut])
+async def get_high_rated_dishes(
+    response: Response,
+    min_rating: float = 4.0,
+    limit: int = 50,
+    skip: int = 0,
+    cursor: Optional[str] = None,
+):
     """
     CRITICAL: Returns ONLY dishes with average_rating >= min_rating
     Used by Recipe screen to show featured/popular dishes
+    Pagination: pass the X-Next-Cursor header of the previous page as `cursor` (skip is legacy)
     """
     logging.info(f"Fetching high-rated dishes - min_rating: {min_rating}, limit: {limit}, skip: {skip}")
     
@@ -460,13 +528,19 @@ async def get_high_rated_dishes(min_rating: float = 4.0, limit: int = 50, skip:
         
         logging.info(f"High-rated query: {query}")
         
-        cursor = dishes_collection.find(query).sort("average_rating", -1).skip(skip).limit(limit)
-        high_rated_docs = await cursor.to_list(length=limit)
+        query = apply_cursor(query, "average_rating", -1, cursor)
+        db_cursor = dishes_collection.find(query, DISH_CARD_PROJECTION).sort(sort_spec("average_rating", -1))
+        if not cursor and skip:
+            db_cursor = db_cursor.skip(skip)
+        high_rated_docs = await db_cursor.limit(limit).to_list(length=limit)
+        token = next_cursor(high_rated_docs, "average_rating", limit)
+        if token:
+            response.headers[NEXT_CURSOR_HEADER] = token
         
         logging.info(f"Found {len(high_rated_docs)} high-rated dishes")
         
         # Convert to response format
-        result = [_to_detail_out(d) for d in high_rated_docs]
+        result = [_to_card_out(d) for d in high_rated_docs]
         
         # Log sample for debugging
         if result:
@@ -474,55 +548,47 @@ async def get_high_rated_dishes(min_rating: float = 4.0, limit: int = 50, skip:
         
         return result
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error in get_high_rated_dishes: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch high-rated dishes: {str(e)}")
 
 # FIXED: My dishes endpoint for Profile screen  
-@router.get("/my-dishes", response_model=List[DishDetailOut])
+@router.get("/my-dishes", response_model=List[DishCardOut])
 async def get_my_dishes(
+    user: CurrentUser,
+    response: Response,
     limit: int = 50,
     skip: int = 0,
-    decoded=Depends(get_current_user)
+    cursor: Optional[str] = None,
 ):
     """
     CRITICAL: Returns dishes created by current user
     Used by Profile screen to show user's dishes
+    Pagination: pass the X-Next-Cursor header of the previous page as `cursor` (skip is legacy)
     """
     try:
-        user_email = extract_user_email(decoded)
-        user = await get_user_by_email(user_email)
-        
-        if not user:
-            logging.error(f"User not found for email: {user_email}")
-            raise HTTPException(status_code=404, detail="User not found")
-        
         user_id, user_email_from_doc, user_username = _get_user_identification(user)
         
         logging.info(f"Fetching dishes for user - ID: {user_id}, Email: {user_email_from_doc}")
         
-        # Build comprehensive query to find user's dishes
-        # Check multiple possible fields where user ID might be stored
+        # owner_id (indexed) sau khi backfill xong, trước đó fallback về $or các field cũ
         query = {
             "name": {"$exists": True, "$ne": "", "$ne": None},  # Valid dish name
-            "$or": [
-                {"creator_id": user_id},           # String version of user ID
-                {"creator_id": ObjectId(user_id)}, # ObjectId version (if stored as ObjectId)
-                {"created_by": user_email_from_doc},  # User email
-                {"created_by": user_id},           # User ID in created_by field
-                {"user_id": user_id},              # Alternative user_id field
-                {"owner_id": user_id},             # Alternative owner_id field
-            ]
+            **(await owner_filter(user)),
         }
         
-        # Also include username if available
-        if user_username:
-            query["$or"].append({"created_by": user_username})
-        
         logging.info(f"My dishes query: {query}")
         
-        cursor = dishes_collection.find(query).sort("created_at", -1).skip(skip).limit(limit)
-        user_dishes = await cursor.to_list(length=limit)
+        query = apply_cursor(query, "created_at", -1, cursor)
+        db_cursor = dishes_collection.find(query, DISH_CARD_PROJECTION).sort(sort_spec("created_at", -1))
+        if not cursor and skip:
+            db_cursor = db_cursor.skip(skip)
+        user_dishes = await db_cursor.limit(limit).to_list(length=limit)
+        token = next_cursor(user_dishes, "created_at", limit)
+        if token:
+            response.headers[NEXT_CURSOR_HEADER] = token
         
         logging.info(f"Found {len(user_dishes)} dishes for user {user_id}")
         
@@ -532,7 +598,7 @@ async def get_my_dishes(
             for i, dish in enumerate(user_dishes[:3]):  # Log first 3
                 logging.info(f"  {i+1}. {dish.get('name')} - creator_id: {dish.get('creator_id')}")
         
-        result = [_to_detail_out(dish) for dish in user_dishes]
+        result = [_to_card_out(dish) for dish in user_dishes]
         return result
         
     except HTTPException:
@@ -541,21 +607,21 @@ async def get_my_dishes(
         logging.error(f"Error in get_my_dishes: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch user dishes: {str(e)}")
 
-@router.get("/suggest/today", response_model=List[DishDetailOut])
+@router.get("/suggest/today", response_model=List[DishCardOut])
 async def suggest_today(limit: int = 12):
     """
     Returns recent dishes for today's suggestions
     """
     try:
         query = {"name": {"$exists": True, "$ne": "", "$ne": None}}
-        cursor = dishes_collection.find(query).sort("created_at", -1).limit(limit)
+        cursor = dishes_collection.find(query, DISH_CARD_PROJECTION).sort("created_at", -1).limit(limit)
         docs = await cursor.to_list(length=limit)
-        return [_to_detail_out(d) for d in docs]
+        return [_to_card_out(d) for d in docs]
     except Exception as e:
         logging.error(f"Error in suggest_today: {str(e)}")
         return []  # Return empty list on error
 
-@router.get("/random", response_model=List[DishDetailOut])
+@router.get("/random", response_model=List[DishCardOut])
 async def get_random_dishes(limit: int = 3):
     """
     Returns random dishes
@@ -564,79 +630,75 @@ async def get_random_dishes(limit: int = 3):
         pipeline = [
             {"$match": {"name": {"$exists": True, "$ne": "", "$ne": None}}},
             {"$sample": {"size": limit}},
+            {"$project": DISH_CARD_PROJECTION},
         ]
         
         docs = await dishes_collection.aggregate(pipeline).to_list(length=limit)
-        return [_to_detail_out(d) for d in docs]
+        return [_to_card_out(d) for d in docs]
         
     except Exception as e:
         logging.error(f"Error fetching random dishes: {str(e)}")
         # Fallback to regular query
         try:
             cursor = dishes_collection.find(
-                {"name": {"$exists": True, "$ne": "", "$ne": None}}
+                {"name": {"$exists": True, "$ne": "", "$ne": None}},
+                DISH_CARD_PROJECTION,
             ).sort("created_at", -1).limit(limit)
             docs = await cursor.to_list(length=limit)
-            return [_to_detail_out(d) for d in docs]
+            return [_to_card_out(d) for d in docs]
         except Exception as fallback_e:
             logging.error(f"Fallback query also failed: {str(fallback_e)}")
             return []
 
 # FIXED: Main dishes list endpoint - handles both general and user-specific queries
-@router.get("/", response_model=List[DishDetailOut])
+@router.get("/", response_model=List[DishCardOut])
 async def get_dishes(
+    request: Request,
+    response: Response,
     limit: int = 20,
     skip: int = 0,
+    cursor: Optional[str] = None,
     my_dishes: bool = False,
     decoded=Depends(get_current_user)
 ):
     """
     Main dishes endpoint - can return all dishes or user's dishes based on my_dishes parameter
+    Pagination: pass the X-Next-Cursor header of the previous page as `cursor` (skip is legacy)
     """
     try:
         base_query = {"name": {"$exists": True, "$ne": "", "$ne": None}}
         
         if my_dishes:
             # Get current user info
-            user_email = extract_user_email(decoded)
-            user = await get_user_by_email(user_email)
-            
-            if not user:
-                logging.warning(f"User not found for my_dishes query: {user_email}")
+            try:
+                user = await resolve_current_user(decoded, request)
+            except HTTPException:
+                logging.warning(f"User not found for my_dishes query: {decoded.get('email')}")
                 return []  # Return empty list if user not found
             
-            user_id, user_email_from_doc, user_username = _get_user_identification(user)
-            
-            # Add user filter to base query
-            user_filter = {
-                "$or": [
-                    {"creator_id": user_id},
-                    {"creator_id": ObjectId(user_id)},
-                    {"created_by": user_email_from_doc},
-                    {"created_by": user_id},
-                    {"user_id": user_id},
-                    {"owner_id": user_id}
-                ]
-            }
-            
-            if user_username:
-                user_filter["$or"].append({"created_by": user_username})
-            
             # Combine base query with user filter
-            query = {"$and": [base_query, user_filter]}
+            query = {**base_query, **(await owner_filter(user))}
             
             logging.info(f"My dishes query via main endpoint: {query}")
         else:
             query = base_query
             logging.info(f"All dishes query: {query}")
         
-        cursor = dishes_collection.find(query).sort("created_at", -1).skip(skip).limit(limit)
-        dishes = await cursor.to_list(length=limit)
+        query = apply_cursor(query, "created_at", -1, cursor)
+        db_cursor = dishes_collection.find(query, DISH_CARD_PROJECTION).sort(sort_spec("created_at", -1))
+        if not cursor and skip:
+            db_cursor = db_cursor.skip(skip)
+        dishes = await db_cursor.limit(limit).to_list(length=limit)
+        token = next_cursor(dishes, "created_at", limit)
+        if token:
+            response.headers[NEXT_CURSOR_HEADER] = token
         
         logging.info(f"Found {len(dishes)} dishes (my_dishes={my_dishes})")
         
-        return [_to_detail_out(dish) for dish in dishes]
+        return [_to_card_out(dish) for dish in dishes]
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error in get_dishes: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch dishes: {str(e)}")
@@ -649,7 +711,7 @@ async def get_dish_detail(dish_id: str):
     Get single dish details by ID
     """
     try:
-        d = await dishes_collection.find_one({"_id": ObjectId(dish_id)})
+        d = await dishes_collection.find_one({"_id": ObjectId(dish_id)}, DISH_DETAIL_PROJECTION)
         if not d:
             raise HTTPException(status_code=404, detail="Dish not found")
         return _to_detail_out(d)
@@ -663,7 +725,7 @@ async def get_dish_with_recipe(dish_id: str):
     Get dish with associated recipe details
     """
     try:
-        dish = await dishes_collection.find_one({"_id": ObjectId(dish_id)})
+        dish = await dishes_collection.find_one({"_id": ObjectId(dish_id)}, DISH_DETAIL_PROJECTION)
         if not dish:
             raise HTTPException(status_code=404, detail="Dish not found")
         
@@ -671,7 +733,7 @@ async def get_dish_with_recipe(dish_id: str):
         recipe_id = dish.get("recipe_id")
         if recipe_id:
             try:
-                r = await recipe_collection.find_one({"_id": ObjectId(recipe_id)})
+                r = await recipe_collection.find_one({"_id": ObjectId(recipe_id)}, DISH_DETAIL_PROJECTION)
                 if r:
                     recipe = RecipeDetailOut(
                         id=str(r["_id"]),
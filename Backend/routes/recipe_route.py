@@ -2,9 +2,9 @@
 Recipe Management Routes - Simplified Main Router
 All handlers moved to utils.recipe_handlers for better organization
 """
-from fastapi import APIRouter, Depends, Body
+from fastapi import APIRouter, Depends, Body, Response
 from models.recipe_model import RecipeIn, RecipeOut
-from core.auth.dependencies import get_current_user
+from core.auth.dependencies import get_current_user, CurrentUser
 from utils.recipe_handlers import (
     create_recipe_handler,
     get_all_recipes_handler,
@@ -12,22 +12,22 @@ from utils.recipe_handlers import (
     get_recipes_by_user_handler,
     rate_recipe_handler
 )
-from typing import List
+from typing import List, Optional
 
 router = APIRouter()
 
 # ==================== RECIPE ROUTES ====================
 @router.post("/", response_model=RecipeOut)
-async def create_recipe(recipe: RecipeIn, decoded=Depends(get_current_user)):
-    return await create_recipe_handler(recipe, decoded)
+async def create_recipe(recipe: RecipeIn, user: CurrentUser):
+    return await create_recipe_handler(recipe, user)
 
 @router.get("/", response_model=List[RecipeOut])
-async def get_all_recipes(skip: int = 0, limit: int = 20):
-    return await get_all_recipes_handler(skip, limit)
+async def get_all_recipes(response: Response, skip: int = 0, limit: int = 20, cursor: Optional[str] = None):
+    return await get_all_recipes_handler(skip, limit, cursor, response)
 
 @router.get("/by-user", response_model=List[RecipeOut])
-async def get_recipes_by_user(decoded=Depends(get_current_user)):
-    return await get_recipes_by_user_handler(decoded)
+async def get_recipes_by_user(user: CurrentUser):
+    return await get_recipes_by_user_handler(user)
 
 @router.get("/{recipe_id}", response_model=RecipeOut)
 async def get_recipe(recipe_id: str):
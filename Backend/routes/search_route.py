@@ -1,29 +1,82 @@
 """
 Search Routes - Find ingredients, users, dishes with filters
 """
-from fastapi import APIRouter, Query, HTTPException
+from fastapi import APIRouter, Query, HTTPException, Depends
 from bson.objectid import ObjectId
-from database.mongo import ingredients_collection, recipe_collection, users_collection, dishes_collection
+from database.mongo import dishes_collection
+from core.auth.dependencies import get_current_user, require_debug
+from core.search import index as search_index
+from core.search import suggest as suggest_index
+from core.search import ingredients as ingredient_index
+from core.search import filters as dish_filters
 from models.ingredients_model import IngredientOut
 from models.recipe_model import RecipeOut
 from models.user_model import UserOut
 from models.dish_model import DishOut
 from core.user_management.service import user_helper
+from utils.fanout import fan_out
+from typing import Literal, Optional
+import os
 
 
 router = APIRouter()
 
+# Field cần cho từng loại kết quả (không kéo search_tokens / image_b64 / mảng lớn về)
+DISH_RESULT_PROJECTION = {"name": 1, "image_url": 1, "cooking_time": 1, "average_rating": 1, "ingredients": 1}
+USER_RESULT_PROJECTION = {"display_id": 1, "name": 1, "avatar": 1, "email": 1, "firebase_uid": 1,
+                          "bio": 1, "createdAt": 1, "lastLoginAt": 1}
+INGREDIENT_RESULT_PROJECTION = {"name": 1, "category": 1, "unit": 1}
+DISH_FILTER_PROJECTION = {"name": 1, "image_url": 1, "cooking_time": 1, "average_rating": 1,
+                          "difficulty": 1, "favorite_count": 1, "created_at": 1}
+
+# Timeout cho từng nguồn của /search/all (giây)
+SEARCH_SECTION_TIMEOUT_SECONDS = float(os.getenv("SEARCH_SECTION_TIMEOUT_SECONDS", "1.5"))
+
+
+@router.on_event("startup")
+async def _start_search_backfill():
+    # Index document cũ / được ghi ngoài API (vd. seed ingredients)
+    search_index.start_backfill()
+    suggest_index.start_refresh()
+
+
+@router.on_event("shutdown")
+async def _stop_search_backfill():
+    search_index.stop_backfill()
+    suggest_index.stop_refresh()
+
+
+@router.post("/admin/reindex", dependencies=[Depends(require_debug)])
+async def reindex_search(kind: str = Query(..., description="dishes | recipes | users | ingredients"),
+                         decoded=Depends(get_current_user)):
+    """Tính lại search_tokens cho cả collection (sau khi đổi cách tokenize)"""
+    if kind not in search_index.SEARCH_SOURCES:
+        raise HTTPException(status_code=400, detail="Invalid kind")
+    return {"kind": kind, "indexed": await search_index.reindex_all(kind)}
+
+
+# ================== AUTOCOMPLETE ==================
+
+@router.get("/suggest")
+async def search_suggest(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(8, ge=1, le=20),
+    type: Optional[Literal["dish", "ingredient"]] = Query(None, description="Chỉ lấy gợi ý món hoặc nguyên liệu"),
+):
+    """
+    Gợi ý theo prefix (không phân biệt dấu) cho ô tìm kiếm - phục vụ từ bộ nhớ, không query Mongo
+    """
+    return {"q": q, "suggestions": suggest_index.suggest(q, limit, [type] if type else None)}
+
 
 # ================== BASIC SEARCH ==================
 
 @router.get("/ingredients", response_model=list[IngredientOut])
-async def search_ingredients(q: str = Query(..., min_length=1)):
+async def search_ingredients(q: str = Query(..., min_length=2)):
     """
-    Tìm kiếm nguyên liệu theo tên
+    Tìm kiếm nguyên liệu theo tên (không phân biệt dấu)
     """
-    regex = {"$regex": q, "$options": "i"}
-    cursor = ingredients_collection.find({"name": regex}).limit(10)
-    ingredients = await cursor.to_list(length=10)
+    ingredients = await search_index.search("ingredients", q, 10, INGREDIENT_RESULT_PROJECTION)
     return [
         {
             "id": str(i["_id"]),
@@ -35,31 +88,22 @@ async def search_ingredients(q: str = Query(..., min_length=1)):
 
 
 @router.get("/users", response_model=list[UserOut])
-async def search_users(q: str = Query(..., min_length=1)):
+async def search_users(q: str = Query(..., min_length=2)):
     """
-    Tìm kiếm người dùng theo display_id
+    Tìm kiếm người dùng theo display_id / tên (không phân biệt dấu)
     """
-    regex = {"$regex": q, "$options": "i"}
-    cursor = users_collection.find({"display_id": regex}).limit(10)
-    users = await cursor.to_list(length=10)
+    users = await search_index.search("users", q, 10, USER_RESULT_PROJECTION)
     
     # Sử dụng user_helper để format consistent với normalized structure
     return [user_helper(u) for u in users]
 
 
 @router.get("/dishes", response_model=list[DishOut])
-async def search_dishes(q: str = Query(..., min_length=1)):
+async def search_dishes(q: str = Query(..., min_length=2)):
     """
-    Tìm kiếm món ăn theo tên hoặc nguyên liệu
+    Tìm kiếm món ăn theo tên hoặc nguyên liệu (không phân biệt dấu, khớp ở tên xếp trước)
     """
-    regex = {"$regex": q, "$options": "i"}
-    cursor = dishes_collection.find({
-        "$or": [
-            {"name": regex},
-            {"ingredients": {"$elemMatch": {"$regex": q, "$options": "i"}}}
-        ]
-    }).limit(10)
-    dishes = await cursor.to_list(length=10)
+    dishes = await search_index.search("dishes", q, 10, DISH_RESULT_PROJECTION)
     return [
         {
             "id": str(d["_id"]),
@@ -72,18 +116,11 @@ async def search_dishes(q: str = Query(..., min_length=1)):
 
 
 @router.get("/recipes", response_model=list[RecipeOut])
-async def search_recipes(q: str = Query(..., min_length=1)):
+async def search_recipes(q: str = Query(..., min_length=2)):
     """
-    Tìm kiếm công thức theo tên hoặc mô tả
+    Tìm kiếm công thức theo tên hoặc mô tả (không phân biệt dấu)
     """
-    regex = {"$regex": q, "$options": "i"}
-    cursor = recipe_collection.find({
-        "$or": [
-            {"name": regex},
-            {"description": regex}
-        ]
-    }).limit(10)
-    recipes = await cursor.to_list(length=10)
+    recipes = await search_index.search("recipes", q, 10)
     return [
         {
             "id": str(r["_id"]),
@@ -103,6 +140,54 @@ async def search_recipes(q: str = Query(..., min_length=1)):
 
 # ================== ADVANCED FILTERS ==================
 
+@router.get("/dishes/filter")
+async def filter_dishes(
+    max_time: Optional[int] = Query(None, description="Thời gian nấu tối đa (phút)", ge=1),
+    min_rating: Optional[float] = Query(None, description="Rating tối thiểu", ge=0.0, le=5.0),
+    difficulty: str = Query("", description="Độ khó, comma-separated: easy, medium, hard"),
+    ingredients: str = Query("", description="Nguyên liệu bắt buộc phải có (comma-separated)"),
+    exclude: str = Query("", description="Nguyên liệu không được có (comma-separated)"),
+    q: str = Query("", description="Tên món / nguyên liệu (không phân biệt dấu)"),
+    sort: Literal["rating", "time", "newest", "popular"] = Query("rating"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+    facets: bool = Query(True, description="Kèm số lượng theo độ khó / thời gian / rating (chỉ trang đầu)"),
+):
+    """
+    Lọc món kết hợp thời gian, rating, độ khó, nguyên liệu và text, có sort + phân trang cursor
+    """
+    difficulties = _split_csv(difficulty)
+    if any(d not in dish_filters.DIFFICULTIES for d in difficulties):
+        raise HTTPException(status_code=400, detail="Invalid difficulty level")
+
+    dish_filter = dish_filters.DishFilter(
+        max_time=max_time,
+        min_rating=min_rating,
+        difficulties=difficulties,
+        ingredients=_split_csv(ingredients),
+        exclude=_split_csv(exclude),
+        q=q,
+    )
+    result = await dish_filters.filter_dishes(
+        dish_filter, sort, limit, cursor, DISH_FILTER_PROJECTION, with_facets=facets and not cursor
+    )
+    return {
+        "dishes": [
+            {
+                "id": str(d["_id"]),
+                "name": d.get("name", ""),
+                "image_url": d.get("image_url", ""),
+                "cooking_time": d.get("cooking_time", 0),
+                "average_rating": d.get("average_rating", 0.0),
+                "difficulty": d.get("difficulty", "medium"),
+                "favorite_count": d.get("favorite_count", 0),
+            } for d in result["dishes"]
+        ],
+        "facets": result["facets"],
+        "next_cursor": result["next_cursor"],
+    }
+
+
 @router.get("/dishes/by-time", response_model=list[DishOut])
 async def filter_dishes_by_time(
     max_time: int = Query(..., description="Thời gian nấu tối đa (phút)", ge=1)
@@ -180,25 +265,21 @@ async def filter_dishes_by_difficulty(
 async def search_all(q: str = Query(..., min_length=2)):
     """
     Tìm kiếm tổng hợp - tất cả loại data
+    Ba nguồn chạy đồng thời, mỗi nguồn có timeout riêng; nguồn chậm trả về rỗng kèm timed_out
     """
-    regex = {"$regex": q, "$options": "i"}
-    
-    dishes_cursor = dishes_collection.find({
-        "$or": [
-            {"name": regex},
-            {"ingredients": {"$elemMatch": {"$regex": q, "$options": "i"}}}
-        ]
-    }).limit(5)
-    dishes = await dishes_cursor.to_list(length=5)
-    
-  
-    users_cursor = users_collection.find({"display_id": regex}).limit(5)
-    users = await users_cursor.to_list(length=5)
-    
+    sections = await fan_out(
+        {
+            "dishes": search_index.search("dishes", q, 5, DISH_RESULT_PROJECTION),
+            "users": search_index.search("users", q, 5, USER_RESULT_PROJECTION),
+            "ingredients": search_index.search("ingredients", q, 5, INGREDIENT_RESULT_PROJECTION),
+        },
+        timeout=SEARCH_SECTION_TIMEOUT_SECONDS,
+        default=[],
+    )
+    dishes = sections["dishes"].value
+    users = sections["users"].value
+    ingredients = sections["ingredients"].value
 
-    ingredients_cursor = ingredients_collection.find({"name": regex}).limit(5)
-    ingredients = await ingredients_cursor.to_list(length=5)
-    
     return {
         "dishes": [
             {
@@ -227,58 +308,57 @@ async def search_all(q: str = Query(..., min_length=2)):
                 "category": i.get("category", "")
             } for i in ingredients
         ],
-        "total_results": len(dishes) + len(users) + len(ingredients)
+        "total_results": len(dishes) + len(users) + len(ingredients),
+        "sections": {
+            name: {"timed_out": r.timed_out, "error": r.error is not None}
+            for name, r in sections.items()
+        },
     }
 
+def _split_csv(raw: str) -> list:
+    return [ing.strip() for ing in raw.split(',') if ing.strip()]
+
+
 # Cập nhật endpoint dishes-by-ingredients
 @router.get("/dishes-by-ingredients")
 async def search_dishes_by_ingredients(
-    ingredients: str = Query("", description="Comma-separated ingredients")
+    ingredients: str = Query("", description="Comma-separated ingredients"),
+    must: str = Query("", description="Nguyên liệu bắt buộc phải có (comma-separated)"),
+    exclude: str = Query("", description="Nguyên liệu không được có (comma-separated)"),
+    limit: int = Query(20, ge=1, le=100),
 ):
     """
     Tìm món ăn theo nhiều nguyên liệu (GET với query params)
+    Xếp theo số nguyên liệu khớp trên toàn bộ món (posting list ingredient_keys), rồi rating, rồi thời gian nấu
     """
     # Parse ingredients từ string
-    ingredient_list = [ing.strip() for ing in ingredients.split(',') if ing.strip()]
-    
-    if not ingredient_list:
+    ingredient_list = _split_csv(ingredients)
+    must_list = _split_csv(must)
+    exclude_list = _split_csv(exclude)
+
+    if not ingredient_list and not must_list:
         return {"dishes": [], "total_results": 0}
-    
-    # ✅ Sửa query syntax
-    or_conditions = []
-    for ing in ingredient_list:
-        or_conditions.append({"ingredients": {"$regex": ing, "$options": "i"}})
-    
-    # Tìm dishes có chứa ít nhất 1 ingredient
-    cursor = dishes_collection.find({
-        "$or": or_conditions
-    })
-    
-    dishes = await cursor.to_list(length=50)
-    
-    # Sắp xếp theo số lượng ingredients khớp
-    scored_dishes = []
-    for dish in dishes:
-        dish_ingredients = dish.get("ingredients", [])
-        match_count = sum(1 for ing in ingredient_list 
-                         if any(ing.lower() in d_ing.lower() for d_ing in dish_ingredients))
-        
-        scored_dishes.append({
-            "id": str(dish["_id"]),
-            "name": dish["name"],
-            "image_url": dish.get("image_url", ""),
-            "cooking_time": dish.get("cooking_time", 0),
-            "average_rating": dish.get("average_rating", 0.0),
-            "ingredients": dish_ingredients,
-            "match_count": match_count,
-            "match_percentage": (match_count / len(ingredient_list)) * 100
-        })
-    
-    # Sắp xếp theo độ khớp giảm dần
-    scored_dishes.sort(key=lambda x: x["match_count"], reverse=True)
-    
+
+    result = await ingredient_index.dishes_by_ingredients(
+        ingredient_list, must_list, exclude_list, limit, DISH_RESULT_PROJECTION
+    )
+    wanted = len(result["keys"]) or 1
+
     return {
-        "dishes": scored_dishes[:20],
-        "total_results": len(scored_dishes),
-        "search_ingredients": ingredient_list
+        "dishes": [
+            {
+                "id": str(dish["_id"]),
+                "name": dish["name"],
+                "image_url": dish.get("image_url", ""),
+                "cooking_time": dish.get("cooking_time", 0),
+                "average_rating": dish.get("average_rating", 0.0),
+                "ingredients": dish.get("ingredients", []),
+                "match_count": dish["match_count"],
+                "match_percentage": (dish["match_count"] / wanted) * 100
+            } for dish in result["dishes"]
+        ],
+        "total_results": result["total"],
+        "search_ingredients": ingredient_list,
+        "must": must_list,
+        "exclude": exclude_list,
     }
\ No newline at end of file
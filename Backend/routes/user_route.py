@@ -2,13 +2,17 @@
 User Management Routes - Simplified Main Router
 All handlers moved to utils.user_handlers for better organization
 """
+import asyncio
+import logging
 from pydantic import BaseModel
 from typing import Literal,Optional
-from fastapi import APIRouter, Depends, Body
+from fastapi import APIRouter, Depends, Body, Query
 from models.user_model import UserOut
 from main_async import user_activity_col  # đã init trong main_async.py (motor)
-from core.auth.dependencies import get_current_user
+from core.auth.dependencies import get_current_user, CurrentUser, CurrentUid, require_debug
 from datetime import datetime, timezone
+from utils.history import move_to_front_pipeline
+from core.hydration import hydrate
 from utils.user_handlers import (
     # Profile handlers
     create_user_handler,
@@ -21,6 +25,9 @@ from utils.user_handlers import (
     # Social handlers
     get_my_social_handler,
     follow_user_handler,
+    unfollow_user_handler,
+    get_followers_handler,
+    get_following_handler,
     get_user_dishes_handler,
     
     # Activity handlers
@@ -32,6 +39,8 @@ from utils.user_handlers import (
 
     # Preferences handlers
     get_my_notifications_handler,
+    get_unread_count_handler,
+    mark_notifications_read_handler,
     set_reminders_handler,
     get_reminders_handler
 )
@@ -50,29 +59,76 @@ async def get_me(decoded=Depends(get_current_user)):
     return await get_me_handler(decoded)
 
 @router.put("/me", response_model=UserOut)
-async def update_me(user_update: dict = Body(...), decoded=Depends(get_current_user)):
-    return await update_me_handler(user_update, decoded)
+async def update_me(user: CurrentUser, uid: CurrentUid, user_update: dict = Body(...)):
+    return await update_me_handler(user_update, user, uid)
 
 @router.get("/search/")
-async def search_users(q: str, decoded=Depends(get_current_user)):
-    return await search_users_handler(q, decoded)
+async def search_users(q: str, user: CurrentUser):
+    return await search_users_handler(q, user)
 
 @router.get("/{user_id}", response_model=UserOut) 
 async def get_user(user_id: str):
     return await get_user_handler(user_id)
 
 @router.get("/me/favorites")
-async def get_my_favorites(decoded=Depends(get_current_user)):
-    return await get_my_favorites_handler(decoded)
+async def get_my_favorites(user: CurrentUser):
+    return await get_my_favorites_handler(user)
 
 # ==================== SOCIAL ROUTES ====================
 @router.get("/me/social")
-async def get_my_social(decoded=Depends(get_current_user)):
-    return await get_my_social_handler(decoded)
+async def get_my_social(user: CurrentUser):
+    return await get_my_social_handler(user)
 
 @router.post("/{user_id}/follow")
-async def follow_user(user_id: str, decoded=Depends(get_current_user)):
-    return await follow_user_handler(user_id, decoded)
+async def follow_user(user_id: str, user: CurrentUser):
+    return await follow_user_handler(user_id, user)
+
+@router.delete("/{user_id}/follow")
+async def unfollow_user(user_id: str, user: CurrentUser):
+    return await unfollow_user_handler(user_id, user)
+
+@router.get("/{user_id}/followers")
+async def get_followers(user_id: str, limit: int = Query(default=20, ge=1, le=100), cursor: Optional[str] = None):
+    return await get_followers_handler(user_id, limit, cursor)
+
+@router.get("/{user_id}/following")
+async def get_following(user_id: str, limit: int = Query(default=20, ge=1, le=100), cursor: Optional[str] = None):
+    return await get_following_handler(user_id, limit, cursor)
+
+async def _run_embedded_migrations():
+    """Chuyển dữ liệu cũ (follows, notifications nhúng; favorites ở user_activity) về chỗ mới, 1 lần cho cả cluster"""
+    from core.user_management.social import migrate_embedded_follows
+    from core.user_management.notifications import migrate_embedded_notifications
+    from core.dish_management.favorites import migrate_activity_favorites
+    from database.migrations import run_once
+    for migration_id, migrate in (
+        ("user_embedded_follows", migrate_embedded_follows),
+        ("user_embedded_notifications", migrate_embedded_notifications),
+        ("user_activity_favorites", migrate_activity_favorites),
+    ):
+        try:
+            await run_once(migration_id, migrate)
+        except Exception as e:
+            logging.error(f"{migrate.__name__} failed: {e}")
+
+_migration_task: Optional[asyncio.Task] = None
+
+@router.on_event("startup")
+async def _start_embedded_migrations():
+    global _migration_task
+    _migration_task = asyncio.create_task(_run_embedded_migrations())
+
+@router.post("/admin/migrate-notifications", dependencies=[Depends(require_debug)])
+async def migrate_notifications(user: CurrentUser):
+    """Chuyển mảng notifications nhúng sang collection notifications"""
+    from core.user_management.notifications import migrate_embedded_notifications
+    return await migrate_embedded_notifications()
+
+@router.post("/admin/migrate-follows", dependencies=[Depends(require_debug)])
+async def migrate_follows(user: CurrentUser):
+    """Chuyển followers/following nhúng trong user_social sang user_follows"""
+    from core.user_management.social import migrate_embedded_follows
+    return await migrate_embedded_follows()
 
 @router.get("/{user_id}/dishes")
 async def get_user_dishes(user_id: str):
@@ -81,33 +137,46 @@ async def get_user_dishes(user_id: str):
 # ==================== ACTIVITY ROUTES ====================
 
 @router.post("/me/cooked/{dish_id}")
-async def add_cooked_dish(dish_id: str, decoded=Depends(get_current_user)):
-    return await add_cooked_dish_handler(dish_id, decoded)
+async def add_cooked_dish(dish_id: str, user: CurrentUser):
+    return await add_cooked_dish_handler(dish_id, user)
 
 # @router.post("/me/viewed/{dish_id}")
-# async def add_viewed_dish(dish_id: str, decoded=Depends(get_current_user)):
-#     return await add_viewed_dish_handler(dish_id, decoded)
+# async def add_viewed_dish(dish_id: str, user: CurrentUser, uid: CurrentUid):
+#     return await add_viewed_dish_handler(dish_id, user, uid)
 
 # @router.get("/me/viewed-dishes")
-# async def get_viewed_dishes(limit: int = 20, decoded=Depends(get_current_user)):
-#     return await get_viewed_dishes_handler(limit, decoded)
+# async def get_viewed_dishes(user: CurrentUser, limit: int = 20):
+#     return await get_viewed_dishes_handler(limit, user)
 
-@router.post("/notify-favorite/{dish_id}")
+@router.post("/notify-favorite/{dish_id}", deprecated=True)
 async def notify_favorite(dish_id: str):
     return await notify_favorite_handler(dish_id)
 
 # ==================== PREFERENCES ROUTES ====================
 @router.get("/me/notifications")
-async def get_my_notifications(decoded=Depends(get_current_user)):
-    return await get_my_notifications_handler(decoded)
+async def get_my_notifications(
+    user: CurrentUser,
+    limit: int = Query(default=20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    unread_only: bool = False,
+):
+    return await get_my_notifications_handler(user, limit, cursor, unread_only)
+
+@router.get("/me/notifications/unread-count")
+async def get_unread_notifications_count(user: CurrentUser):
+    return await get_unread_count_handler(user)
+
+@router.post("/me/notifications/read")
+async def mark_notifications_read(user: CurrentUser, ids: Optional[List[str]] = Body(default=None, embed=True)):
+    return await mark_notifications_read_handler(user, ids)
 
 @router.post("/me/reminders")
-async def set_reminders(reminders: List[str] = Body(...), decoded=Depends(get_current_user)):
-    return await set_reminders_handler(reminders, decoded)
+async def set_reminders(user: CurrentUser, reminders: List[str] = Body(...)):
+    return await set_reminders_handler(reminders, user)
 
 @router.get("/me/reminders", response_model=List[str])
-async def get_reminders(decoded=Depends(get_current_user)):
-    return await get_reminders_handler(decoded)
+async def get_reminders(user: CurrentUser):
+    return await get_reminders_handler(user)
 
 
 
@@ -142,25 +211,14 @@ async def add_view_history(payload: ViewEventIn, decoded=Depends(get_current_use
     }
 
 
+    # Bỏ entry cũ cùng type+id (cả dạng string cũ 'type:id'), đẩy entry mới lên đầu, cắt list - 1 update
+    same_entry = {"$or": [
+        {"$and": [{"$eq": ["$$this.type", doc["type"]]}, {"$eq": ["$$this.id", doc["id"]]}]},
+        {"$eq": ["$$this", f"{doc['type']}:{doc['id']}"]},
+    ]}
     await user_activity_col.update_one(
         {"user_id": uid},
-        {"$pull": {"viewed_dishes_and_users": {"type": doc["type"], "id": doc["id"]}}},
-        upsert=True
-    )
-
-    # 2) Đẩy item mới lên đầu + cắt danh sách
-    await user_activity_col.update_one(
-        {"user_id": uid},
-        {
-            "$push": {
-                "viewed_dishes_and_users": {
-                    "$each": [doc],
-                    "$position": 0,
-                    "$slice": MAX_HISTORY
-                }
-            },
-            "$set": {"updated_at": now}
-        },
+        move_to_front_pipeline("viewed_dishes_and_users", doc, same_entry, MAX_HISTORY, {"updated_at": now}),
         upsert=True
     )
 
@@ -194,10 +252,11 @@ def _normalize_view_entry(it: Any) -> Optional[Dict[str, Any]]:
     return None
 
 @router.get("/activity/view")
-async def get_view_history(limit: int = 50, decoded=Depends(get_current_user)):
+async def get_view_history(limit: int = 50, hydrate_items: bool = True, decoded=Depends(get_current_user)):
     """
     Trả về lịch sử đã xem (mới nhất nằm đầu).
     Giữ tương thích ngược: chấp nhận cả string 'dish:<id>' và object {type,id,...}.
+    hydrate_items: thay snapshot name/image lúc xem bằng dữ liệu hiện tại của dish/user.
     """
     uid = decoded["uid"]
 
@@ -218,4 +277,17 @@ async def get_view_history(limit: int = 50, decoded=Depends(get_current_user)):
     if limit and limit > 0:
         items = items[:limit]
 
+    if hydrate_items and items:
+        current = await hydrate((it["type"], it["id"]) for it in items)
+        for it in items:
+            entity = current.get((it["type"], it["id"]))
+            if not entity:
+                continue
+            if it["type"] == "dish":
+                it["name"] = entity["name"] or it.get("name", "")
+                it["image"] = entity["image_url"] or it.get("image", "")
+            else:
+                it["name"] = entity["name"] or entity["display_id"] or it.get("name", "")
+                it["image"] = entity["avatar"] or it.get("image", "")
+
     return {"items": items, "count": len(items)}
\ No newline at end of file
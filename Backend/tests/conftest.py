@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Cho phép `pytest` chạy từ bất kỳ đâu: import theo gốc Backend/ giống app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
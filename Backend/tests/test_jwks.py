@@ -0,0 +1,138 @@
+"""
+LocalTokenVerifier against a locally generated key pair standing in for Google's securetoken certs
+"""
+import asyncio
+import datetime
+import time
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from firebase_admin import auth as fb_auth
+from jose import jwt
+
+from core.auth.jwks import LocalTokenVerifier, SigningKeysUnavailable
+
+PROJECT_ID = "cook-app-test"
+KID = "test-key-1"
+
+
+def _key_and_cert():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "securetoken.system.gserviceaccount.com")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    key_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    return key_pem, cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+KEY_PEM, CERT_PEM = _key_and_cert()
+
+
+@pytest.fixture
+def verifier():
+    v = LocalTokenVerifier(project_id=PROJECT_ID, certs_url="http://localhost.invalid/certs")
+    v.load_certificates({KID: CERT_PEM}, max_age=3600)
+    return v
+
+
+def _claims(**overrides):
+    now = int(time.time())
+    claims = {
+        "iss": f"https://securetoken.google.com/{PROJECT_ID}",
+        "aud": PROJECT_ID,
+        "sub": "user-123",
+        "email": "user@example.com",
+        "iat": now - 10,
+        "auth_time": now - 10,
+        "exp": now + 3600,
+    }
+    claims.update(overrides)
+    return claims
+
+
+def _token(claims=None, kid=KID, key=KEY_PEM, algorithm="RS256"):
+    return jwt.encode(claims or _claims(), key, algorithm=algorithm, headers={"kid": kid})
+
+
+def test_valid_token(verifier):
+    decoded = verifier.verify(_token())
+    assert decoded["uid"] == "user-123"
+    assert decoded["email"] == "user@example.com"
+
+
+def test_expired_token(verifier):
+    now = int(time.time())
+    token = _token(_claims(iat=now - 7200, auth_time=now - 7200, exp=now - 3600))
+    with pytest.raises(fb_auth.ExpiredIdTokenError):
+        verifier.verify(token)
+
+
+def test_wrong_audience(verifier):
+    with pytest.raises(fb_auth.InvalidIdTokenError):
+        verifier.verify(_token(_claims(aud="other-project")))
+
+
+def test_wrong_issuer(verifier):
+    with pytest.raises(fb_auth.InvalidIdTokenError):
+        verifier.verify(_token(_claims(iss="https://securetoken.google.com/other-project")))
+
+
+def test_unknown_kid(verifier):
+    with pytest.raises(fb_auth.InvalidIdTokenError, match="unknown key id"):
+        verifier.verify(_token(kid="rotated-away"))
+
+
+def test_non_rs256_alg(verifier):
+    token = _token(key="shared-secret", algorithm="HS256")
+    with pytest.raises(fb_auth.InvalidIdTokenError, match="RS256"):
+        verifier.verify(token)
+
+
+def test_signature_from_other_key(verifier):
+    other_key, _ = _key_and_cert()
+    with pytest.raises(fb_auth.InvalidIdTokenError):
+        verifier.verify(_token(key=other_key))
+
+
+def test_refresh_loads_fetched_certificates(monkeypatch):
+    v = LocalTokenVerifier(project_id=PROJECT_ID, certs_url="http://localhost.invalid/certs")
+    monkeypatch.setattr(v, "_fetch", lambda: ({KID: CERT_PEM}, 120))
+    assert asyncio.run(v.refresh()) == 120
+    assert v.verify(_token())["uid"] == "user-123"
+    assert v.stats()["keys"] == 1 and v.stats()["refreshes"] == 1
+
+
+def test_no_certificates_loaded():
+    v = LocalTokenVerifier(project_id=PROJECT_ID)
+    with pytest.raises(SigningKeysUnavailable):
+        v.verify(_token())
+
+
+def test_stale_certificates_rejected(verifier):
+    verifier.max_staleness = 60
+    verifier.load_certificates({KID: CERT_PEM}, max_age=-61)
+    with pytest.raises(SigningKeysUnavailable, match="stale"):
+        verifier.verify(_token())
+    assert verifier.stats()["stale"] is True
+
+
+def test_certificates_within_staleness_window(verifier):
+    verifier.max_staleness = 600
+    verifier.load_certificates({KID: CERT_PEM}, max_age=-60)
+    assert verifier.verify(_token())["uid"] == "user-123"
@@ -0,0 +1,47 @@
+"""
+Cursor round trip and rejection of crafted cursors
+"""
+import base64
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId, json_util
+from fastapi import HTTPException
+
+from utils.pagination import apply_cursor, decode_cursor, encode_cursor
+
+
+def _token(payload):
+    raw = json_util.dumps(payload)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def test_round_trip():
+    doc = {"_id": ObjectId(), "created_at": datetime(2026, 1, 2, tzinfo=timezone.utc)}
+    value, last_id = decode_cursor(encode_cursor("created_at", doc), "created_at")
+    assert last_id == doc["_id"]
+    assert value.replace(tzinfo=timezone.utc) == doc["created_at"]
+
+
+def test_null_value_allowed():
+    doc = {"_id": ObjectId()}
+    assert decode_cursor(encode_cursor("average_rating", doc), "average_rating") == (None, doc["_id"])
+
+
+@pytest.mark.parametrize("value, last_id", [
+    ({"$ne": None}, ObjectId()),
+    ([1, 2], ObjectId()),
+    (5, {"$gt": ""}),
+    (5, "not-an-object-id"),
+])
+def test_operator_injection_rejected(value, last_id):
+    token = _token({"f": "average_rating", "v": [value, last_id]})
+    with pytest.raises(HTTPException) as exc:
+        apply_cursor({}, "average_rating", -1, token)
+    assert exc.value.status_code == 400
+
+
+def test_other_listing_rejected():
+    token = encode_cursor("created_at", {"_id": ObjectId(), "created_at": 1})
+    with pytest.raises(HTTPException):
+        decode_cursor(token, "average_rating")
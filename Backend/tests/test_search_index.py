@@ -0,0 +1,20 @@
+"""
+Search field stamping and short-query rejection (no Mongo needed for either)
+"""
+import asyncio
+
+from core.search import index
+
+
+def test_search_fields_stamp_version():
+    fields = index.search_fields("dishes", {"name": "Canh chua cá", "ingredients": ["Cá lóc"]})
+    assert fields["search_version"] == index.SEARCH_FIELDS_VERSION
+    assert "ca" in fields["search_tokens"] and "canh" in fields["search_words"]
+
+
+def test_single_letter_query_returns_nothing(monkeypatch):
+    def _no_db(*args, **kwargs):
+        raise AssertionError("short query must not reach Mongo")
+
+    monkeypatch.setitem(index.SEARCH_SOURCES["dishes"], "collection", type("C", (), {"aggregate": _no_db})())
+    assert asyncio.run(index.search("dishes", "a b")) == []
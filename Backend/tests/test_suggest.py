@@ -0,0 +1,73 @@
+"""
+SuggestIndex prefix lookup and rebuild(), with an in-memory stand-in for the dish / ingredient collections
+"""
+import asyncio
+
+from bson import ObjectId
+
+from core.search import suggest as suggest_module
+from core.search.suggest import DISH, INGREDIENT, SuggestIndex
+
+
+class _Cursor:
+    def __init__(self, docs, on_each=None):
+        self._docs = list(docs)
+        self._on_each = on_each
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self._docs:
+            if self._on_each:
+                self._on_each()
+            await asyncio.sleep(0)
+            yield doc
+
+
+class _Collection:
+    def __init__(self, docs, on_each=None):
+        self.docs = docs
+        self.on_each = on_each
+
+    def find(self, *args, **kwargs):
+        return _Cursor(self.docs, self.on_each)
+
+
+def test_kind_filter_not_cut_by_heavier_kind():
+    index = SuggestIndex()
+    for i in range(60):
+        index.add(DISH, str(i), f"canh {i}", 10.0)
+    index.add(INGREDIENT, "cai", "Cải", 1.0)
+
+    assert [s["text"] for s in index.suggest("ca", 5, [INGREDIENT])] == ["Cải"]
+    assert all(s["type"] == DISH for s in index.suggest("ca", 5))
+
+
+def test_insert_invalidates_cached_prefix():
+    index = SuggestIndex()
+    index.add(DISH, "1", "Canh chua", 1.0)
+    assert len(index.suggest("ca", 5, [INGREDIENT])) == 0
+    index.add(INGREDIENT, "ca", "Cá", 1.0)
+    assert [s["text"] for s in index.suggest("ca", 5, [INGREDIENT])] == ["Cá"]
+
+
+def test_rebuild_replays_dishes_added_meanwhile(monkeypatch):
+    stored = {"_id": ObjectId(), "name": "Phở bò", "ingredients": ["Bánh phở"]}
+    late = {"_id": ObjectId(), "name": "Phở gà", "ingredients": ["Thịt gà"]}
+    added = []
+
+    def _add_late():
+        if not added:
+            added.append(late)
+            suggest_module.add_dish(late)
+
+    monkeypatch.setattr(suggest_module, "dishes_collection", _Collection([stored], _add_late))
+    monkeypatch.setattr(suggest_module, "ingredients_collection", _Collection([]))
+    monkeypatch.setattr(suggest_module, "_index", SuggestIndex())
+
+    asyncio.run(suggest_module.rebuild())
+
+    names = {s["text"] for s in suggest_module.suggest("pho", 10, [DISH])}
+    assert names == {"Phở bò", "Phở gà"}
+    assert suggest_module._pending is None
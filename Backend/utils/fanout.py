@@ -0,0 +1,46 @@
+"""
+Concurrent fan-out over independent sub-queries
+Every section runs at the same time under its own timeout budget, so an endpoint
+answers in max(section latency) instead of the sum, and one slow or failing source
+only empties its own section instead of failing (or stalling) the whole response.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Mapping, NamedTuple, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+class SectionResult(NamedTuple):
+    value: Any
+    timed_out: bool = False
+    error: Optional[str] = None
+
+
+async def _run(name: str, awaitable: Awaitable[Any], timeout: Optional[float], default: Any) -> SectionResult:
+    try:
+        return SectionResult(await asyncio.wait_for(awaitable, timeout))
+    except asyncio.TimeoutError:
+        logger.warning(f"Fan-out section '{name}' timed out after {timeout}s")
+        return SectionResult(default, timed_out=True)
+    except Exception as e:
+        logger.error(f"Fan-out section '{name}' failed: {e}")
+        return SectionResult(default, error=str(e))
+
+
+async def fan_out(
+    sections: Mapping[str, Awaitable[Any]],
+    timeout: Union[float, Mapping[str, float], None] = None,
+    default: Any = None,
+) -> Dict[str, SectionResult]:
+    """
+    Chạy đồng thời các awaitable trong `sections`, mỗi cái với timeout riêng
+    (`timeout` là số giây chung hoặc dict theo tên section; None = không giới hạn).
+    Section quá hạn / lỗi trả về `default` kèm timed_out / error thay vì raise.
+    """
+    def budget(name: str) -> Optional[float]:
+        return timeout.get(name) if isinstance(timeout, Mapping) else timeout
+
+    names = list(sections)
+    results = await asyncio.gather(*(_run(n, sections[n], budget(n), default) for n in names))
+    return dict(zip(names, results))
@@ -0,0 +1,48 @@
+"""
+Capped history lists (cooked / viewed) updated atomically on the server
+Each helper returns an update pipeline for update_one, so de-duplication, ordering
+and trimming happen in one write: no read-modify-write, no lost updates between
+devices, and the list itself never travels over the wire.
+"""
+from typing import Any, Dict, List
+
+
+def _current(field: str) -> Dict[str, Any]:
+    return {"$ifNull": [f"${field}", []]}
+
+
+def append_unique_pipeline(field: str, value: Any, max_items: int) -> List[Dict[str, Any]]:
+    """
+    Append `value` at the end (oldest first) unless it is already in the list,
+    keeping the newest `max_items` entries. A repeat leaves the document unmodified.
+    """
+    current = _current(field)
+    literal = {"$literal": value}
+    return [{"$set": {field: {"$cond": [
+        {"$in": [literal, current]},
+        current,
+        {"$slice": [{"$concatArrays": [current, [literal]]}, -max_items]},
+    ]}}}]
+
+
+def move_to_front_pipeline(
+    field: str,
+    entry: Dict[str, Any],
+    same_entry: Dict[str, Any],
+    max_items: int,
+    extra_set: Dict[str, Any] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Put `entry` first (newest first), dropping older entries for which the
+    `same_entry` expression (evaluated on `$$this`) is true, and keep `max_items`.
+    """
+    stage: Dict[str, Any] = {field: {"$slice": [
+        {"$concatArrays": [
+            [{"$literal": entry}],
+            {"$filter": {"input": _current(field), "cond": {"$not": [same_entry]}}},
+        ]},
+        max_items,
+    ]}}
+    for key, value in (extra_set or {}).items():
+        stage[key] = {"$literal": value}
+    return [{"$set": stage}]
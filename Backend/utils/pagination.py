@@ -0,0 +1,85 @@
+"""
+Keyset (cursor) pagination helpers
+A page is fetched with `sort_field, _id` ordering and the next page starts
+strictly after the last document of the previous one, so every page is an
+index seek instead of a growing skip().
+
+Continuation tokens are opaque: base64url(JSON({"f": sort_field, "v": [value, _id]})).
+They come back from the client, so the value must be a scalar and _id an ObjectId.
+"""
+import base64
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId, json_util
+from fastapi import HTTPException
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(sort_field: str, doc: Dict[str, Any]) -> str:
+    value = doc.get(sort_field) if sort_field != "_id" else None
+    raw = json_util.dumps({"f": sort_field, "v": [value, doc["_id"]]})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str, sort_field: str) -> Tuple[Any, Any]:
+    """Return (sort value, _id) of the last item of the previous page"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        data = json_util.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+        if data.get("f") != sort_field:
+            raise ValueError("cursor belongs to another listing")
+        value, last_id = data["v"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Giá trị đi thẳng vào filter: dict/list sẽ thành toán tử query ({"$ne": null}, ...)
+    if isinstance(value, (dict, list)) or not isinstance(last_id, ObjectId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return value, last_id
+
+
+def keyset_filter(sort_field: str, direction: int, value: Any, last_id: Any) -> Dict[str, Any]:
+    """
+    Filter selecting documents that come after (value, last_id) in
+    `sort([(sort_field, direction), ("_id", direction)])` order.
+    Mongo sorts null/missing before every other type, so they come last when descending.
+    """
+    op = "$lt" if direction < 0 else "$gt"
+    if sort_field == "_id":
+        return {"_id": {op: last_id}}
+    if value is None:
+        if direction < 0:
+            return {sort_field: None, "_id": {op: last_id}}
+        return {"$or": [
+            {sort_field: None, "_id": {op: last_id}},
+            {sort_field: {"$ne": None}},
+        ]}
+    clauses: List[Dict[str, Any]] = [
+        {sort_field: {op: value}},
+        {sort_field: value, "_id": {op: last_id}},
+    ]
+    if direction < 0:
+        clauses.append({sort_field: None})
+    return {"$or": clauses}
+
+
+def apply_cursor(query: Dict[str, Any], sort_field: str, direction: int, cursor: Optional[str]) -> Dict[str, Any]:
+    """AND the keyset condition onto an existing query (keeps any top-level $or intact)"""
+    if not cursor:
+        return query
+    value, last_id = decode_cursor(cursor, sort_field)
+    after = keyset_filter(sort_field, direction, value, last_id)
+    return {"$and": [query, after]} if query else after
+
+
+def sort_spec(sort_field: str, direction: int) -> List[Tuple[str, int]]:
+    if sort_field == "_id":
+        return [("_id", direction)]
+    return [(sort_field, direction), ("_id", direction)]
+
+
+def next_cursor(docs: List[Dict[str, Any]], sort_field: str, limit: int) -> Optional[str]:
+    """Token for the next page, or None when this page was the last one"""
+    if not docs or limit <= 0 or len(docs) < limit:
+        return None
+    return encode_cursor(sort_field, docs[-1])
@@ -4,10 +4,12 @@ All recipe-related route handlers consolidated here
 """
 from fastapi import HTTPException
 from models.recipe_model import RecipeIn, RecipeOut
-from database.mongo import recipe_collection, users_collection
+from database.mongo import recipe_collection
 from core.auth.dependencies import extract_user_email
 from bson import ObjectId
-from typing import List
+from typing import List, Optional
+from utils.pagination import apply_cursor, sort_spec, next_cursor, NEXT_CURSOR_HEADER
+from core.search.index import search_fields
 
 
 # ==================== HELPER FUNCTIONS ====================
@@ -53,20 +55,16 @@ def extract_ratings_from_recipe(recipe: dict) -> List[int]:
 
 # ==================== RECIPE HANDLERS ====================
 
-async def create_recipe_handler(recipe: RecipeIn, decoded):
+async def create_recipe_handler(recipe: RecipeIn, user):
     """
     Tạo công thức mới
     """
-    user_email = extract_user_email(decoded)
-    user = await users_collection.find_one({"email": user_email})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     # ✅ Prepare complete recipe data
     recipe_dict = recipe.dict()
     recipe_dict["ratings"] = []
     recipe_dict["average_rating"] = 0.0
     recipe_dict["user_ratings"] = {}  # For new rating system
+    recipe_dict.update(search_fields("recipes", recipe_dict))
 
     result = await recipe_collection.insert_one(recipe_dict)
     if not result.inserted_id:
@@ -81,14 +79,22 @@ async def create_recipe_handler(recipe: RecipeIn, decoded):
     )
 
 
-async def get_all_recipes_handler(skip: int = 0, limit: int = 20):
+async def get_all_recipes_handler(skip: int = 0, limit: int = 20, cursor: Optional[str] = None, response=None):
     """
     Lấy tất cả công thức (public) với pagination
+    Ưu tiên `cursor` (header X-Next-Cursor của trang trước); `skip` giữ để tương thích
     """
     if limit > 100:  # Prevent abuse
         limit = 100
     
-    recipes = await recipe_collection.find().sort("_id", -1).skip(skip).limit(limit).to_list(length=limit)
+    query = apply_cursor({}, "_id", -1, cursor)
+    db_cursor = recipe_collection.find(query).sort(sort_spec("_id", -1))
+    if not cursor and skip:
+        db_cursor = db_cursor.skip(skip)
+    recipes = await db_cursor.limit(limit).to_list(length=limit)
+    token = next_cursor(recipes, "_id", limit)
+    if token and response is not None:
+        response.headers[NEXT_CURSOR_HEADER] = token
     
     return [
         RecipeOut(
@@ -138,15 +144,11 @@ async def get_recipe_handler(recipe_id: str):
     )
 
 
-async def get_recipes_by_user_handler(decoded):
+async def get_recipes_by_user_handler(user):
     """
     Lấy công thức của người dùng hiện tại
     """
-    user_email = extract_user_email(decoded)
-    user = await users_collection.find_one({"email": user_email})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
+    user_email = user.get("email")
     recipes = await recipe_collection.find({"created_by": user_email}).to_list(length=100)
     
     return [
@@ -3,18 +3,23 @@ User Route Handlers - Extracted from routes/user/
 All user-related route handlers consolidated here
 """
 from fastapi import HTTPException, Body
-from core.user_management.service import UserDataService, user_helper
+from core.user_management.service import UserDataService, insert_user, user_helper
 from core.auth.dependencies import extract_user_email, get_user_by_email
+from core.user_management.user_cache import invalidate_user
+from utils.history import move_to_front_pipeline
+from core.hydration import hydrate_dishes, hydrate_users, invalidate_entity
+from core.user_management import notifications, social
+from core.search.index import reindex_document, search
 from models.user_model import UserOut
 from bson import ObjectId
-from typing import Dict, Any, List
+from pymongo.errors import DuplicateKeyError
+from typing import Dict, Any, List, Optional
 from datetime import datetime, timezone
+import asyncio
 
 from database.mongo import (
     users_collection,
     user_social_collection, 
-    user_activity_collection,
-    user_notifications_collection,
     user_preferences_collection,
     dishes_collection
 )
@@ -39,15 +44,8 @@ async def create_user_handler(decoded):
     if existing_user:
         return user_helper(existing_user)
 
-    # Tạo display_id từ email
+    # Tạo display_id từ email (insert_user thêm hậu tố 1, 2, ... nếu đã có người dùng)
     display_id = email.split('@')[0]
-    
-    # Kiểm tra display_id trùng
-    counter = 1
-    original_display_id = display_id
-    while await users_collection.find_one({"display_id": display_id}):
-        display_id = f"{original_display_id}{counter}"
-        counter += 1
 
     # Tạo user mới
     user_data = {
@@ -61,8 +59,13 @@ async def create_user_handler(decoded):
         "lastLoginAt": datetime.now(timezone.utc),
     }
 
-    result = await users_collection.insert_one(user_data)
-    new_user = await users_collection.find_one({"_id": result.inserted_id})
+    try:
+        new_user = await insert_user(user_data)
+    except DuplicateKeyError:
+        # Cùng email vừa được tạo bởi request đăng nhập song song
+        new_user = await users_collection.find_one({"email": email})
+        if not new_user:
+            raise
     
     # Khởi tạo các collections phụ cho user
     await UserDataService.init_user_data(str(new_user["_id"]))
@@ -100,15 +103,8 @@ async def get_me_handler(decoded):
         name = decoded.get("name", "")
         avatar = decoded.get("picture", "")
         
-        # Tạo display_id từ email
+        # Tạo display_id từ email (insert_user thêm hậu tố 1, 2, ... nếu đã có người dùng)
         display_id = email.split('@')[0] if email else f"user_{uid[:8]}"
-        
-        # Kiểm tra display_id trùng - async call
-        counter = 1
-        original_display_id = display_id
-        while await users_collection.find_one({"display_id": display_id}):
-            display_id = f"{original_display_id}{counter}"
-            counter += 1
 
         # Tạo user mới
         user_data = {
@@ -123,8 +119,13 @@ async def get_me_handler(decoded):
         }
 
         # async call
-        result = await users_collection.insert_one(user_data)
-        user = await users_collection.find_one({"_id": result.inserted_id})
+        try:
+            user = await insert_user(user_data)
+        except DuplicateKeyError:
+            # Cùng email vừa được tạo bởi request đăng nhập song song
+            user = await users_collection.find_one({"email": email})
+            if not user:
+                raise
         
         # Khởi tạo các collections phụ cho user mới - async call
         await UserDataService.init_user_data(str(user["_id"]))
@@ -136,15 +137,10 @@ async def get_me_handler(decoded):
         )
     
     return user_helper(user)
-async def update_me_handler(user_update: dict, decoded):
+async def update_me_handler(user_update: dict, user, uid: Optional[str] = None):
     """
     Cập nhật thông tin cá nhân
     """
-    email = extract_user_email(decoded)
-    user = await users_collection.find_one({"email": email})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     # Loại bỏ các field không được phép edit
     user_update.pop("email", None)
     user_update.pop("hashed_password", None)
@@ -156,79 +152,126 @@ async def update_me_handler(user_update: dict, decoded):
         if existing and existing["_id"] != user["_id"]:
             raise HTTPException(status_code=400, detail="Display ID already taken")
     
-    await users_collection.update_one(
-        {"_id": user["_id"]},
-        {"$set": user_update}
-    )
+    # Kiểm tra trên chỉ là fast path: 2 request đổi sang cùng display_id vẫn chạm unique index
+    try:
+        await users_collection.update_one(
+            {"_id": user["_id"]},
+            {"$set": user_update}
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Display ID already taken")
+    invalidate_user(uid or user.get("firebase_uid"))
+    invalidate_entity("user", str(user["_id"]))
+    if "display_id" in user_update or "name" in user_update:
+        await reindex_document("users", user["_id"])
     updated_user = await users_collection.find_one({"_id": user["_id"]})
     return user_helper(updated_user)
 
 
-async def search_users_handler(q: str, decoded):
+async def search_users_handler(q: str, current_user):
     """
-    Tìm kiếm người dùng theo display_id
+    Tìm kiếm người dùng theo display_id / tên (token index, không phân biệt dấu)
     """
-    email = extract_user_email(decoded)
-    current_user = await users_collection.find_one({"email": email})
-    
-    query = {
-        "display_id": {"$regex": q, "$options": "i"},
-        "_id": {"$ne": current_user["_id"]}  
-    }
-    users = await users_collection.find(query).to_list(length=20)
+    users = await search(
+        "users", q, 20,
+        projection={"display_id": 1, "name": 1, "avatar": 1, "email": 1, "bio": 1, "createdAt": 1, "lastLoginAt": 1},
+        extra_filter={"_id": {"$ne": current_user["_id"]}},
+    )
     return [user_helper(u) for u in users]
 
 
 # ==================== SOCIAL HANDLERS ====================
 
-async def get_my_social_handler(decoded):
+# Số followers/following kèm theo /me/social
+SOCIAL_PREVIEW_LIMIT = 20
+
+async def get_my_social_handler(user, preview: int = SOCIAL_PREVIEW_LIMIT):
     """
-    Lấy thông tin social của user hiện tại
+    Lấy thông tin social của user hiện tại: counters + trang đầu followers/following
+    (xem các route /{user_id}/followers, /{user_id}/following để phân trang tiếp)
     """
-    email = extract_user_email(decoded)
-    user = await users_collection.find_one({"email": email})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    social_data = await UserDataService.get_user_social(str(user["_id"]))
-    return social_data.dict() if social_data else {
-        "followers": [], "following": [], "follower_count": 0, "following_count": 0
+    user_id = str(user["_id"])
+    counters, followers, following = await asyncio.gather(
+        social.get_counters(user_id),
+        social.list_followers(user_id, preview),
+        social.list_following(user_id, preview),
+    )
+    return {
+        "user_id": user_id,
+        **counters,
+        "followers": [e["user_id"] for e in followers["items"]],
+        "following": [e["user_id"] for e in following["items"]],
+        "followers_next_cursor": followers["next_cursor"],
+        "following_next_cursor": following["next_cursor"],
     }
 
 
-async def follow_user_handler(user_id: str, decoded):
+async def follow_user_handler(user_id: str, current_user):
     """
     Theo dõi người dùng khác
     """
     if not ObjectId.is_valid(user_id):
         raise HTTPException(status_code=400, detail="Invalid user ID")
 
-    email = extract_user_email(decoded)
-    user_to_follow = await users_collection.find_one({"_id": ObjectId(user_id)})
-    current_user = await users_collection.find_one({"email": email})
+    user_to_follow = await users_collection.find_one({"_id": ObjectId(user_id)}, {"display_id": 1})
 
-    if not user_to_follow or not current_user:
+    if not user_to_follow:
         raise HTTPException(status_code=404, detail="User not found")
 
     if current_user["_id"] == user_to_follow["_id"]:
         raise HTTPException(status_code=400, detail="You cannot follow yourself")
     
-    result = await UserDataService.follow_user(str(current_user["_id"]), user_id)   
+    result = await UserDataService.follow_user(str(current_user["_id"]), user_id)
+    if result["follower_count"] is None:
+        return {"msg": f"You are already following {user_to_follow['display_id']}"}
  
-    # Gửi thông báo milestone nếu cần
-    social_data = await UserDataService.get_user_social(user_id)
-    if social_data and social_data.follower_count % 5 == 0:
-        # TODO: Implement milestone notification
-        pass
-    
+    # Gửi thông báo milestone nếu cần (follower_count là giá trị ngay sau $inc)
+    await social.notify_follower_milestone(user_id, result["follower_count"])
+
     return {"msg": f"You are now following {user_to_follow['display_id']}"}
 
 
+async def unfollow_user_handler(user_id: str, current_user):
+    """
+    Bỏ theo dõi người dùng
+    """
+    if not ObjectId.is_valid(user_id):
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+
+    return await UserDataService.unfollow_user(str(current_user["_id"]), user_id)
+
+
+async def _hydrated_follow_page(page: Dict[str, Any]) -> Dict[str, Any]:
+    users = await hydrate_users(e["user_id"] for e in page["items"])
+    items = []
+    for e in page["items"]:
+        summary = users.get(e["user_id"])
+        if summary:
+            items.append({**summary, "followed_at": e["followed_at"]})
+    return {"items": items, "count": len(items), "next_cursor": page["next_cursor"]}
+
+
+async def get_followers_handler(user_id: str, limit: int, cursor: Optional[str]):
+    """
+    Danh sách người theo dõi user_id (mới nhất trước, phân trang bằng cursor)
+    """
+    return await _hydrated_follow_page(await social.list_followers(user_id, limit, cursor))
+
+
+async def get_following_handler(user_id: str, limit: int, cursor: Optional[str]):
+    """
+    Danh sách người mà user_id đang theo dõi (mới nhất trước, phân trang bằng cursor)
+    """
+    return await _hydrated_follow_page(await social.list_following(user_id, limit, cursor))
+
+
 async def get_user_dishes_handler(user_id: str):
     """
     Xem danh sách món ăn đã tạo của người dùng khác
     """
-    dishes = await dishes_collection.find({"creator_id": user_id}).to_list(length=20)
+    from core.dish_management.ownership import is_backfill_complete
+    owner_query = {"owner_id": user_id} if await is_backfill_complete() else {"creator_id": user_id}
+    dishes = await dishes_collection.find(owner_query, {"search_tokens": 0, "search_words": 0, "ingredient_keys": 0}).to_list(length=20)
     return dishes
 
 
@@ -236,15 +279,10 @@ async def get_user_dishes_handler(user_id: str):
 
 MAX_HISTORY = 50
 
-async def get_my_activity_handler(decoded):
+async def get_my_activity_handler(user):
     """
     Lấy activity history của user hiện tại
     """
-    email = extract_user_email(decoded)
-    user = await users_collection.find_one({"email": email})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     activity_data = await UserDataService.get_user_activity(str(user["_id"]))
     return activity_data.dict() if activity_data else {
         "favorite_dishes": [], "cooked_dishes": [], "viewed_dishes": [], 
@@ -252,20 +290,15 @@ async def get_my_activity_handler(decoded):
     }
 
 
-async def add_cooked_dish_handler(dish_id: str, decoded):
+async def add_cooked_dish_handler(dish_id: str, user):
     """
     Thêm món vào lịch sử đã nấu
     """
-    email = extract_user_email(decoded)
-    user = await users_collection.find_one({"email": email})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     result = await UserDataService.add_to_cooked(str(user["_id"]), dish_id, MAX_HISTORY)
     return result
 
 
-async def add_viewed_dish_handler(dish_id: str, decoded):
+async def add_viewed_dish_handler(dish_id: str, user, uid: Optional[str] = None):
     """
     Thêm món vào lịch sử đã xem
     """
@@ -274,69 +307,47 @@ async def add_viewed_dish_handler(dish_id: str, decoded):
         raise HTTPException(status_code=400, detail="Invalid dish ID")
     
 
-    dish = await dishes_collection.find_one({"_id": ObjectId(dish_id)})
+    dish = await dishes_collection.find_one({"_id": ObjectId(dish_id)}, {"_id": 1})
     if not dish:
         raise HTTPException(status_code=404, detail="Dish not found")
     
-    email = extract_user_email(decoded)
-    user = await users_collection.find_one({"email": email})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
 
     viewed_dish = {
         "dish_id": dish_id,
         "viewed_at": datetime.utcnow()
     }
     
+    # Xóa entry cũ nếu có, thêm vào đầu list, giữ tối đa 50 items - 1 update
     await users_collection.update_one(
         {"_id": user["_id"]},
-        {
-            "$pull": {"viewed_dishes": {"dish_id": dish_id}},  # Xóa cũ nếu có
-        }
-    )
-    
-    await users_collection.update_one(
-        {"_id": user["_id"]},
-        {
-            "$push": {
-                "viewed_dishes": {
-                    "$each": [viewed_dish],
-                    "$position": 0,  # Thêm vào đầu list
-                    "$slice": 50     # Giữ tối đa 50 items
-                }
-            }
-        },
-        upsert=True
+        move_to_front_pipeline(
+            "viewed_dishes", viewed_dish, {"$eq": ["$$this.dish_id", dish_id]}, MAX_HISTORY
+        )
     )
+    invalidate_user(uid or user.get("firebase_uid"))
     
     return {"message": "Dish added to view history", "dish_id": dish_id}
 
 # Trong user_handlers.py (handler function)
-async def get_viewed_dishes_handler(limit: int, decoded):
+async def get_viewed_dishes_handler(limit: int, user):
     """
     Lấy lịch sử món đã xem
     """
     try:
-        email = extract_user_email(decoded)
-        user = await users_collection.find_one({"email": email})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
         viewed_dishes = user.get("viewed_dishes", [])[:limit]
         
-        # Lấy thông tin chi tiết của các món đã xem
+        # Lấy thông tin các món đã xem: 1 query $in (có cache), không kèm image_b64
+        dishes = await hydrate_dishes(item["dish_id"] for item in viewed_dishes)
         dish_details = []
         for item in viewed_dishes:
-            dish = await dishes_collection.find_one({"_id": ObjectId(item["dish_id"])})
+            dish = dishes.get(item["dish_id"])
             if dish:
                 dish_details.append({
-                    "id": str(dish["_id"]),
-                    "name": dish.get("name", ""),
-                    "image_b64": dish.get("image_b64"),
-                    "image_mime": dish.get("image_mime"),
-                    "cooking_time": dish.get("cooking_time", 0),
-                    "average_rating": dish.get("average_rating", 0.0),
+                    "id": dish["id"],
+                    "name": dish["name"],
+                    "image_url": dish["image_url"],
+                    "cooking_time": dish["cooking_time"],
+                    "average_rating": dish["average_rating"],
                     "viewed_at": item["viewed_at"]
                 })
         
@@ -350,63 +361,49 @@ async def get_viewed_dishes_handler(limit: int, decoded):
 
 async def notify_favorite_handler(dish_id: str):
     """
-    Gửi thông báo khi có người thả tim món ăn 
+    Deprecated: thông báo milestone thả tim giờ được gửi ngay trong toggle-favorite /
+    add_to_favorites (dựa trên favorite_count sau khi $inc). Endpoint giữ lại cho client cũ,
+    không gửi gì, chỉ đọc counter.
     """
-    dish = await dishes_collection.find_one({"_id": ObjectId(dish_id)})
+    if not ObjectId.is_valid(dish_id):
+        raise HTTPException(status_code=400, detail="Invalid dish ID")
+    dish = await dishes_collection.find_one({"_id": ObjectId(dish_id)}, {"favorite_count": 1})
     if not dish:
         raise HTTPException(status_code=404, detail="Dish not found")
     
-    creator_id = dish.get("creator_id")
-    if not creator_id:
-        return {"msg": "No creator for this dish"}
-    
-    # ✅ OPTIMIZED: Count favorites efficiently using aggregation
-    favorite_count = await user_activity_collection.count_documents({
-        "favorite_dishes": dish_id
-    })
-    
-    # Gửi thông báo milestone
-    if favorite_count > 0 and favorite_count % 5 == 0:
-        await user_notifications_collection.update_one(
-            {"user_id": creator_id},
-            {
-                "$push": {"notifications": {
-                    "type": "milestone",
-                    "message": f"Món ăn '{dish['name']}' của bạn đã nhận được {favorite_count} lượt thả tim!",
-                    "created_at": "now",
-                    "read": False
-                }},
-                "$inc": {"unread_count": 1}
-            },
-            upsert=True
-        )
-    return {"msg": "Notification sent if milestone reached"}
+    return {
+        "msg": "Deprecated: milestone notifications are sent when the dish is favorited; nothing was sent",
+        "favorite_count": int(dish.get("favorite_count") or 0),
+    }
 
 
 # ==================== PREFERENCES HANDLERS ====================
 
-async def get_my_notifications_handler(decoded):
+async def get_my_notifications_handler(user, limit: int = 20, cursor: Optional[str] = None, unread_only: bool = False):
     """
-    Lấy thông báo của user hiện tại
+    Lấy thông báo của user hiện tại (mới nhất trước, phân trang bằng cursor)
     """
-    email = extract_user_email(decoded)
-    user = await users_collection.find_one({"email": email})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    notif_data = await UserDataService.get_user_notifications(str(user["_id"]))
-    return notif_data.dict() if notif_data else {"notifications": [], "unread_count": 0}
+    return await notifications.list_notifications(str(user["_id"]), limit, cursor, unread_only)
 
 
-async def set_reminders_handler(reminders: List[str], decoded):
+async def get_unread_count_handler(user):
     """
-    Đặt thời gian nhắc nhở
+    Số thông báo chưa đọc (endpoint nhẹ cho client poll)
     """
-    email = extract_user_email(decoded)
-    user = await users_collection.find_one({"email": email})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    return {"unread_count": await notifications.unread_count(str(user["_id"]))}
+
+
+async def mark_notifications_read_handler(user, ids: Optional[List[str]] = None):
+    """
+    Đánh dấu đã đọc các thông báo trong ids, hoặc tất cả nếu không truyền ids
+    """
+    return await notifications.mark_read(str(user["_id"]), ids)
+
 
+async def set_reminders_handler(reminders: List[str], user):
+    """
+    Đặt thời gian nhắc nhở
+    """
     await user_preferences_collection.update_one(
         {"user_id": str(user["_id"])},
         {"$set": {"reminders": reminders}},
@@ -415,42 +412,27 @@ async def set_reminders_handler(reminders: List[str], decoded):
     return {"msg": "Reminders set successfully"}
 
 
-async def get_reminders_handler(decoded):
+async def get_reminders_handler(user):
     """
     Lấy danh sách thời gian nhắc nhở
     """
-    email = extract_user_email(decoded)
-    user = await users_collection.find_one({"email": email})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     preferences = await user_preferences_collection.find_one({"user_id": str(user["_id"])})
     return preferences.get("reminders", []) if preferences else []
 
-async def get_my_favorites_handler(decoded):
+async def get_my_favorites_handler(user):
     """
     Trả về danh sách món ăn yêu thích của user hiện tại.
     """
-    user_email = decoded.get("email")
-    user = await users_collection.find_one({"email": user_email})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
     favorite_ids = user.get("favorite_dishes", [])
     if not isinstance(favorite_ids, list):
         favorite_ids = []
 
+    # Giữ thứ tự favorite_dishes; món đã bị xóa thì bỏ qua
+    hydrated = await hydrate_dishes(did for did in favorite_ids if isinstance(did, str))
     dishes = []
-    if favorite_ids:
-        try:
-            object_ids = [ObjectId(did) for did in favorite_ids if ObjectId.is_valid(did)]
-        except Exception:
-            raise HTTPException(status_code=400, detail="Invalid dish ID format")
-
-        cursor = dishes_collection.find({"_id": {"$in": object_ids}})
-        async for dish in cursor:
-            dish["id"] = str(dish["_id"])
-            dish["_id"] = str(dish["_id"])
-            dishes.append(dish)
+    for did in favorite_ids:
+        dish = hydrated.get(did)
+        if dish:
+            dishes.append({**dish, "_id": dish["id"]})
 
     return dishes